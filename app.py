@@ -1,9 +1,14 @@
 """ This module is the main entry point for the Flask app """
+import hashlib
+import math
+import multiprocessing
 import os
-from datetime import timedelta
+import time
+from datetime import datetime, timedelta, timezone
 
 from flask import (
     Flask,
+    g,
     jsonify,
     render_template,
     request,
@@ -11,14 +16,19 @@ from flask import (
     url_for,
     session,
     flash,
-    send_from_directory,
     abort,
+    get_flashed_messages,
+    make_response,
+    stream_template,
 )
 from flask_jwt_extended import JWTManager
-from werkzeug.security import generate_password_hash
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
 
 from src.constants import (
     DATABASE_PATH,
+    DATABASE_POOL_SIZE,
+    WAITRESS_THREADS,
     USER_ID,
     USERNAME,
     PASSWORD,
@@ -26,6 +36,7 @@ from src.constants import (
     IMAGE_EXT,
     CONTENT,
     DATE,
+    IMAGE_VARIANTS,
     GET,
     PUT,
     POST,
@@ -34,8 +45,20 @@ from src.constants import (
     OPTIONS,
 )
 from src.auth_controller import AuthController
-from src.post_controller import PostController
-from src.database_access_layer import Database
+from src.post_controller import PostController, encode_cursor, encode_search_cursor
+from src.database_access_layer import (
+    Database,
+    ConnectionPool,
+    enable_profiling,
+    profiling_enabled,
+    start_profile,
+    stop_profile,
+)
+from src.image_index import get_image_index
+from src.image_queue import get_queue_depth, variant_filename
+from src.password_hasher import HasherBusy, get_hasher, hash_password
+from src.rate_limiter import check_limits
+from src import metrics
 
 APP_DIR = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_DIR = os.path.join(APP_DIR, "images")
@@ -50,54 +73,183 @@ app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=12)
 
 os.makedirs(os.path.join(APP_DIR, "images"), exist_ok=True)
 
+# answers serve_image lookups without a stat per request
+image_index = get_image_index(UPLOAD_DIR)
+# a year, the longest max-age caches are expected to honour
+IMAGE_MAX_AGE = 31536000
+
 jwt = JWTManager(app)
 
+# SQL_PROFILE=1 times every statement, logs the ones slower than SLOW_QUERY_MS and adds
+# a per request summary to the response. It has to be on before the pools connect.
+if os.environ.get("SQL_PROFILE"):
+    enable_profiling(float(os.environ.get("SLOW_QUERY_MS", "100")) / 1000)
+
+# the password hashing processes are forked before anything below can start a thread,
+# the writer and image workers included. A spawned child re-importing this module skips it.
+if multiprocessing.parent_process() is None:
+    get_hasher().start()
+
+# One pool per process, connections are checked out per request in get_db(). The read
+# write pool is created first so the schema exists before the read only pool opens.
+# DATABASE_PATH in the environment points the app at another file, the tests use test.db
+DATABASE_FILE = os.environ.get("DATABASE_PATH") or DATABASE_PATH
+db_pool = ConnectionPool(DATABASE_FILE, DATABASE_POOL_SIZE)
+read_pool = ConnectionPool(DATABASE_FILE, DATABASE_POOL_SIZE, read_only=True)
+
+# requests with these methods only ever read, so they get a read only connection
+READ_ONLY_METHODS = (GET, "HEAD")
+
+# columns the JSON API can return, ?fields= picks a subset
+API_FIELDS = (POST_ID, USER_ID, USERNAME, CONTENT, DATE, IMAGE_EXT)
+API_PAGE_SIZE = 20
+# a larger ?limit= is cut down to this rather than refused
+API_MAX_PAGE_SIZE = 100
 
-def _unwrap(v):
-    return v[0] if isinstance(v, tuple) and len(v) == 1 else v
+# part of every page ETag, a restart (and so a deploy with changed templates) never
+# answers with a 304 for a page rendered by the old code
+PAGE_VERSION = os.environ.get("PAGE_VERSION") or str(time.time_ns())
 
 
-def _unwrap_sql_value(v):
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
     """
-    Unwraps a SQL value that may be wrapped in a tuple
-    Args:
-    v: The value to unwrap
-    Returns:
-    The unwrapped value
+    Turns a full password hashing pool into a quick 503 rather than a request thread
+    waiting behind everyone else's logins
+    Returns:    503 response asking the client to retry shortly
     """
-    if isinstance(v, tuple) and len(v) == 1:
-        return v[0]
-    return v
+    response = make_response("Server busy, please try again shortly", 503)
+    response.retry_after = 1
+    return response
 
 
-def _normalise_user(user: dict | None) -> dict | None:
+def rate_limit(*buckets: tuple[str, str]):
     """
-    Normalises a user dictionary by unwrapping any SQL values
+    Takes a token from each (limit name, key) bucket, called before any database or
+    password work so a flood of requests is turned away cheaply
     Args:
-    user: The user dictionary to normalise
-    Returns:
-    The normalised user dictionary
+        buckets: (limit name, key) pairs, see LIMITS in src/rate_limiter.py
+    Returns:    A 429 response if any bucket is empty, None to go ahead
     """
-    if not user:
+    wait = check_limits(*buckets)
+    if not wait:
         return None
-    if USER_ID in user:
-        user[USER_ID] = _unwrap_sql_value(user[USER_ID])
-    if PASSWORD in user:
-        user[PASSWORD] = _unwrap_sql_value(user[PASSWORD])
-    if USERNAME in user:
-        user[USERNAME] = _unwrap_sql_value(user[USERNAME])
-    return user
+    response = make_response("Too many requests, please slow down", 429)
+    response.retry_after = math.ceil(wait)
+    return response
 
 
-def _normalise_post(post: dict | None) -> dict | None:
-    """Normalises a post dictionary by unwrapping any SQL values
-    Args:    post: The post dictionary to normalise
-    Returns:    The normalised post dictionary
+def get_db() -> Database:
+    """
+    Gets the Database for the current request, checking a connection out of the pool the
+    first time it is called. GET requests get a read only connection that skips the writer
+    entirely. The connection is returned to the pool when the app context is torn down.
+    Returns:    The pooled Database for this request
     """
-    for k in (POST_ID, USER_ID, IMAGE_EXT, CONTENT, DATE):
-        if k in post:
-            post[k] = _unwrap_sql_value(post[k])
-    return post
+    if "db" not in g:
+        pool = read_pool if request.method in READ_ONLY_METHODS else db_pool
+        g.db = Database(pool=pool)
+    return g.db
+
+
+HTTP_REQUESTS = metrics.Counter(
+    "http_requests_total", "Requests handled, by route", ("route", "method", "status")
+)
+HTTP_REQUEST_SECONDS = metrics.Histogram(
+    "http_request_duration_seconds", "Time to build each response", ("route",)
+)
+IMAGE_QUEUE_DEPTH = metrics.Gauge("image_queue_depth", "Image jobs waiting or running")
+CACHE_EVENTS = metrics.Counter(
+    "cache_events_total",
+    "Lookups and evictions per in process cache",
+    ("cache", "event"),
+)
+CACHE_HIT_RATIO = metrics.Gauge(
+    "cache_hit_ratio", "Share of lookups answered by each cache", ("cache",)
+)
+
+
+@app.before_request
+def start_timer():
+    """Notes when the request started, for the latency histogram"""
+    g.request_start = time.perf_counter()
+    if profiling_enabled():
+        start_profile()
+
+
+@app.after_request
+def record_request(response):
+    """
+    Counts the request and observes its latency under its route pattern, so the number
+    of series stays fixed however many posts and images there are. A streamed body is
+    still being rendered at this point, so it is recorded once the body has been sent.
+    Args:
+        response: The response about to be sent
+    Returns:    The response, unchanged
+    """
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    method, path, status = request.method, request.path, response.status_code
+    start = g.get("request_start")
+    profiling = profiling_enabled()
+
+    if response.is_streamed:
+        # the feed query and the template render both run as the body is sent
+        response.call_on_close(
+            lambda: finish_request(
+                route,
+                method,
+                path,
+                status,
+                start,
+                stop_profile() if profiling else None,
+            )
+        )
+        return response
+
+    profile = stop_profile() if profiling else None
+    if profile is not None:
+        # queries are the timed calls, statements everything the connections traced
+        # while running them, including writes on the writer's connection
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={profile.total_seconds * 1000:.1f};desc="{profile.count} queries, '
+            f'{profile.traced} statements"',
+        )
+    finish_request(route, method, path, status, start, profile)
+    return response
+
+
+def finish_request(route: str, method: str, path: str, status: int, start, profile):
+    """
+    Records a finished request in the metrics, and logs its SQL summary when profiling
+    Args:
+        start: perf_counter() when the request started, None if it was never noted
+        profile: The request's QueryProfile, None when not profiling
+    """
+    HTTP_REQUESTS.inc(route, method, status)
+    if start is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+    if profile is not None:
+        app.logger.info(
+            "%s %s: %d queries, %d statements, %.1fms in the database",
+            method,
+            path,
+            profile.count,
+            profile.traced,
+            profile.total_seconds * 1000,
+        )
+
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    """
+    Returns the request's pooled connection, if one was checked out
+    Args:
+        exception: The exception that ended the request, if any
+    """
+    db = g.pop("db", None)
+    if db is not None:
+        db.close()
 
 
 def get_current_user_id() -> int | None:
@@ -110,7 +262,8 @@ def get_current_user_id() -> int | None:
 
 def get_current_user(auth: AuthController = None) -> dict | None:
     """
-    Gets the current user from the database using the user ID from the session token
+    Gets the current user using the user ID from the session token, from the user cache
+    when they were looked up recently and from the database otherwise
     Args:
         auth: Optional existing AuthController to reuse (avoids creating new connection)
     Returns:    The current user dictionary, or None if the user is not found or the token is invalid
@@ -119,13 +272,60 @@ def get_current_user(auth: AuthController = None) -> dict | None:
     if uid is None:
         return None
 
-    if auth is not None:
-        user = auth.db.get_user_by_id(uid)
-        return _normalise_user(user)
+    db = auth.db if auth is not None else get_db()
+
+    # most requests come from users that were looked up moments ago
+    user = db.user_cache.get(uid)
+    if user is not None:
+        return user
 
-    with AuthController(DATABASE_PATH) as auth:
-        user = auth.db.get_user_by_id(uid)
-        return _normalise_user(user)
+    generation = db.user_cache.generation
+    user = db.get_user_by_id(uid)
+    if user is not None:
+        db.user_cache.put(user, generation)
+    return user
+
+
+def page_validators(db: Database, *keys) -> tuple[str, datetime]:
+    """
+    Builds the ETag and Last-Modified for a page from the users and posts data versions,
+    which change on every write, plus whatever else the page depends on
+    Args:
+        db: The Database for this request
+        keys: Everything besides the data the page depends on, e.g. the user and cursor
+    Returns:    tuple: (etag, last_modified)
+    """
+    versions = db.get_data_versions()
+    parts = (PAGE_VERSION, versions["users"][0], versions["posts"][0], *keys)
+    etag = hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest()
+    changed_at = max(versions["users"][1], versions["posts"][1])
+    last_modified = datetime.strptime(changed_at, "%Y-%m-%d %H:%M:%S.%f")
+    return etag, last_modified.replace(tzinfo=timezone.utc)
+
+
+def set_validators(response, etag: str, last_modified: datetime):
+    """
+    Adds the ETag and Last-Modified to a page response, browsers keep the page but have to
+    revalidate it on every visit
+    Returns:    The response
+    """
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag: str, last_modified: datetime):
+    """
+    Checks the request's If-None-Match and If-Modified-Since against the page validators
+    Returns:    A 304 response if the client's copy is current, None if the page has to be rendered
+    """
+    if not is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified
+    ):
+        return set_validators(app.response_class(status=304), etag, last_modified)
+    return None
 
 
 @app.route("/", methods=[GET, POST, OPTIONS])
@@ -147,68 +347,243 @@ def home():
             }
         )
 
-    with Database(DATABASE_PATH) as db:
-        with AuthController(db=db) as auth:
-            with PostController(db=db) as posts:
+    if request.method == POST:
+        limited = rate_limit(
+            ("post_ip", request.remote_addr),
+            ("post_user", str(session.get(USER_ID, ""))),
+        )
+        if limited:
+            return limited
 
-                user = get_current_user(auth)
+    db = get_db()
+    with AuthController(db=db) as auth:
+        with PostController(db=db) as posts:
 
-                if request.method == POST:
-                    if not user:
-                        flash("You must be logged in to create a post", "error")
-                        return redirect(url_for("login"))
+            user = get_current_user(auth)
 
-                    content = (request.form.get(CONTENT) or "").strip()
-                    if not content:
-                        flash("Post content cannot be empty", "error")
-                        return redirect(url_for("home"))
+            if request.method == POST:
+                if not user:
+                    flash("You must be logged in to create a post", "error")
+                    return redirect(url_for("login"))
 
-                    post_id = posts.generate_uuid()
-
-                    image_ext = None
-                    file = request.files.get("image")
-                    if file and file.filename:
-                        image_ext = posts.upload_image(file, post_id, UPLOAD_DIR)
-                        if not image_ext:
-                            flash("Invalid image file", "error")
-                            return redirect(url_for("home"))
-
-                    post_obj = {
-                        POST_ID: str(post_id),
-                        USER_ID: str(user[USER_ID]),
-                        CONTENT: content,
-                        IMAGE_EXT: f".{image_ext}" if image_ext else "NONE",
-                    }
+                content = (request.form.get(CONTENT) or "").strip()
+                if not content:
+                    flash("Post content cannot be empty", "error")
+                    return redirect(url_for("home"))
 
-                    print(post_obj[IMAGE_EXT])
-                    print(posts.get_filename(post_obj))
+                post_id = posts.generate_uuid()
 
-                    ok = posts.create_post(post_obj)
-                    if ok:
-                        flash("Post created successfully", "success")
-                    else:
-                        flash("Failed to create post", "error")
-                    return redirect(url_for("home"))
+                image_ext = None
+                file = request.files.get("image")
+                if file and file.filename:
+                    image_ext = posts.upload_image(file, post_id, UPLOAD_DIR)
+                    if not image_ext:
+                        flash("Invalid image file", "error")
+                        return redirect(url_for("home"))
 
-                PAGE_SIZE = 10
-                try:
-                    page = int(request.args.get("page", "1"))
-                except ValueError:
-                    page = 1
-                page = max(page, 1)
+                post_obj = {
+                    POST_ID: str(post_id),
+                    USER_ID: str(user[USER_ID]),
+                    CONTENT: content,
+                    IMAGE_EXT: f".{image_ext}" if image_ext else "NONE",
+                }
 
-                page_posts, has_more = posts.get_posts(page, PAGE_SIZE)
-                page_posts = [_normalise_post(p) for p in page_posts]
+                print(post_obj[IMAGE_EXT])
+                print(posts.get_filename(post_obj))
 
-                return render_template(
+                ok = posts.create_post(post_obj)
+                if ok:
+                    flash("Post created successfully", "success")
+                else:
+                    flash("Failed to create post", "error")
+                return redirect(url_for("home"))
+
+            PAGE_SIZE = 10
+            before = request.args.get("before") or None
+
+            # a page with flash messages is only shown once, it is never cached
+            cacheable = "_flashes" not in session
+            if cacheable:
+                etag, last_modified = page_validators(
+                    db, "home", user and user[USER_ID], before
+                )
+                response = not_modified(etag, last_modified)
+                if response is not None:
+                    return response
+
+            try:
+                page = posts.stream_posts(before, PAGE_SIZE)
+            except ValueError:
+                # a mangled cursor just starts over from the newest posts
+                page = posts.stream_posts(None, PAGE_SIZE)
+
+            # the page streams out as it renders, so the navbar and sidebar are sent
+            # before the posts are read. Flashes are taken now, the session cookie is
+            # written with the headers before any of the template runs.
+            get_flashed_messages()
+            response = make_response(
+                stream_template(
                     "html/home.html",
                     user=user,
-                    posts=page_posts,
+                    posts=page,
                     post_controller=posts,
-                    page=page,
-                    has_more=has_more,
                     max_chars=1024,
                 )
+            )
+            if cacheable:
+                set_validators(response, etag, last_modified)
+            return response
+
+
+@app.route("/search", methods=[GET, OPTIONS])
+def search():
+    """
+    Searches post content for the words in ?q=, best matches first
+    Returns:   template: The search page html template, with a page of matching posts and the current user (if logged in)
+    """
+    if request.method == OPTIONS:
+        return jsonify(
+            {
+                "GET": True,
+                "POST": False,
+                "PATCH": False,
+                "PUT": False,
+                "DELETE": False,
+                "OPTIONS": True,
+            }
+        )
+
+    db = get_db()
+    with AuthController(db=db) as auth:
+        with PostController(db=db) as posts:
+
+            user = get_current_user(auth)
+
+            PAGE_SIZE = 10
+            query = (request.args.get("q") or "").strip()
+            after = request.args.get("after") or None
+            try:
+                page_posts, has_more = posts.search_posts(query, after, PAGE_SIZE)
+            except ValueError:
+                # a mangled cursor just starts over from the best matches
+                page_posts, has_more = posts.search_posts(query, None, PAGE_SIZE)
+
+            next_cursor = encode_search_cursor(page_posts[-1]) if has_more else None
+
+            return render_template(
+                "html/search.html",
+                user=user,
+                query=query,
+                posts=page_posts,
+                post_controller=posts,
+                next_cursor=next_cursor,
+                has_more=has_more,
+            )
+
+
+def api_error(message: str, status: int):
+    """
+    Builds the error body every JSON API failure is answered with
+    Returns:    tuple: (json response, status)
+    """
+    return jsonify({"ok": False, "error": message}), status
+
+
+def api_page_args() -> tuple[tuple, int]:
+    """
+    Reads ?fields= and ?limit= for the JSON API, the limit is clamped to between 1 and
+    API_MAX_PAGE_SIZE
+    Returns:    tuple: (fields to return, page size)
+    Raises:     ValueError: if a field is unknown or the limit is not a number
+    """
+    fields = request.args.get("fields")
+    if fields:
+        fields = tuple(field.strip() for field in fields.split(","))
+        unknown = [field for field in fields if field not in API_FIELDS]
+        if unknown:
+            raise ValueError(f"unknown fields {', '.join(unknown)}")
+    else:
+        fields = API_FIELDS
+
+    limit = request.args.get("limit", API_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError("limit must be a number") from None
+    return fields, min(max(limit, 1), API_MAX_PAGE_SIZE)
+
+
+def api_page(rows: list[dict], has_more: bool, fields: tuple, etag, last_modified):
+    """
+    Builds a JSON API page straight from the feed rows, only the requested fields are
+    copied out
+    Returns:    The JSON response with its validators set
+    """
+    response = jsonify(
+        {
+            "posts": [{field: row[field] for field in fields} for row in rows],
+            "next": encode_cursor(rows[-1]) if has_more else None,
+        }
+    )
+    return set_validators(response, etag, last_modified)
+
+
+@app.route("/api/posts", methods=[GET])
+def api_posts():
+    """
+    The home feed as JSON, newest first. ?before= takes the previous page's next cursor,
+    ?limit= the page size and ?fields= a comma separated subset of API_FIELDS
+    Returns:    json: {"posts": [...], "next": cursor or null}
+    """
+    try:
+        fields, limit = api_page_args()
+    except ValueError as e:
+        return api_error(str(e), 400)
+    before = request.args.get("before") or None
+
+    db = get_db()
+    etag, last_modified = page_validators(db, "api_posts", before, limit, fields)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    with PostController(db=db) as posts:
+        try:
+            page_posts, has_more = posts.get_posts(before, limit)
+        except ValueError:
+            return api_error("invalid cursor", 400)
+    return api_page(page_posts, has_more, fields, etag, last_modified)
+
+
+@app.route("/api/users/<int:user_id>/posts", methods=[GET])
+def api_user_posts(user_id: int):
+    """
+    One user's posts as JSON, newest first, with the same arguments as /api/posts
+    Returns:    json: {"posts": [...], "next": cursor or null}, 404 if there is no such user
+    """
+    try:
+        fields, limit = api_page_args()
+    except ValueError as e:
+        return api_error(str(e), 400)
+    before = request.args.get("before") or None
+
+    db = get_db()
+    etag, last_modified = page_validators(
+        db, "api_user_posts", user_id, before, limit, fields
+    )
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    with PostController(db=db) as posts:
+        try:
+            page_posts, has_more = posts.get_user_posts(user_id, before, limit)
+        except ValueError:
+            return api_error("invalid cursor", 400)
+        # only an empty first page needs telling apart from a user with no posts
+        if not page_posts and before is None and db.get_user_by_id(user_id) is None:
+            return api_error("user not found", 404)
+    return api_page(page_posts, has_more, fields, etag, last_modified)
 
 
 @app.route("/get_image/<filename>")
@@ -224,11 +599,45 @@ def serve_image(filename: str):
     if safe_path.startswith("..") or os.path.isabs(safe_path):
         abort(400)
 
-    full_path = os.path.join(UPLOAD_DIR, safe_path)
-    if not os.path.isfile(full_path):
+    # ?size= asks for one of the IMAGE_VARIANTS derivatives instead of the original
+    size = request.args.get("size")
+    image = None
+    if size in IMAGE_VARIANTS:
+        image = image_index.lookup(variant_filename(safe_path, size))
+    fallback = size is not None and image is None
+    if image is None:
+        image = image_index.lookup(safe_path)
+    if image is None:
         abort(404)
 
-    return send_from_directory(UPLOAD_DIR, safe_path)
+    try:
+        file = open(image.path, "rb")
+    except OSError:
+        # deleted since it was indexed, the next lookup has to stat it again
+        image_index.invalidate(os.path.basename(image.path))
+        abort(404)
+
+    # the file wrapper lets waitress send the file without copying it through Python
+    data = wrap_file(request.environ, file)
+    response = app.response_class(
+        data, mimetype=image.mimetype, direct_passthrough=True
+    )
+    response.content_length = image.size
+    response.accept_ranges = "bytes"
+    response.set_etag(image.etag)
+    response.last_modified = image.last_modified
+    response.cache_control.public = True
+    if fallback:
+        # the derivative is not there yet, clients have to come back for it
+        response.cache_control.no_cache = True
+    else:
+        # image names are never reused so the bytes behind a url never change
+        response.cache_control.max_age = IMAGE_MAX_AGE
+        response.cache_control.immutable = True
+
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=image.size
+    )
 
 
 @app.route("/register", methods=[GET, POST, OPTIONS])
@@ -252,7 +661,12 @@ def register():
             }
         )
 
-    with AuthController(DATABASE_PATH) as auth:
+    if request.method == POST:
+        limited = rate_limit(("register_ip", request.remote_addr))
+        if limited:
+            return limited
+
+    with AuthController(db=get_db()) as auth:
 
         if request.method == POST:
             username = (request.form.get(USERNAME) or "").strip()
@@ -267,9 +681,9 @@ def register():
                 )
                 return redirect(url_for("register"))
 
-            user_id = auth.login(potential_new_user)
-            if user_id:
-                session[USER_ID] = user_id
+            # register already knows the new user_id, logging in again would only
+            # repeat the lookup and the password hash
+            session[USER_ID] = created[USER_ID]
 
             flash("Account created successfully.", "success")
             return redirect(url_for("home"))
@@ -285,7 +699,7 @@ def logout():
         redirect: Redirects to home page for browser requests
         json: JSON response for API requests
     """
-    with AuthController(DATABASE_PATH) as auth:
+    with AuthController(db=get_db()) as auth:
 
         session.pop(USER_ID, None)
         result = auth.logout()
@@ -305,7 +719,17 @@ def login():
     template: The login page html template, with the current user (if logged in)
     """
 
-    with AuthController(DATABASE_PATH) as auth:
+    if request.method == POST:
+        # per address against spraying many accounts, per username against one account
+        # being guessed at from many addresses
+        username = (request.form.get(USERNAME) or "").strip().lower()
+        limited = rate_limit(
+            ("login_ip", request.remote_addr), ("login_user", username)
+        )
+        if limited:
+            return limited
+
+    with AuthController(db=get_db()) as auth:
 
         if request.method == OPTIONS:
             return jsonify(
@@ -348,234 +772,259 @@ def profile():
     template: The profile page html template, with the current user (if logged in) and their posts
     """
 
-    with Database(DATABASE_PATH) as db:
-        with AuthController(db=db) as auth:
-            with PostController(db=db) as posts:
-
-                if request.method == OPTIONS:
-                    return jsonify(
-                        {
-                            "GET": True,
-                            "POST": True,
-                            "PATCH": True,
-                            "PUT": True,
-                            "DELETE": True,
-                            "OPTIONS": True,
-                        }
-                    )
-
-                user = get_current_user(auth)
-                user = _normalise_user(user)
+    db = get_db()
+    with AuthController(db=db) as auth:
+        with PostController(db=db) as posts:
+
+            if request.method == OPTIONS:
+                return jsonify(
+                    {
+                        "GET": True,
+                        "POST": True,
+                        "PATCH": True,
+                        "PUT": True,
+                        "DELETE": True,
+                        "OPTIONS": True,
+                    }
+                )
 
-                data = request.get_json(silent=True) or {}
+            user = get_current_user(auth)
 
-                method = request.method
-                if request.form.get("method"):
+            data = request.get_json(silent=True) or {}
 
-                    override_method = request.form.get("method")
-                    if override_method == "PATCH":
-                        method = PATCH
-                    elif override_method == "PUT":
-                        method = PUT
-                    elif override_method == "DELETE":
-                        method = DELETE
+            method = request.method
+            if request.form.get("method"):
 
-                print(method)
+                override_method = request.form.get("method")
+                if override_method == "PATCH":
+                    method = PATCH
+                elif override_method == "PUT":
+                    method = PUT
+                elif override_method == "DELETE":
+                    method = DELETE
 
-                if not user:
-                    if method == GET:
-                        flash("Please log in first.", "error")
-                        return redirect(url_for("login"))
-                    return jsonify({"ok": False, "error": "unauthorized"}), 401
+            print(method)
 
+            if not user:
                 if method == GET:
-                    my_posts = posts.get_user_posts(str(user[USER_ID]))
+                    flash("Please log in first.", "error")
+                    return redirect(url_for("login"))
+                return jsonify({"ok": False, "error": "unauthorized"}), 401
+
+            if method == GET:
+                cacheable = "_flashes" not in session
+                if cacheable:
+                    etag, last_modified = page_validators(
+                        posts.db, "profile", user[USER_ID]
+                    )
+                    response = not_modified(etag, last_modified)
+                    if response is not None:
+                        return response
+
+                my_posts, _ = posts.get_user_posts(str(user[USER_ID]))
 
-                    return render_template(
+                response = make_response(
+                    render_template(
                         "html/profile.html",
                         user=user,
                         posts=my_posts,
+                        post_count=posts.db.get_user_post_count(user[USER_ID]),
                         post_controller=posts,
                     )
+                )
+                if cacheable:
+                    set_validators(response, etag, last_modified)
+                return response
 
-                if method == POST:
-                    action = request.form.get("action")
-
-                    if action == "logout":
-                        session.pop(USER_ID, None)
-                        flash("Logged out.", "success")
+            if method == POST:
+                action = request.form.get("action")
 
-                        return redirect(url_for("home"))
+                if action == "logout":
+                    session.pop(USER_ID, None)
+                    flash("Logged out.", "success")
 
-                    if action == "delete_post":
-                        date = request.form.get(DATE)
-                        if not date:
-                            flash("Missing post date.", "error")
-                            return redirect(url_for("profile"))
+                    return redirect(url_for("home"))
 
-                        ok = posts.delete_post(str(user[USER_ID]), date)
-                        flash(
-                            "Post deleted." if ok else "Failed to delete post.",
-                            "success" if ok else "error",
-                        )
+                if action == "delete_post":
+                    date = request.form.get(DATE)
+                    if not date:
+                        flash("Missing post date.", "error")
                         return redirect(url_for("profile"))
 
-                    flash("Unknown action.", "error")
+                    ok = posts.delete_post(str(user[USER_ID]), date)
+                    flash(
+                        "Post deleted." if ok else "Failed to delete post.",
+                        "success" if ok else "error",
+                    )
                     return redirect(url_for("profile"))
 
-                if method == PATCH:
+                flash("Unknown action.", "error")
+                return redirect(url_for("profile"))
 
-                    action = request.form.get("action")
-                    print(action)
+            if method == PATCH:
 
-                    if action == "edit_post":
+                action = request.form.get("action")
+                print(action)
 
-                        date = request.form.get(DATE)
-                        post_id = request.form.get(POST_ID)
+                if action == "edit_post":
 
-                        old_post = posts.get_post_by_id(post_id)
+                    date = request.form.get(DATE)
+                    post_id = request.form.get(POST_ID)
 
-                        edited_post = old_post.copy()
-                        edited_post[CONTENT] = request.form.get(CONTENT)
+                    old_post = posts.get_post_by_id(post_id)
 
-                        posts.edit_post(old_post, edited_post, old_post[USER_ID])
+                    edited_post = old_post.copy()
+                    edited_post[CONTENT] = request.form.get(CONTENT)
 
-                        print("edit")
+                    posts.edit_post(old_post, edited_post, old_post[USER_ID])
 
-                        return redirect(url_for("profile"))
+                    print("edit")
 
-                    req_type = (data.get("type") or "user").lower()
-
-                    if req_type == "user":
-                        new_username = request.form.get(USERNAME)
-                        new_password = request.form.get(PASSWORD)
-
-                        if not new_username and not new_password:
-                            return (
-                                jsonify(
-                                    {
-                                        "ok": False,
-                                        "error": "PATCH user requires username and/or password",
-                                    }
-                                ),
-                                400,
-                            )
-
-                        edited = {
-                            USER_ID: int(user[USER_ID]),
-                            USERNAME: new_username if new_username else user[USERNAME],
-                            PASSWORD: generate_password_hash(new_password)
-                            if new_password
-                            else _unwrap(user[PASSWORD]),
-                        }
-
-                        ok = auth.db.update_user(user, edited)
-                        return jsonify({"ok": ok, "updated": "user"}), (
-                            200 if ok else 400
-                        )
+                    return redirect(url_for("profile"))
+
+                req_type = (data.get("type") or "user").lower()
+
+                if req_type == "user":
+                    new_username = request.form.get(USERNAME)
+                    new_password = request.form.get(PASSWORD)
 
-                    if req_type == POST:
-                        post_id = data.get(POST_ID)
-                        if post_id is None:
-                            return (
-                                jsonify(
-                                    {
-                                        "ok": False,
-                                        "error": "PATCH post requires post_id",
-                                    }
-                                ),
-                                400,
-                            )
-
-                        old_post = posts.get_post_by_id(int(post_id))
-                        if not old_post:
-                            return (
-                                jsonify({"ok": False, "error": "post not found"}),
-                                404,
-                            )
-
-                        new_content = data.get(CONTENT)
-                        new_image_ext = data.get(IMAGE_EXT)
-
-                        if not new_content and not new_image_ext:
-                            return (
-                                jsonify(
-                                    {
-                                        "ok": False,
-                                        "error": "PATCH post requires content and/or image_ext",
-                                    }
-                                ),
-                                400,
-                            )
-
-                        author = _unwrap(old_post.get(USER_ID))
-                        if str(author) != str(user[USER_ID]):
-                            return jsonify({"ok": False, "error": "forbidden"}), 403
-
-                        edited_post = old_post.copy()
-                        edited_post[CONTENT] = new_content
-                        edited_post[IMAGE_EXT] = new_image_ext
-
-                        posts.edit_post(old_post, edited_post, old_post[USER_ID])
-                        return jsonify({"ok": True, "updated": POST}), 200
-
-                    return jsonify({"ok": False, "error": "unknown type"}), 400
-
-                if method == PUT:
-                    new_username = (
-                        request.form.get(USERNAME) or user[USERNAME]
-                    ).strip()
-                    new_password = request.form.get(PASSWORD) or user[PASSWORD]
-
-                    if not new_username or not new_password:
+                    if not new_username and not new_password:
                         return (
                             jsonify(
                                 {
                                     "ok": False,
-                                    "error": "PUT user requires username and password",
+                                    "error": "PATCH user requires username and/or password",
                                 }
                             ),
                             400,
                         )
 
                     edited = {
-                        USER_ID: (user[USER_ID]),
-                        USERNAME: new_username,
-                        PASSWORD: generate_password_hash(new_password),
+                        USER_ID: int(user[USER_ID]),
+                        USERNAME: new_username if new_username else user[USERNAME],
+                        PASSWORD: hash_password(new_password)
+                        if new_password
+                        else user[PASSWORD],
                     }
 
                     ok = auth.db.update_user(user, edited)
-                    flash("Account information changed successfully", "success")
-                    return redirect(url_for("profile"))
+                    return jsonify({"ok": ok, "updated": "user"}), (200 if ok else 400)
+
+                if req_type == POST:
+                    post_id = data.get(POST_ID)
+                    if post_id is None:
+                        return (
+                            jsonify(
+                                {
+                                    "ok": False,
+                                    "error": "PATCH post requires post_id",
+                                }
+                            ),
+                            400,
+                        )
+
+                    old_post = posts.get_post_by_id(int(post_id))
+                    if not old_post:
+                        return (
+                            jsonify({"ok": False, "error": "post not found"}),
+                            404,
+                        )
 
-                if method == DELETE:
-                    req_type = (data.get("type") or "user").lower()
-
-                    if req_type == POST:
-                        date = data.get(DATE)
-                        if not date:
-                            return (
-                                jsonify(
-                                    {"ok": False, "error": "DELETE post requires date"}
-                                ),
-                                400,
-                            )
-
-                        ok = posts.delete_post(str(user[USER_ID]), date)
-                        return jsonify({"ok": ok, "deleted": POST}), (
-                            200 if ok else 400
+                    new_content = data.get(CONTENT)
+                    new_image_ext = data.get(IMAGE_EXT)
+
+                    if not new_content and not new_image_ext:
+                        return (
+                            jsonify(
+                                {
+                                    "ok": False,
+                                    "error": "PATCH post requires content and/or image_ext",
+                                }
+                            ),
+                            400,
                         )
 
-                    if req_type == "user":
-                        db.delete_user_posts(user[USER_ID])
-                        ok = db.delete_user(str(user[USER_ID]))
-                        if ok:
-                            session.pop(USER_ID, None)
-                        return jsonify({"ok": ok, "deleted": "user"}), (
-                            200 if ok else 400
+                    author = old_post.get(USER_ID)
+                    if str(author) != str(user[USER_ID]):
+                        return jsonify({"ok": False, "error": "forbidden"}), 403
+
+                    edited_post = old_post.copy()
+                    edited_post[CONTENT] = new_content
+                    edited_post[IMAGE_EXT] = new_image_ext
+
+                    posts.edit_post(old_post, edited_post, old_post[USER_ID])
+                    return jsonify({"ok": True, "updated": POST}), 200
+
+                return jsonify({"ok": False, "error": "unknown type"}), 400
+
+            if method == PUT:
+                new_username = (request.form.get(USERNAME) or user[USERNAME]).strip()
+                new_password = request.form.get(PASSWORD) or user[PASSWORD]
+
+                if not new_username or not new_password:
+                    return (
+                        jsonify(
+                            {
+                                "ok": False,
+                                "error": "PUT user requires username and password",
+                            }
+                        ),
+                        400,
+                    )
+
+                edited = {
+                    USER_ID: (user[USER_ID]),
+                    USERNAME: new_username,
+                    PASSWORD: hash_password(new_password),
+                }
+
+                ok = auth.db.update_user(user, edited)
+                flash("Account information changed successfully", "success")
+                return redirect(url_for("profile"))
+
+            if method == DELETE:
+                req_type = (data.get("type") or "user").lower()
+
+                if req_type == POST:
+                    date = data.get(DATE)
+                    if not date:
+                        return (
+                            jsonify(
+                                {"ok": False, "error": "DELETE post requires date"}
+                            ),
+                            400,
                         )
 
-                    return jsonify({"ok": False, "error": "unknown type"}), 400
+                    ok = posts.delete_post(str(user[USER_ID]), date)
+                    return jsonify({"ok": ok, "deleted": POST}), (200 if ok else 400)
+
+                if req_type == "user":
+                    db.delete_user_posts(user[USER_ID])
+                    ok = db.delete_user(str(user[USER_ID]))
+                    if ok:
+                        session.pop(USER_ID, None)
+                    return jsonify({"ok": ok, "deleted": "user"}), (200 if ok else 400)
+
+                return jsonify({"ok": False, "error": "unknown type"}), 400
+
+
+@app.route("/metrics", methods=[GET])
+def metrics_endpoint():
+    """
+    Exposes the process's metrics in the Prometheus text format, the gauges and cache
+    totals are read just before rendering so a scrape is the only thing that pays for them
+    Returns:    text: every metric
+    """
+    IMAGE_QUEUE_DEPTH.set(get_queue_depth(get_db()))
+    for name, cache in (("feed", db_pool.feed_cache), ("user", db_pool.user_cache)):
+        stats = cache.stats()
+        for event in ("hits", "misses", "evictions"):
+            CACHE_EVENTS.set_total(stats[event], name, event)
+        CACHE_HIT_RATIO.set(stats["hit_rate"], name)
+
+    return app.response_class(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 # I am not sure what to do with this.
@@ -597,21 +1046,28 @@ def health():
                 "OPTIONS": True,
             }
         )
-    return jsonify({"status": "healthy"})
+    return jsonify(
+        {
+            "status": "healthy",
+            "feed_cache": db_pool.feed_cache.stats(),
+            "user_cache": db_pool.user_cache.stats(),
+        }
+    )
 
 
 if __name__ == "__main__":
     from waitress import serve
     from src.image_queue import start_worker
 
-    # Start background image processing worker
-    start_worker()
+    # Start background image processing workers, IMAGE_BACKEND=process moves the
+    # resizing out of the server process
+    start_worker(db_path=DATABASE_FILE)
 
     serve(
         app,
         host="0.0.0.0",
         port=4000,
-        threads=16,  # Up from default 4
+        threads=WAITRESS_THREADS,  # Up from default 4, also bounds the db pool
         connection_limit=200,  # Max concurrent connections
         channel_timeout=120,  # Request timeout in seconds
         recv_bytes=65536,  # Larger receive buffer
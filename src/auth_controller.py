@@ -2,10 +2,10 @@
 
 
 import traceback
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token
 
-from src.database_access_layer import Database
+from src.database_access_layer import Database, ConnectionPool
+from src.password_hasher import PasswordHasher, get_hasher
 from src.constants import *
 
 
@@ -14,10 +14,22 @@ class AuthController:
 
     min_password_length = 8
 
-    def __init__(self, database_path: str = None, db: Database = None):
+    def __init__(
+        self,
+        database_path: str = None,
+        db: Database = None,
+        pool: ConnectionPool = None,
+        hasher: PasswordHasher = None,
+    ):
+        # hashing runs in the shared worker pool, it raises HasherBusy once that is full
+        self.hasher = hasher or get_hasher()
         if db is not None:
             self.db = db
             self._owns_db = False
+        elif pool is not None:
+            # a pooled Database hands its connection back to the pool on close
+            self.db = Database(pool=pool)
+            self._owns_db = True
         else:
             self.db = Database(database_path)
             self._owns_db = True
@@ -36,24 +48,27 @@ class AuthController:
         """
         Registers a new user given the user's information.
         Returns:
-        dict: the validated user information
+        dict: the validated user information, including the new user_id so the caller can
+        start a session without logging in again
         None: when an error occurs or the provided info is invalid
         """
         local_user = user.copy()
+        if len(local_user[PASSWORD]) < self.min_password_length:
+            print("Password too short")
+            return None
         is_taken = self.db.get_user_by_username(local_user.get(USERNAME))
         if is_taken:
             print("Username Taken")
             return None
-        if len(local_user[PASSWORD]) < self.min_password_length:
-            print("Password too short")
-            return None
 
         # Hash the password before storing
         local_user[PASSWORD] = self._hash_password(local_user[PASSWORD])
 
-        if self.db.insert_user(local_user):
-            return local_user
-        return None
+        user_id = self.db.create_user(local_user)
+        if user_id is None:
+            return None
+        local_user[USER_ID] = user_id
+        return local_user
 
     def login(self, user) -> str | None:
         """
@@ -66,12 +81,12 @@ class AuthController:
             (user_password, *_) = user[PASSWORD]
         else:
             user_password = user[PASSWORD]
-        if self._verify_password(user[USERNAME], user_password):
-            # Retrieve full user data from database for token generation
-            user = self.db.get_user_by_username(user[USERNAME])
-            if user:
-                return user[USER_ID]
-        return None
+        # one lookup and one verify, the stored user already holds the user_id
+        stored = self.db.get_user_by_username(user[USERNAME])
+        if stored is None or not self.hasher.verify(stored[PASSWORD], user_password):
+            return None
+        self._rehash_password(stored, user_password)
+        return stored[USER_ID]
 
     def logout(self):
         """
@@ -88,22 +103,19 @@ class AuthController:
         Returns:
         str: the hashed password
         """
-        hashed_password = generate_password_hash(password)
+        hashed_password = self.hasher.hash(password)
         return hashed_password
 
-    def _verify_password(self, username, password) -> bool:
+    def _rehash_password(self, user: dict, password: str) -> None:
         """
-        Talks with the database to verify that the password for the user exists.
-        Looks up the user in the database, pulls the hashed password and
-        compares it to the hash of the given password.
-        Returns:
-        bool: True means that the information matches, false means that it doesn't
+        Stores a new hash of the password if the stored one was made with different hash
+        parameters, so changing them takes effect as users log in. The login goes ahead
+        whether or not this works.
         """
-        user = self.db.get_user_by_username(username)
-        if user is None:
-            return False
-        if type(user["password"]) is tuple:
-            (user_password, *_) = user["password"]
-        else:
-            user_password = user["password"]
-        return check_password_hash(user_password, password)
+        if not self.hasher.needs_rehash(user[PASSWORD]):
+            return
+        try:
+            rehashed = {**user, PASSWORD: self.hasher.hash(password)}
+            self.db.update_user(user, rehashed)
+        except Exception:
+            traceback.print_exc()
@@ -0,0 +1,221 @@
+"""In process caches for hot read paths, invalidated by the Database write methods"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src.constants import *
+
+# feed pages kept per database file, each entry is one page of posts
+FEED_CACHE_SIZE = 256
+
+# logged in users looked up per request, an entry is trusted for USER_CACHE_TTL seconds
+# even if a write slipped past the invalidation, e.g. from another process
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60.0
+
+_feed_caches = {}
+_user_caches = {}
+_caches_lock = threading.Lock()
+
+
+class FeedCache:
+    """
+    Bounded LRU cache of home feed pages keyed by (cursor, page_size).
+
+    Each page remembers the range of (date, post_id) keys it was read from, from the row
+    just past the page (or the start of time on the last page) up to its cursor. A write
+    only drops the pages whose range holds the post it touched, every other page would
+    read back exactly the same rows.
+
+    The cache lives in this process only, writes made by another process (python -m
+    src.manage import for example) are not seen until the app restarts.
+    """
+
+    def __init__(self, max_entries: int = FEED_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidation, a page read from the database before a write
+        # committed must not be stored after it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, before: tuple | None, page_size: int) -> tuple[list, bool] | None:
+        """Returns a copy of the cached (posts, has_more) page, or None on a miss"""
+        key = (before, page_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        posts, has_more = entry[0], entry[1]
+        return [dict(post) for post in posts], has_more
+
+    def put(
+        self,
+        before: tuple | None,
+        page_size: int,
+        rows: list[dict],
+        generation: int,
+    ) -> None:
+        """
+        Stores a page read with page_size + 1 rows, the extra row marks where the page's
+        range ends. Nothing is stored if anything was invalidated since generation.
+        """
+        has_more = len(rows) > page_size
+        posts = [dict(post) for post in rows[:page_size]]
+        low = (
+            (rows[page_size][DATE], str(rows[page_size][POST_ID])) if has_more else None
+        )
+        # the extra row's author matters too, deleting it changes has_more
+        users = {str(post[USER_ID]) for post in rows}
+
+        with self._lock:
+            if generation != self.generation:
+                return
+            key = (before, page_size)
+            self._entries[key] = (posts, has_more, low, before, users)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_post(self, date: str, post_id: str = None) -> None:
+        """
+        Drops the pages whose range holds the post, without a post_id every post on that
+        date is assumed to be touched
+        """
+
+        def covers(entry) -> bool:
+            low, high = entry[2], entry[3]
+            if post_id is None:
+                return (low is None or low[0] <= date) and (
+                    high is None or date <= high[0]
+                )
+            key = (date, str(post_id))
+            return (low is None or low <= key) and (high is None or key < high)
+
+        self._invalidate(covers)
+
+    def invalidate_user(self, user_id) -> None:
+        """Drops the pages showing a post by the user, or whose extra row is theirs"""
+        user_id = str(user_id)
+        self._invalidate(lambda entry: user_id in entry[4])
+
+    def clear(self) -> None:
+        """Drops every page"""
+        self._invalidate(lambda entry: True)
+
+    def _invalidate(self, matches) -> None:
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, entry in self._entries.items() if matches(entry)]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Returns the counters needed to size the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class UserCache:
+    """
+    Bounded LRU cache of user records keyed by user_id, each entry expiring ttl seconds
+    after it was stored. Safe to share between threads.
+    """
+
+    def __init__(self, max_entries: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidation, same as FeedCache
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id) -> dict | None:
+        """Returns a copy of the cached user, or None on a miss or if it has expired"""
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(entry[0])
+
+    def put(self, user: dict, generation: int) -> None:
+        """Stores a user unless anything was invalidated since generation"""
+        key = str(user[USER_ID])
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (dict(user), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id) -> None:
+        """Drops the user so the next lookup reads the database"""
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(str(user_id), None)
+
+    def clear(self) -> None:
+        """Drops every user"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the counters needed to size the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def _get_cache(caches: dict, path: str, factory):
+    key = os.path.abspath(path)
+    with _caches_lock:
+        if key not in caches:
+            caches[key] = factory()
+        return caches[key]
+
+
+def get_feed_cache(path: str) -> FeedCache:
+    """Returns the feed cache for a database file, shared by every connection to it"""
+    return _get_cache(_feed_caches, path, FeedCache)
+
+
+def get_user_cache(path: str) -> UserCache:
+    """Returns the user cache for a database file, shared by every connection to it"""
+    return _get_cache(_user_caches, path, UserCache)
@@ -10,9 +10,19 @@ IMAGESDIR = "/images/"
 DATABASE_PATH = "database.db"
 TEST_DATABASE_PATH = "test.db"
 
+# waitress worker threads, the connection pool is sized so every thread can hold one
+WAITRESS_THREADS = 16
+DATABASE_POOL_SIZE = WAITRESS_THREADS
+
 GET = "GET"
 POST = "POST"
 PATCH = "PATCH"
 PUT = "PUT"
 OPTIONS = "OPTIONS"
 DELETE = "DELETE"
+
+# derived image sizes, each fits the original inside a box this many pixels on a side
+IMAGE_VARIANTS = {"thumb": 160, "feed": 640, "full": 1600}
+# derivatives are re-encoded as webp or jpeg, webp falls back to jpeg if Pillow lacks it
+IMAGE_VARIANT_FORMAT = "webp"
+IMAGE_VARIANT_QUALITY = {"webp": 80, "jpeg": 82}
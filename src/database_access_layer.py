@@ -1,26 +1,788 @@
 import sqlite3 as sql
 import datetime
+import itertools
+import logging
+import os
+import queue
+import time
 import traceback
 import threading
+import urllib.parse
+from concurrent.futures import Future
+from typing import Any, Callable, Iterable, Iterator
 
+from src.cache import get_feed_cache, get_user_cache
 from src.constants import *
+from src.metrics import Counter, Histogram, instrument
+
+# SQLite only allows one writer at a time, so every write goes through a single writer thread
+# per database file that commits whatever has queued up as one transaction. A batch is
+# committed once it holds WRITE_BATCH_SIZE operations or has been open for WRITE_BATCH_WINDOW
+# seconds, so one fsync is shared by everything that arrived in the meantime.
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_WINDOW = 0.002
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+# Opt-in SQL profiling, off unless enable_profiling is called. Every statement run through
+# fetch_one, fetch_all and execute_write is timed, the ones slower than the threshold are
+# logged, and a thread can collect everything it ran between start_profile and
+# stop_profile. Connections opened while it is on also trace every statement they run.
+SLOW_QUERY_SECONDS = 0.1
+
+_profiling = {"enabled": False, "slow": SLOW_QUERY_SECONDS}
+_profiles = threading.local()
+_slow_log = logging.getLogger("src.database_access_layer.slow")
+
+DB_METHOD_SECONDS = Histogram(
+    "db_method_duration_seconds",
+    "Time spent in each Database method, including any wait for the writer",
+    ("method",),
+)
+DB_WRITE_WAIT_SECONDS = Histogram(
+    "db_write_queue_wait_seconds",
+    "Time a write waited in the writer queue before its batch started",
+)
+DB_WRITE_BATCH_SIZE = Histogram(
+    "db_write_batch_size",
+    "Write operations committed per transaction",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+DB_WRITE_ERRORS = Counter(
+    "db_write_errors_total", "Write operations that raised or failed to commit"
+)
+
+# sqlite3 caches prepared statements per connection keyed on the SQL text, so every query
+# is a module level constant and the cache is sized to hold all of them
+STATEMENT_CACHE_SIZE = 256
+
+_USER_COLUMNS = "user_id, username, password"
+_POST_COLUMNS = "post_id, user_id, image_ext, content, date"
+
+_INSERT_USER = "INSERT INTO users (user_id, username, password) VALUES (?, ?, ?)"
+_SELECT_USER_BY_USERNAME = f"SELECT {_USER_COLUMNS} FROM users WHERE username = ?"
+_SELECT_USER_BY_ID = f"SELECT {_USER_COLUMNS} FROM users WHERE user_id = ?"
+_SELECT_POST_BY_DATE = f"SELECT {_POST_COLUMNS} FROM posts WHERE date = ?"
+_SELECT_POST_BY_ID = f"SELECT {_POST_COLUMNS} FROM posts WHERE post_id = ?"
+_SELECT_ALL_POSTS = f"SELECT {_POST_COLUMNS} FROM posts ORDER BY date DESC"
+
+# keyset pages for iter_users and iter_posts, each page is a short read of its own so a
+# long export never holds a snapshot open and stops the WAL from being checkpointed
+_ITER_USERS_FIRST = f"SELECT {_USER_COLUMNS} FROM users ORDER BY user_id LIMIT ?"
+_ITER_USERS_AFTER = (
+    f"SELECT {_USER_COLUMNS} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?"
+)
+_ITER_POSTS_FIRST = f"SELECT {_POST_COLUMNS} FROM posts ORDER BY date, post_id LIMIT ?"
+_ITER_POSTS_AFTER = f"""
+    SELECT {_POST_COLUMNS} FROM posts
+    WHERE (date, post_id) > (?, ?)
+    ORDER BY date, post_id LIMIT ?
+"""
+
+# keeps posts_fts in step with posts, an edit is a delete of the old text plus an insert
+_SEARCH_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts (rowid, content) VALUES (NEW.rowid, NEW.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, content)
+        VALUES ('delete', OLD.rowid, OLD.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF content ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, content)
+        VALUES ('delete', OLD.rowid, OLD.content);
+        INSERT INTO posts_fts (rowid, content) VALUES (NEW.rowid, NEW.content);
+    END
+    """,
+)
+
+# post_counts rows are ('total', ''), ('user', user_id) and ('day', YYYY-MM-DD). Every
+# posts write fires these per row, so bulk deletes like delete_user_posts are counted too
+_COUNTER_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS post_counts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO post_counts (scope, key, count)
+        VALUES ('total', '', 1), ('user', NEW.user_id, 1), ('day', substr(NEW.date, 1, 10), 1)
+        ON CONFLICT (scope, key) DO UPDATE SET count = count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS post_counts_delete AFTER DELETE ON posts BEGIN
+        UPDATE post_counts SET count = count - 1
+        WHERE (scope, key) IN (
+            VALUES ('total', ''), ('user', OLD.user_id), ('day', substr(OLD.date, 1, 10))
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS post_counts_update AFTER UPDATE OF user_id, date ON posts
+    BEGIN
+        UPDATE post_counts SET count = count - 1
+        WHERE (scope, key) IN (VALUES ('user', OLD.user_id), ('day', substr(OLD.date, 1, 10)));
+        INSERT INTO post_counts (scope, key, count)
+        VALUES ('user', NEW.user_id, 1), ('day', substr(NEW.date, 1, 10), 1)
+        ON CONFLICT (scope, key) DO UPDATE SET count = count + 1;
+    END
+    """,
+)
+
+# what post_counts should hold, counted from scratch
+_COUNT_POSTS = """
+    SELECT 'total', '', COUNT(*) FROM posts
+    UNION ALL
+    SELECT 'user', CAST(user_id AS TEXT), COUNT(*) FROM posts GROUP BY user_id
+    UNION ALL
+    SELECT 'day', substr(date, 1, 10), COUNT(*) FROM posts GROUP BY substr(date, 1, 10)
+"""
+# counters that disagree with a fresh count, rows missing on either side count as 0. The
+# NOT IN builds its list of actual keys once, a correlated NOT EXISTS would walk the whole
+# of actual again for every counter.
+_COUNTER_DRIFT = f"""
+    WITH actual (scope, key, count) AS ({_COUNT_POSTS})
+    SELECT a.scope, a.key, COALESCE(c.count, 0), a.count
+    FROM actual a
+    LEFT JOIN post_counts c ON c.scope = a.scope AND c.key = a.key
+    WHERE COALESCE(c.count, 0) != a.count
+    UNION ALL
+    SELECT c.scope, c.key, c.count, 0
+    FROM post_counts c
+    WHERE c.count != 0 AND (c.scope, c.key) NOT IN (SELECT scope, key FROM actual)
+"""
+_SELECT_COUNTER = "SELECT count FROM post_counts WHERE scope = ? AND key = ?"
+
+# data_versions holds a version and the UTC time of the last change for users and posts,
+# bumped by every insert, update and delete so pages can be revalidated cheaply
+_VERSION_TRIGGERS = tuple(
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_version_{event} AFTER {event} ON {table} BEGIN
+        UPDATE data_versions
+        SET version = version + 1, changed_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE name = '{table}';
+    END
+    """
+    for table in ("users", "posts")
+    for event in ("insert", "update", "delete")
+)
+_SELECT_DATA_VERSIONS = "SELECT name, version, changed_at FROM data_versions"
+
+# image jobs, a failed job is queued again from scratch when its image is enqueued again
+MAX_IMAGE_JOB_ATTEMPTS = 5
+_ENQUEUE_IMAGE_JOB = """
+    INSERT INTO image_jobs (path, available_at) VALUES (?, ?)
+    ON CONFLICT (path) DO UPDATE
+    SET status = 'queued', attempts = 0, available_at = excluded.available_at, last_error = NULL
+    WHERE status = 'failed'
+"""
+# jobs whose lease ran out on their last attempt, the worker holding them died each time.
+# status != 'failed' is implied but lets SQLite use the partial index
+_EXPIRE_IMAGE_JOBS = f"""
+    UPDATE image_jobs SET status = 'failed', last_error = 'lease expired'
+    WHERE status != 'failed' AND available_at <= ?
+    AND status = 'running' AND attempts >= {MAX_IMAGE_JOB_ATTEMPTS}
+"""
+# the oldest available job, queued or with an expired lease, becomes the caller's until
+# the new lease runs out
+_CLAIM_IMAGE_JOB = """
+    UPDATE image_jobs
+    SET status = 'running', attempts = attempts + 1, available_at = ?
+    WHERE path = (
+        SELECT path FROM image_jobs
+        WHERE status != 'failed' AND available_at <= ?
+        ORDER BY available_at LIMIT 1
+    )
+    RETURNING path, attempts
+"""
+_FAIL_IMAGE_JOB = f"""
+    UPDATE image_jobs
+    SET status = CASE WHEN attempts >= {MAX_IMAGE_JOB_ATTEMPTS} THEN 'failed' ELSE 'queued' END,
+        available_at = ?, last_error = ?
+    WHERE path = ?
+"""
+_COUNT_IMAGE_JOBS = "SELECT status, COUNT(*) AS count FROM image_jobs GROUP BY status"
+
+# bulk loads skip rows whose key already exists instead of failing the whole chunk
+# only a taken key is skipped, a row breaking any other constraint (a missing date for
+# example) fails its chunk instead of vanishing as OR IGNORE would let it
+_BULK_INSERT_USERS = f"""
+    INSERT INTO users ({_USER_COLUMNS}) VALUES (?, ?, ?)
+    ON CONFLICT (user_id) DO NOTHING
+"""
+_BULK_INSERT_POSTS = f"""
+    INSERT INTO posts ({_POST_COLUMNS}) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (post_id) DO NOTHING
+"""
+
+# rows per executemany in the bulk inserts, each chunk is one transaction on the writer
+BULK_CHUNK_SIZE = 10_000
+
+# rows fetched from the cursor at a time by fetch_iter
+FETCH_BATCH_SIZE = 100
+# rows read per keyset page by iter_users and iter_posts
+ITER_PAGE_SIZE = 1000
+
+
+def _dict_row(cursor: sql.Cursor, row: tuple) -> dict:
+    """Row factory that builds a dict keyed by column name straight from the cursor"""
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def _normalise_path(path: str) -> str:
+    """Appends the .db extension to a database path if it is missing"""
+    if not path.endswith(".db"):
+        path += ".db"
+    return path
+
+
+class QueryProfile:
+    """Statements run by one thread between start_profile and stop_profile"""
+
+    def __init__(self):
+        # (statement, seconds, rows) per timed statement
+        self.queries = []
+        # every statement the connections traced, including ones not run through fetch_*
+        self.traced = 0
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(seconds for _, seconds, _ in self.queries)
+
+
+def enable_profiling(slow_query_seconds: float = SLOW_QUERY_SECONDS) -> None:
+    """Turns SQL profiling on, statements slower than slow_query_seconds are logged"""
+    _profiling["enabled"] = True
+    _profiling["slow"] = slow_query_seconds
+
+
+def disable_profiling() -> None:
+    """Turns SQL profiling off, connections already tracing keep counting statements"""
+    _profiling["enabled"] = False
+
+
+def profiling_enabled() -> bool:
+    return _profiling["enabled"]
+
+
+def start_profile() -> QueryProfile:
+    """Starts collecting the statements this thread runs"""
+    _profiles.current = QueryProfile()
+    return _profiles.current
+
+
+def stop_profile() -> QueryProfile | None:
+    """Stops collecting and returns what this thread ran since start_profile"""
+    profile = getattr(_profiles, "current", None)
+    _profiles.current = None
+    return profile
+
+
+def _record_query(statement: str, seconds: float, rows: int) -> None:
+    """Adds a timed statement to the thread's profile and logs it if it was slow"""
+    profile = getattr(_profiles, "current", None)
+    if profile is not None:
+        profile.queries.append((statement, seconds, rows))
+    if seconds >= _profiling["slow"]:
+        _slow_log.warning(
+            "slow query %.1fms, %d rows: %s",
+            seconds * 1000,
+            rows,
+            " ".join(statement.split()),
+        )
+
+
+def _trace_statement(statement: str) -> None:
+    """sqlite3 trace callback, counts statements for the thread's profile"""
+    profile = getattr(_profiles, "current", None)
+    if profile is not None:
+        profile.traced += 1
+
+
+def _connect(path: str, read_only: bool = False) -> sql.Connection:
+    """
+    Opens a connection to the database file and applies the connection level PRAGMAs.
+
+    The connection is created with check_same_thread disabled so that pooled connections
+    can be handed to whichever waitress thread is serving the request, a connection is
+    still only ever used by one thread at a time.
+
+    Read only connections are opened with mode=ro and query_only so any write fails straight
+    away, the file must already exist and use WAL so they never block on the writer.
+    """
+    if read_only:
+        uri = "file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro"
+        connection = sql.connect(
+            uri,
+            uri=True,
+            timeout=60,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        connection.execute("PRAGMA query_only=ON")
+        connection.execute("PRAGMA busy_timeout=30000")
+        if _profiling["enabled"]:
+            connection.set_trace_callback(_trace_statement)
+        return connection
+
+    connection = sql.connect(
+        path,
+        timeout=60,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+
+    # Enable WAL mode for better concurrent write performance
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA busy_timeout=30000")
+    if _profiling["enabled"]:
+        connection.set_trace_callback(_trace_statement)
+    return connection
+
+
+def _is_legacy_schema(connection: sql.Connection) -> bool:
+    """Returns True if the database still uses the old single json column tables"""
+    columns = connection.execute("PRAGMA table_info(posts)").fetchall()
+    return any(column[1] == "json" for column in columns)
+
+
+def _create_schema(
+    connection: sql.Connection, users: str = "users", posts: str = "posts"
+) -> None:
+    """
+    Creates the users and posts tables and their indexes if they do not exist.
+
+    The table names can be overridden so that the migration can build the new tables next
+    to the legacy ones before swapping them in.
+
+    Raises:
+        sql.OperationalError: if the database still uses the legacy json schema
+    """
+
+    # the migration builds its tables next to the legacy ones so only check the real tables
+    if posts == "posts" and _is_legacy_schema(connection):
+        raise sql.OperationalError(
+            "database uses the legacy json schema, "
+            "run 'python -m src.manage migrate' to convert it"
+        )
+
+    # create the user and posts tables if they do not exist
+    connection.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {users} (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL
+        )
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {posts} (
+            post_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES {users}(user_id),
+            content TEXT NOT NULL,
+            image_ext TEXT NOT NULL DEFAULT 'NONE',
+            date TEXT NOT NULL
+        )
+        """
+    )
+
+    # the feed is ordered by (date, post_id) and profiles by (user_id, date, post_id),
+    # idx_posts_user_date predates post_id being part of the profile order
+    connection.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_users_username ON {users}(username)"
+    )
+    connection.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_posts_date ON {posts}(date, post_id)"
+    )
+    connection.execute("DROP INDEX IF EXISTS idx_posts_user_date")
+    connection.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_posts_user_date_id ON {posts}(user_id, date, post_id)"
+    )
+
+    # durable queue of uploaded images waiting for their derivatives, a job is queued or
+    # running until available_at (its retry time or lease expiry) and failed for good
+    # once it has used up its attempts
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS image_jobs (
+            path TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            last_error TEXT
+        )
+        """
+    )
+    connection.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_image_jobs_available
+        ON image_jobs(available_at) WHERE status != 'failed'
+        """
+    )
+    # count_image_jobs runs on every /metrics scrape, this answers it from the index in
+    # status order instead of reading and sorting the jobs
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS idx_image_jobs_status ON image_jobs(status)"
+    )
+
+    # the search index and counters only belong to the real posts table, the migration
+    # builds them once its tables have been swapped in
+    if posts == "posts":
+        _create_search_index(connection)
+        _create_counters(connection)
+        _create_data_versions(connection)
+    connection.commit()
+
+
+def _create_search_index(connection: sql.Connection) -> None:
+    """
+    Creates the FTS5 index over post content and the triggers that keep it in sync with
+    every insert, edit and delete on posts.
+
+    The index is an external content table keyed on the posts rowid so the content is not
+    stored twice. A VACUUM can renumber those rowids, run 'python -m src.manage
+    rebuild-search' afterwards.
+    """
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'"
+    ).fetchone()
+
+    connection.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            content, content='posts', content_rowid='rowid', tokenize='porter unicode61'
+        )
+        """
+    )
+    for trigger in _SEARCH_TRIGGERS:
+        connection.execute(trigger)
+
+    # index any posts written before the search index existed
+    if exists is None:
+        connection.execute("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+
+
+def _create_counters(connection: sql.Connection) -> None:
+    """
+    Creates the post_counts table and the triggers that keep the total, per user and per
+    day post counts up to date, so counting posts never has to scan the posts table.
+    """
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'post_counts'"
+    ).fetchone()
+
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS post_counts (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+        """
+    )
+    for trigger in _COUNTER_TRIGGERS:
+        connection.execute(trigger)
+
+    # count any posts written before the counters existed
+    if exists is None:
+        connection.execute(
+            f"INSERT INTO post_counts (scope, key, count) {_COUNT_POSTS}"
+        )
+
+
+def _create_data_versions(connection: sql.Connection) -> None:
+    """
+    Creates the data_versions table and the triggers that bump the users or posts row on
+    every write to that table, so a page can tell whether anything it shows has changed
+    with a primary key lookup.
+    """
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            changed_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    connection.execute(
+        """
+        INSERT OR IGNORE INTO data_versions (name, version, changed_at) VALUES
+            ('users', 0, strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            ('posts', 0, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        """
+    )
+    for trigger in _VERSION_TRIGGERS:
+        connection.execute(trigger)
+
+
+class GroupCommitWriter:
+    """
+    Dedicated writer thread for one database file.
+
+    Callers hand it operations, functions taking the writer's connection, and block until
+    the batch their operation was part of has been committed. Each operation runs inside its
+    own savepoint so a failing one is rolled back on its own and its caller gets the
+    exception while the rest of the batch still commits.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = WRITE_BATCH_SIZE,
+        batch_window: float = WRITE_BATCH_WINDOW,
+    ):
+        """
+        Constructor for the GroupCommitWriter class, opens the writer connection and starts
+        the writer thread.
 
-# Global lock for SQLite write operations - SQLite only allows one writer at a time
-_db_write_lock = threading.Lock()
+        Parameters:
+            path: path to the database file
+            batch_size: most operations committed in one transaction
+            batch_window: longest time in seconds a batch waits for more operations
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+
+        # transactions are managed by hand so the batch can be wrapped in BEGIN/COMMIT
+        self.connection = _connect(path)
+        self.connection.isolation_level = None
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"db-writer-{os.path.basename(path)}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, operation: Callable[[sql.Connection], Any]) -> Any:
+        """
+        Queues a write operation and waits for it to be committed.
+
+        Parameters:
+            operation: function that performs the write on the connection it is given
+
+        Returns:
+            Any: whatever the operation returned
+
+        Raises:
+            Exception: whatever the operation raised, or the error that stopped the commit
+        """
+        future = Future()
+        self._queue.put((operation, future, time.perf_counter()))
+        return future.result()
+
+    def _run(self) -> None:
+        """Writer thread loop, collects a batch of operations and commits it"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch: list) -> None:
+        """Runs a batch of operations in one transaction and resolves their futures"""
+        results = []
+        started = time.perf_counter()
+        for _, _, queued in batch:
+            DB_WRITE_WAIT_SECONDS.observe(started - queued)
+        DB_WRITE_BATCH_SIZE.observe(len(batch))
+
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for operation, future, _ in batch:
+                self.connection.execute("SAVEPOINT operation")
+                try:
+                    result = operation(self.connection)
+                except Exception as e:
+                    self.connection.execute("ROLLBACK TO operation")
+                    self.connection.execute("RELEASE operation")
+                    results.append((future, None, e))
+                else:
+                    self.connection.execute("RELEASE operation")
+                    results.append((future, result, None))
+            self.connection.execute("COMMIT")
+        except Exception as e:
+            # the transaction itself failed, nothing in the batch was written
+            if self.connection.in_transaction:
+                self.connection.execute("ROLLBACK")
+            DB_WRITE_ERRORS.inc(amount=len(batch))
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is not None:
+                DB_WRITE_ERRORS.inc()
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def get_writer(path: str) -> GroupCommitWriter:
+    """Returns the writer for a database file, starting it on first use"""
+    key = os.path.abspath(path)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = GroupCommitWriter(path)
+        return _writers[key]
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections to a single database file.
+
+    Connections are opened lazily with the PRAGMAs already applied and the schema is only
+    created once for the whole pool, so checking a connection out costs no setup work.
+    At most max_connections are handed out at once, callers past that wait for one to be
+    released. A read only pool skips the schema and has no writer.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_connections: int = DATABASE_POOL_SIZE,
+        timeout: float = 60,
+        read_only: bool = False,
+    ):
+        """
+        Constructor for the ConnectionPool class, opens the first connection and creates
+        the schema with it.
+
+        Parameters:
+            path: path to the database file
+            max_connections: maximum number of connections checked out at the same time
+            timeout: seconds to wait for a free connection before giving up
+            read_only: hand out read only connections, the database must already exist
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self.path = _normalise_path(path)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.read_only = read_only
+
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._closed = False
+
+        connection = _connect(self.path, read_only)
+        if not read_only:
+            _create_schema(connection)
+        self._idle.append(connection)
+
+        self.writer = None if read_only else get_writer(self.path)
+        self.feed_cache = get_feed_cache(self.path)
+        self.user_cache = get_user_cache(self.path)
+
+    def acquire(self) -> sql.Connection:
+        """
+        Checks a connection out of the pool, opening a new one if none are idle.
+
+        Returns:
+            sql.Connection: a configured connection to the database
+
+        Raises:
+            sql.OperationalError: if the pool is closed or no connection was free in time
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sql.OperationalError("timed out waiting for a pooled connection")
+
+        with self._lock:
+            if self._closed:
+                self._slots.release()
+                raise sql.OperationalError("connection pool is closed")
+            if self._idle:
+                return self._idle.pop()
+
+        try:
+            return _connect(self.path, self.read_only)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection: sql.Connection) -> None:
+        """
+        Returns a connection to the pool, any transaction left open is rolled back so the
+        next user gets a clean connection.
+        """
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sql.Error:
+            # the connection is broken, drop it instead of pooling it
+            connection.close()
+            self._slots.release()
+            return
+
+        with self._lock:
+            if self._closed:
+                connection.close()
+            else:
+                self._idle.append(connection)
+        self._slots.release()
+
+    def close(self) -> None:
+        """Closes every idle connection, connections still checked out are closed on release"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
 
 
 class Database:
 
     # On initilization, connect/create the database and create the
     # tables if they do not exist
-    def __init__(self, path: str):
+    def __init__(
+        self, path: str = None, pool: "ConnectionPool" = None, read_only: bool = False
+    ):
         """
         Constructor for the Database class, this will create a connection to the database file and/or
         create the file if it does not exist, as well as create the users and posts tables if they
         also do not exist in the database.
 
+        When a pool is passed the connection is checked out of the pool instead, it is already
+        configured and the schema has already been created so no setup is done here.
+
+        A read only Database skips the schema setup and never queues anything on the writer,
+        every write method fails immediately.
+
         Parameters:
-            None
+            path: path to the database file, ignored when a pool is passed
+            pool: optional ConnectionPool to check a connection out of
+            read_only: open the database read only, ignored when a pool is passed
 
         Returns:
             None
@@ -30,38 +792,31 @@ class Database:
 
         """
 
-        # create the connection, also creates the database file if it does not exist
-        if not path.endswith(".db"):
-            path += ".db"
-
         self._lock = threading.Lock()
-        self.connection = sql.connect(path, timeout=60)
+        self._pool = pool
         self._closed = False
 
-        # Enable WAL mode for better concurrent write performance
-        self.connection.execute("PRAGMA journal_mode=WAL")
-        self.connection.execute("PRAGMA synchronous=NORMAL")
-        self.connection.execute("PRAGMA busy_timeout=30000")
+        if pool is not None:
+            self.connection = pool.acquire()
+            self.read_only = pool.read_only
+            self._writer = pool.writer
+            self.feed_cache = pool.feed_cache
+            self.user_cache = pool.user_cache
+            return
+
+        path = _normalise_path(path)
+        self.read_only = read_only
+        self.feed_cache = get_feed_cache(path)
+        self.user_cache = get_user_cache(path)
+        if read_only:
+            self.connection = _connect(path, read_only=True)
+            self._writer = None
+            return
 
-        # create the user and posts tables if they do not exist
-        self.connection.execute(
-            "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, json TEXT)"
-        )
-        self.connection.execute(
-            "CREATE TABLE IF NOT EXISTS posts (post_id TEXT PRIMARY KEY, json TEXT)"
-        )
-
-        # create indexes on frequently queried JSON fields for performance
-        self.connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_posts_date ON posts(json_extract(json, '$.date'))"
-        )
-        self.connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_posts_user_id ON posts(json_extract(json, '$.user_id'))"
-        )
-        self.connection.execute(
-            "CREATE INDEX IF NOT EXISTS idx_users_username ON users(json_extract(json, '$.username'))"
-        )
-        self.connection.commit()
+        # create the connection, also creates the database file if it does not exist
+        self.connection = _connect(path)
+        _create_schema(self.connection)
+        self._writer = get_writer(path)
 
     def __enter__(self):
         return self
@@ -69,6 +824,167 @@ class Database:
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
+    def fetch_one(self, query: str, params: list = ()) -> dict | None:
+        """
+        Runs a query and returns its first row as a dict keyed by column name
+
+        Parameters:
+            query: the SQL to run, kept constant so the prepared statement is reused
+            params: values bound to the query's placeholders
+
+        Returns:
+            dict: the first row of the result
+            None: if the query returned no rows
+
+        Raises:
+            None
+        """
+        cursor = self.connection.cursor()
+        cursor.row_factory = _dict_row
+        if not _profiling["enabled"]:
+            return cursor.execute(query, params).fetchone()
+
+        start = time.perf_counter()
+        row = cursor.execute(query, params).fetchone()
+        _record_query(query, time.perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetch_all(self, query: str, params: list = ()) -> list[dict]:
+        """
+        Runs a query and returns every row as a dict keyed by column name
+
+        Parameters:
+            query: the SQL to run, kept constant so the prepared statement is reused
+            params: values bound to the query's placeholders
+
+        Returns:
+            list[dict]: the rows of the result, empty if there are none
+
+        Raises:
+            None
+        """
+        cursor = self.connection.cursor()
+        cursor.row_factory = _dict_row
+        if not _profiling["enabled"]:
+            return cursor.execute(query, params).fetchall()
+
+        start = time.perf_counter()
+        rows = cursor.execute(query, params).fetchall()
+        _record_query(query, time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetch_iter(
+        self, query: str, params: list = (), batch_size: int = FETCH_BATCH_SIZE
+    ) -> Iterator[dict]:
+        """
+        Runs a query and yields its rows as dicts as they come off the cursor, only
+        batch_size rows are held in memory at a time. The query does not run until the
+        first row is asked for, and the connection must stay open until the last one.
+
+        Parameters:
+            query: the SQL to run, kept constant so the prepared statement is reused
+            params: values bound to the query's placeholders
+            batch_size: rows fetched from the cursor at a time
+
+        Returns:
+            Iterator[dict]: the rows of the result
+
+        Raises:
+            None
+        """
+        cursor = self.connection.cursor()
+        cursor.row_factory = _dict_row
+        profiling = _profiling["enabled"]
+        elapsed = 0.0
+        count = 0
+
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                # only the time spent in sqlite counts, not the caller's work in between
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+                count += len(rows)
+                yield from rows
+                start = time.perf_counter()
+        finally:
+            cursor.close()
+            if profiling:
+                _record_query(query, elapsed, count)
+
+    def execute_write(self, query: str, params: list = ()) -> int:
+        """
+        Runs a write statement through the group commit writer and waits for it to commit
+
+        Parameters:
+            query: the SQL to run
+            params: values bound to the query's placeholders
+
+        Returns:
+            int: number of rows the statement changed
+
+        Raises:
+            sql.OperationalError: if the database was opened read only
+            sql.Error: if the statement or the commit it was part of failed
+        """
+        return self._submit(
+            query,
+            lambda connection: connection.execute(query, params).rowcount,
+            rows=lambda rowcount: rowcount,
+        )
+
+    def _submit(
+        self, statement: str, operation: Callable, rows: Callable = None
+    ) -> Any:
+        """
+        Runs an operation on the group commit writer and waits for it to commit, every
+        write goes through here. With profiling on the wait is recorded against the
+        calling thread's profile under statement, and the statements the writer's
+        connection traces while running the operation are counted in it too.
+
+        Parameters:
+            statement: the SQL, or a description of the operation, for the profile
+            operation: called with the writer's connection inside its transaction
+            rows: turns the operation's result into a row count for the profile
+
+        Returns:
+            Any: whatever the operation returned
+
+        Raises:
+            sql.OperationalError: if the database was opened read only
+            sql.Error: if the operation or the commit it was part of failed
+        """
+        if self._writer is None:
+            raise sql.OperationalError("attempt to write a readonly database")
+        if not _profiling["enabled"]:
+            return self._writer.submit(operation)
+
+        profile = getattr(_profiles, "current", None)
+
+        def profiled(connection):
+            # the caller is blocked on the result, so the writer can count into its
+            # profile. The writer may predate enable_profiling, so it traces here.
+            _profiles.current = profile
+            connection.set_trace_callback(_trace_statement)
+            try:
+                return operation(connection)
+            finally:
+                connection.set_trace_callback(None)
+                _profiles.current = None
+
+        # includes the wait for the writer, which is what the request pays for
+        start = time.perf_counter()
+        result = self._writer.submit(profiled)
+        _record_query(
+            statement,
+            time.perf_counter() - start,
+            0 if rows is None else rows(result),
+        )
+        return result
+
     def insert_user(self, user: dict) -> bool:
         """
         This function will insert a new user into the users tables of the database.
@@ -83,31 +999,42 @@ class Database:
         Raises:
             None
         """
+        return self.create_user(user) is not None
 
-        username = validate_value(user.get("username"))
-        password = validate_value(user.get("password"))
-        user_id = validate_value(user.get("user_id", None))
+    def create_user(self, user: dict) -> int | None:
+        """
+        This function inserts a new user like insert_user, but hands back the user_id the
+        row was stored under so the caller does not have to look the user up again.
 
-        json = '{"username": "' + username + '", "password": "' + password + '"}'
+        Parameters:
+            user (dict): a dictionary containing the json information of the
+                         user to be insereted
 
-        # insert the user_id with the user if it was passed (primarliy for the update user function)
-        with _db_write_lock:
-            try:
-                if user_id:
-                    self.connection.execute(
-                        "INSERT INTO users (user_id, json) VALUES (?, ?)",
-                        ([user_id, json]),
-                    )
-                    self.connection.commit()
-                else:
-                    self.connection.execute(
-                        "INSERT INTO users (json) VALUES (?)", ([json])
-                    )
-                    self.connection.commit()
-                return True
-            except sql.IntegrityError:
-                print("Integrity Violated")
-                return False
+        Returns:
+            int: the new user's user_id
+            None: if the user_id was already taken
+
+        Raises:
+            None
+        """
+
+        username = user.get(USERNAME)
+        password = user.get(PASSWORD)
+        user_id = user.get(USER_ID)
+
+        # insert the user_id with the user if it was passed (primarliy for the update user function),
+        # a NULL user_id lets sqlite assign the next one
+        try:
+            return self._submit(
+                _INSERT_USER,
+                lambda connection: connection.execute(
+                    _INSERT_USER, [user_id or None, username, password]
+                ).lastrowid,
+                rows=lambda user_id: 1,
+            )
+        except sql.IntegrityError:
+            print("Integrity Violated")
+            return None
 
     def insert_post(self, post: dict) -> bool:
         """
@@ -126,37 +1053,97 @@ class Database:
         """
 
         # extract the values out of the post object/dictionary
-        post_id = validate_value(post.get(POST_ID))
-        content = validate_value(post.get(CONTENT))
-        image_ext = validate_value(post.get(IMAGE_EXT))
-        date = validate_value(post.get(DATE))
-        user_id = validate_value(post.get(USER_ID))
-
-        # construct the json object
-        json = (
-            '{"user_id": "'
-            + user_id
-            + '", "content": "'
-            + content
-            + '", "image_ext": "'
-            + image_ext
-            + '", "date": "'
-            + date
-            + '"}'
-        )
+        post_id = post.get(POST_ID)
+        content = post.get(CONTENT)
+        image_ext = post.get(IMAGE_EXT)
+        date = post.get(DATE)
+        user_id = post.get(USER_ID)
 
         # insert the post into the databse
-        with _db_write_lock:
-            try:
-                self.connection.execute(
-                    "INSERT INTO posts (post_id, json) VALUES (?, ?)",
-                    ([str(post_id), json]),
-                )
-                self.connection.commit()
-                return True
-            except sql.IntegrityError:
-                traceback.print_exc()
-                return False
+        try:
+            self.execute_write(
+                "INSERT INTO posts (post_id, user_id, content, image_ext, date) VALUES (?, ?, ?, ?, ?)",
+                [str(post_id), user_id, content, image_ext, date],
+            )
+            self.feed_cache.invalidate_post(date, post_id)
+            return True
+        except sql.IntegrityError:
+            traceback.print_exc()
+            return False
+
+    def insert_users(
+        self, users: Iterable[dict], chunk_size: int = BULK_CHUNK_SIZE
+    ) -> int:
+        """
+        This function bulk inserts users, streaming them into the database in large chunks
+        with one transaction per chunk instead of one per user. Users whose user_id is
+        already taken are skipped, a user breaking any other constraint fails its chunk.
+
+        Parameters:
+            users: iterable of user dicts, it is only read one chunk at a time
+            chunk_size: number of users written per transaction
+
+        Returns:
+            int: number of users inserted
+
+        Raises:
+            sql.Error: if a chunk could not be written, earlier chunks stay committed
+        """
+        rows = (
+            (user.get(USER_ID) or None, user.get(USERNAME), user.get(PASSWORD))
+            for user in users
+        )
+        return self._insert_chunks(_BULK_INSERT_USERS, rows, chunk_size)
+
+    def insert_posts(
+        self, posts: Iterable[dict], chunk_size: int = BULK_CHUNK_SIZE
+    ) -> int:
+        """
+        This function bulk inserts posts, streaming them into the database in large chunks
+        with one transaction per chunk instead of one per post. Posts whose post_id is
+        already taken are skipped, a post breaking any other constraint fails its chunk.
+
+        Parameters:
+            posts: iterable of post dicts, it is only read one chunk at a time
+            chunk_size: number of posts written per transaction
+
+        Returns:
+            int: number of posts inserted
+
+        Raises:
+            sql.Error: if a chunk could not be written, earlier chunks stay committed
+        """
+        rows = (
+            (
+                str(post.get(POST_ID)),
+                post.get(USER_ID),
+                post.get(IMAGE_EXT) or "NONE",
+                post.get(CONTENT),
+                post.get(DATE),
+            )
+            for post in posts
+        )
+        try:
+            return self._insert_chunks(_BULK_INSERT_POSTS, rows, chunk_size)
+        finally:
+            # a bulk load can land anywhere in the feed
+            self.feed_cache.clear()
+
+    def _insert_chunks(self, query: str, rows: Iterator[tuple], chunk_size: int) -> int:
+        """Writes rows chunk by chunk with executemany and returns how many were inserted"""
+        if self._writer is None:
+            raise sql.OperationalError("attempt to write a readonly database")
+
+        inserted = 0
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return inserted
+            inserted += self._submit(
+                query,
+                lambda connection: connection.executemany(query, chunk).rowcount,
+                rows=lambda rowcount: rowcount,
+            )
 
     def get_user_by_username(self, username: str) -> dict | None:
         """
@@ -174,24 +1161,7 @@ class Database:
             None
         """
 
-        user = {}
-
-        user_id = self.connection.execute(
-            "SELECT user_id FROM users WHERE json_extract(json, '$.username') LIKE ?",
-            (["%" + username + "%"]),
-        ).fetchone()
-        password = self.connection.execute(
-            "SELECT json_extract(json, '$.password') FROM users WHERE json_extract(json, '$.username') LIKE ?",
-            (["%" + username + "%"]),
-        ).fetchone()
-
-        if user_id is not None:
-            user[USERNAME] = validate_value(username)
-            user[PASSWORD] = validate_value(password)
-            user[USER_ID] = validate_value(user_id)
-            return user
-
-        return None
+        return self.fetch_one(_SELECT_USER_BY_USERNAME, [username])
 
     def get_user_by_id(self, user_id: int) -> dict | None:
         """
@@ -209,24 +1179,7 @@ class Database:
             None
         """
 
-        user = {}
-
-        username = self.connection.execute(
-            "SELECT json_extract(json, '$.username') FROM users WHERE user_id LIKE ?",
-            (["%" + str(user_id) + "%"]),
-        ).fetchone()
-        password = self.connection.execute(
-            "SELECT json_extract(json, '$.password') FROM users WHERE user_id LIKE ?",
-            (["%" + str(user_id) + "%"]),
-        ).fetchone()
-
-        if username is not None:
-            user[USERNAME] = validate_value(username)
-            user[PASSWORD] = validate_value(password)
-            user[USER_ID] = validate_value(user_id)
-            return user
-
-        return None
+        return self.fetch_one(_SELECT_USER_BY_ID, [user_id])
 
     def get_post_by_date(self, date: str) -> dict | None:
         """
@@ -244,37 +1197,7 @@ class Database:
             None
         """
 
-        post = {}
-
-        # extract the individual values of each post
-        user_id = self.connection.execute(
-            "SELECT json_extract(json, '$.user_id') FROM posts WHERE json_extract(json, '$.date') LIKE ?",
-            (["%" + date + "%"]),
-        ).fetchone()
-        image_ext = self.connection.execute(
-            "SELECT json_extract(json, '$.image_ext') FROM posts WHERE json_extract(json, '$.date') LIKE ?",
-            (["%" + date + "%"]),
-        ).fetchone()
-        content = self.connection.execute(
-            "SELECT json_extract(json, '$.content') FROM posts WHERE json_extract(json, '$.date') LIKE ?",
-            (["%" + date + "%"]),
-        ).fetchone()
-        post_id = self.connection.execute(
-            "SELECT post_id FROM posts WHERE json_extract(json, '$.date') LIKE ?",
-            (["%" + date + "%"]),
-        ).fetchone()
-
-        # put the post object together if it exists in the database
-        if user_id is not None:
-            post[USER_ID] = validate_value(user_id)
-            post[IMAGE_EXT] = validate_value(image_ext)
-            post[CONTENT] = validate_value(content)
-            post[DATE] = validate_value(date)
-            post[POST_ID] = validate_value(post_id)
-            return post
-
-        # if the post object was not found then return None
-        return None
+        return self.fetch_one(_SELECT_POST_BY_DATE, [date])
 
     def get_post_by_id(self, post_id: int) -> dict | None:
         """
@@ -292,37 +1215,7 @@ class Database:
             None
         """
 
-        post = {}
-
-        # extract the individual values of each post
-        user_id = self.connection.execute(
-            "SELECT json_extract(json, '$.user_id') FROM posts WHERE post_id = ?",
-            [str(post_id)],
-        ).fetchone()
-        image_ext = self.connection.execute(
-            "SELECT json_extract(json, '$.image_ext') FROM posts WHERE post_id = ?",
-            [str(post_id)],
-        ).fetchone()
-        content = self.connection.execute(
-            "SELECT json_extract(json, '$.content') FROM posts WHERE post_id = ?",
-            [str(post_id)],
-        ).fetchone()
-        date = self.connection.execute(
-            "SELECT json_extract(json, '$.date') FROM posts WHERE post_id = ?",
-            [str(post_id)],
-        ).fetchone()
-
-        # put the post object together if it exists in the database
-        if user_id is not None:
-            post[USER_ID] = validate_value(user_id)
-            post[IMAGE_EXT] = validate_value(image_ext)
-            post[CONTENT] = validate_value(content)
-            post[DATE] = validate_value(date)
-            post[POST_ID] = validate_value(post_id)
-            return post
-
-        # if the post object was not found then return None
-        return None
+        return self.fetch_one(_SELECT_POST_BY_ID, [str(post_id)])
 
     def get_all_posts(self) -> list[dict]:
         """
@@ -338,27 +1231,161 @@ class Database:
             None
         """
 
-        post_collection = []
-        posts = self.connection.execute(
-            "SELECT post_id, json_extract(json, '$.user_id'), json_extract(json, '$.image_ext'), json_extract(json, '$.content'), json_extract(json, '$.date') FROM posts ORDER BY json_extract(json, '$.date') DESC"
-        ).fetchall()
+        # every row is held at once, iter_posts walks the table in constant memory
+        return self.fetch_all(_SELECT_ALL_POSTS)
+
+    def iter_users(self, page_size: int = ITER_PAGE_SIZE) -> Iterator[dict]:
+        """
+        This function yields every user in user_id order, reading them one keyset page
+        at a time so memory use does not grow with the table
+
+        Parameters:
+            page_size: users read per query
+
+        Returns:
+            Iterator[dict]: every user object
+
+        Raises:
+            None
+        """
+        return self._iter_keyset(
+            _ITER_USERS_FIRST, _ITER_USERS_AFTER, (USER_ID,), page_size
+        )
+
+    def iter_posts(self, page_size: int = ITER_PAGE_SIZE) -> Iterator[dict]:
+        """
+        This function yields every post oldest first, in (date, post_id) order, reading
+        them one keyset page at a time instead of building a list like get_all_posts
 
-        # this might be the most cursed for loop i've ever written
-        for post_id, user_id, image_ext, content, date in posts:
+        Parameters:
+            page_size: posts read per query
 
-            structured_post = {}
-            structured_post[POST_ID] = validate_value(post_id)
-            structured_post[USER_ID] = validate_value(user_id)
-            structured_post[IMAGE_EXT] = validate_value(image_ext)
-            structured_post[CONTENT] = validate_value(content)
-            structured_post[DATE] = validate_value(date)
-            post_collection.append(structured_post)
+        Returns:
+            Iterator[dict]: every post object
 
-        return post_collection
+        Raises:
+            None
+        """
+        return self._iter_keyset(
+            _ITER_POSTS_FIRST, _ITER_POSTS_AFTER, (DATE, POST_ID), page_size
+        )
+
+    def _iter_keyset(
+        self, first: str, after: str, key: tuple, page_size: int
+    ) -> Iterator[dict]:
+        """
+        Yields the rows of first, then of after starting just past the last row's key,
+        until a page comes back short. Rows written during the walk show up if they sort
+        after the current page, nothing is ever repeated or skipped.
+        """
+        rows = self.fetch_iter(first, [page_size])
+        while True:
+            count = 0
+            last = None
+            for last in rows:
+                count += 1
+                yield last
+            if count < page_size:
+                return
+            rows = self.fetch_iter(
+                after, [*(last[column] for column in key), page_size]
+            )
+
+    def _get_counter(self, scope: str, key: str) -> int:
+        """Reads one post_counts row, a counter that was never written is 0"""
+        row = self.fetch_one(_SELECT_COUNTER, [scope, key])
+        return row["count"] if row else 0
 
     def get_post_count(self) -> int:
-        """ """
-        return self.connection.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+        """
+        This function returns the total number of posts from the maintained counters
+
+        Parameters:
+            None
+
+        Returns:
+            int: number of posts in the database
+
+        Raises:
+            None
+        """
+        return self._get_counter("total", "")
+
+    def get_user_post_count(self, user_id: int) -> int:
+        """
+        This function returns the number of posts made by a user
+
+        Parameters:
+            user_id: the id of the user
+
+        Returns:
+            int: number of posts by the user, 0 if they have none
+
+        Raises:
+            None
+        """
+        return self._get_counter("user", str(user_id))
+
+    def get_daily_post_count(self, day: str) -> int:
+        """
+        This function returns the number of posts made on a day
+
+        Parameters:
+            day: the day as YYYY-MM-DD
+
+        Returns:
+            int: number of posts dated that day, 0 if there are none
+
+        Raises:
+            None
+        """
+        return self._get_counter("day", day)
+
+    def get_data_versions(self) -> dict[str, tuple[int, str]]:
+        """
+        This function returns how often the users and posts tables have been written to
+        and when they last were
+
+        Parameters:
+            None
+
+        Returns:
+            dict: {"users": (version, changed_at), "posts": (version, changed_at)} with
+            changed_at as a UTC "YYYY-MM-DD HH:MM:SS.SSS" string
+
+        Raises:
+            None
+        """
+        return {
+            row["name"]: (row["version"], row["changed_at"])
+            for row in self.fetch_all(_SELECT_DATA_VERSIONS)
+        }
+
+    def reconcile_counters(self) -> list[tuple[str, str, int, int]]:
+        """
+        This function recounts every post counter from the posts table and replaces the
+        stored counters with the fresh counts in one transaction
+
+        Parameters:
+            None
+
+        Returns:
+            list[tuple]: (scope, key, stored count, actual count) for each counter that had
+            drifted, empty if all of them were correct
+
+        Raises:
+            sql.Error: if the counters could not be rewritten
+        """
+
+        def reconcile(connection):
+            drift = connection.execute(_COUNTER_DRIFT).fetchall()
+            connection.execute("DELETE FROM post_counts")
+            connection.execute(
+                f"INSERT INTO post_counts (scope, key, count) {_COUNT_POSTS}"
+            )
+            return drift
+
+        return self._submit("reconcile post_counts", reconcile, rows=len)
 
     def update_post(self, old_post: dict, edited_post: dict, user_id: int) -> bool:
         """
@@ -386,17 +1413,16 @@ class Database:
         content = edited_post.get(CONTENT)
         image = edited_post.get(IMAGE_EXT)
 
-        with _db_write_lock:
-            try:
-                # Single atomic update for both fields
-                self.connection.execute(
-                    "UPDATE posts SET json = json_set(json, '$.content', ?, '$.image_ext', ?) WHERE post_id = ?",
-                    [content, image, str(post_id)],
-                )
-                self.connection.commit()
-                return True
-            except Exception:
-                return False
+        try:
+            # Single atomic update for both fields
+            self.execute_write(
+                "UPDATE posts SET content = ?, image_ext = ? WHERE post_id = ?",
+                [content, image, str(post_id)],
+            )
+            self.feed_cache.invalidate_post(old_post.get(DATE), post_id)
+            return True
+        except Exception:
+            return False
 
     def update_user(self, old_user: dict, edited_user: dict) -> bool:
         """
@@ -418,21 +1444,21 @@ class Database:
             return False
 
         user_id = edited_user.get(USER_ID)
-        username = validate_value(edited_user.get("username"))
-        password = validate_value(edited_user.get("password"))
-        json_str = '{"username": "' + username + '", "password": "' + password + '"}'
-
-        with _db_write_lock:
-            try:
-                # Use atomic UPDATE instead of DELETE + INSERT
-                self.connection.execute(
-                    "UPDATE users SET json = ? WHERE user_id = ?",
-                    [json_str, user_id],
-                )
-                self.connection.commit()
-                return True
-            except Exception:
-                return False
+        username = edited_user.get(USERNAME)
+        password = edited_user.get(PASSWORD)
+
+        try:
+            # Use atomic UPDATE instead of DELETE + INSERT
+            self.execute_write(
+                "UPDATE users SET username = ?, password = ? WHERE user_id = ?",
+                [username, password, user_id],
+            )
+            # the feed shows usernames
+            self.feed_cache.invalidate_user(user_id)
+            self.user_cache.invalidate(user_id)
+            return True
+        except Exception:
+            return False
 
     def delete_user(self, user_id: int) -> bool:
         """
@@ -448,15 +1474,14 @@ class Database:
             None
         """
 
-        with _db_write_lock:
-            try:
-                data = self.connection.execute(
-                    "DELETE FROM users WHERE user_id LIKE ?", ["%" + str(user_id) + "%"]
-                )
-                self.connection.commit()
-                return data is not None
-            except Exception:
-                return False
+        try:
+            self.execute_write("DELETE FROM users WHERE user_id = ?", [user_id])
+            # their remaining posts now show as [deleted]
+            self.feed_cache.invalidate_user(user_id)
+            self.user_cache.invalidate(user_id)
+            return True
+        except Exception:
+            return False
 
     def delete_post(self, user_id: int, date: str):
         """
@@ -469,16 +1494,15 @@ class Database:
         Returns:
             bool: true if the deletion was successful, false if not
         """
-        with _db_write_lock:
-            try:
-                data = self.connection.execute(
-                    "DELETE FROM posts WHERE json_extract(json, '$.user_id') LIKE ? and json_extract(json, '$.date') LIKE ?",
-                    ["%" + str(user_id) + "%", "%" + date + "%"],
-                )
-                self.connection.commit()
-                return data is not None
-            except Exception:
-                return False
+        try:
+            self.execute_write(
+                "DELETE FROM posts WHERE user_id = ? and date = ?",
+                [user_id, date],
+            )
+            self.feed_cache.invalidate_post(date)
+            return True
+        except Exception:
+            return False
 
     def delete_user_posts(self, user_id: int) -> bool:
         """
@@ -490,16 +1514,123 @@ class Database:
         Returns:
             bool: True if deletion was successful, False if not
         """
-        with _db_write_lock:
-            try:
-                self.connection.execute(
-                    "DELETE FROM posts WHERE json_extract(json, '$.user_id') = ?",
-                    [str(user_id)],
-                )
-                self.connection.commit()
-                return True
-            except Exception:
-                return False
+        try:
+            self.execute_write(
+                "DELETE FROM posts WHERE user_id = ?",
+                [str(user_id)],
+            )
+            self.feed_cache.invalidate_user(user_id)
+            return True
+        except Exception:
+            return False
+
+    def enqueue_image_job(self, path: str) -> None:
+        """
+        This function records that an image needs its derivatives made, a job that is
+        already waiting or running is left as it is
+
+        Parameters:
+            path: path to the original image
+
+        Returns:
+            None
+
+        Raises:
+            sql.Error: if the job could not be written
+        """
+        self.execute_write(_ENQUEUE_IMAGE_JOB, [path, time.time()])
+
+    def claim_image_job(self, lease: float) -> dict | None:
+        """
+        This function hands the oldest available image job to the caller for lease seconds,
+        after that another worker may claim it again
+
+        Parameters:
+            lease: seconds the caller has to finish the job
+
+        Returns:
+            dict: the claimed job's path and attempts so far, including this one
+            None: if no job is available
+
+        Raises:
+            sql.Error: if the claim could not be written
+        """
+
+        def claim(connection):
+            now = time.time()
+            connection.execute(_EXPIRE_IMAGE_JOBS, [now])
+            row = connection.execute(_CLAIM_IMAGE_JOB, [now + lease, now]).fetchone()
+            return None if row is None else {"path": row[0], "attempts": row[1]}
+
+        return self._submit(
+            _CLAIM_IMAGE_JOB, claim, rows=lambda job: 0 if job is None else 1
+        )
+
+    def complete_image_job(self, path: str) -> None:
+        """
+        This function removes a finished image job
+
+        Parameters:
+            path: path to the original image
+
+        Returns:
+            None
+
+        Raises:
+            sql.Error: if the job could not be removed
+        """
+        self.execute_write("DELETE FROM image_jobs WHERE path = ?", [path])
+
+    def fail_image_job(self, path: str, error: str, retry_after: float) -> None:
+        """
+        This function puts a job that raised back in the queue, or marks it failed once it
+        has used all MAX_IMAGE_JOB_ATTEMPTS
+
+        Parameters:
+            path: path to the original image
+            error: what went wrong, kept on the job
+            retry_after: seconds before the job may be claimed again
+
+        Returns:
+            None
+
+        Raises:
+            sql.Error: if the job could not be written
+        """
+        self.execute_write(_FAIL_IMAGE_JOB, [time.time() + retry_after, error, path])
+
+    def count_image_jobs(self) -> dict[str, int]:
+        """
+        This function counts the image jobs in each status
+
+        Parameters:
+            None
+
+        Returns:
+            dict: number of jobs keyed by status, statuses without jobs are left out
+
+        Raises:
+            None
+        """
+        return {
+            row["status"]: row["count"] for row in self.fetch_all(_COUNT_IMAGE_JOBS)
+        }
+
+    def rebuild_search_index(self) -> None:
+        """
+        Rebuilds the full text search index from the posts table, only needed if the index
+        has drifted, for example after a VACUUM renumbered the posts rowids
+
+        Parameters:
+            None
+
+        Returns:
+            None
+
+        Raises:
+            sql.Error: if the rebuild could not be written
+        """
+        self.execute_write("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
 
     def close(self) -> None:
         """
@@ -517,6 +1648,10 @@ class Database:
         with self._lock:
             if not self._closed:
                 self._closed = True
+                if self._pool is not None:
+                    # pooled connections go back to the pool instead of being closed
+                    self._pool.release(self.connection)
+                    return
                 try:
                     self.connection.close()
                 except Exception:
@@ -527,26 +1662,34 @@ class Database:
         **ONLY USE IN TESTS ON TEST DATABASE DO NOT WIPE OUR USERS DATA WE CAN SELL IT**
         """
 
-        with _db_write_lock:
-            # remvoe old tables
-            self.connection.execute("DROP TABLE IF EXISTS users")
-            self.connection.execute("DROP TABLE IF EXISTS posts")
-
-            # recreate the tables
-            self.connection.execute(
-                "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, json TEXT)"
-            )
-            self.connection.execute(
-                "CREATE TABLE IF NOT EXISTS posts (post_id INTEGER PRIMARY KEY, json TEXT)"
-            )
-
-            self.connection.commit()
-
-
-def validate_value(value):
-
-    if not value:
-        return value
-    if isinstance(value, tuple):
-        return value[0]
-    return value
+        # remvoe old tables
+        self.connection.execute("DROP TABLE IF EXISTS users")
+        self.connection.execute("DROP TABLE IF EXISTS posts")
+        self.connection.execute("DROP TABLE IF EXISTS posts_fts")
+        self.connection.execute("DROP TABLE IF EXISTS post_counts")
+        self.connection.execute("DROP TABLE IF EXISTS data_versions")
+        self.connection.execute("DROP TABLE IF EXISTS image_jobs")
+
+        # recreate the tables
+        _create_schema(self.connection)
+        self.feed_cache.clear()
+        self.user_cache.clear()
+
+
+# every public Database method is timed, close and reset_tables are not worth a series
+# the iterators return straight away, timing them would only measure creating them. The
+# query helpers run inside the other methods, timing them too would count that time twice.
+instrument(
+    Database,
+    DB_METHOD_SECONDS,
+    skip=(
+        "close",
+        "reset_tables",
+        "fetch_one",
+        "fetch_all",
+        "fetch_iter",
+        "execute_write",
+        "iter_users",
+        "iter_posts",
+    ),
+)
@@ -0,0 +1,98 @@
+"""Cached index of the uploaded images so serving one does not need a stat per request"""
+
+import mimetypes
+import os
+import stat
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+# image files remembered per upload directory, only the stat results are kept
+IMAGE_INDEX_SIZE = 4096
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class ImageEntry(NamedTuple):
+    path: str
+    size: int
+    last_modified: datetime
+    etag: str
+    mimetype: str
+
+
+class ImageIndex:
+    """
+    Bounded LRU of the files in an upload directory, filled the first time each file is
+    asked for. Image names are unique per post and are only ever rewritten by the image
+    queue, which calls invalidate_image when it does, so an entry stays valid until then.
+    Missing files are not remembered since an upload can create them at any time.
+    """
+
+    def __init__(self, directory: str, max_entries: int = IMAGE_INDEX_SIZE):
+        self.directory = os.path.abspath(directory)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidation, a stat taken before a rewrite must not be stored
+        self._generation = 0
+
+    def lookup(self, filename: str) -> ImageEntry | None:
+        """Returns the file's entry, or None if there is no such file"""
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None:
+                self._entries.move_to_end(filename)
+                return entry
+            generation = self._generation
+
+        path = os.path.join(self.directory, filename)
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+
+        entry = ImageEntry(
+            path=path,
+            size=info.st_size,
+            last_modified=datetime.fromtimestamp(info.st_mtime, timezone.utc),
+            # size and mtime change whenever the file is rewritten
+            etag=f"{info.st_size:x}-{info.st_mtime_ns:x}",
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        )
+        with self._lock:
+            if generation != self._generation:
+                return entry
+            self._entries[filename] = entry
+            self._entries.move_to_end(filename)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, filename: str) -> None:
+        """Forgets a file so the next lookup stats it again"""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(filename, None)
+
+
+def get_image_index(directory: str) -> ImageIndex:
+    """Returns the index for an upload directory, creating it on first use"""
+    key = os.path.abspath(directory)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = ImageIndex(key)
+        return _indexes[key]
+
+
+def invalidate_image(path: str) -> None:
+    """Forgets a file in whichever index covers its directory, called after rewriting it"""
+    directory, filename = os.path.split(os.path.abspath(path))
+    with _indexes_lock:
+        index = _indexes.get(directory)
+    if index is not None:
+        index.invalidate(filename)
@@ -1,60 +1,263 @@
 """Background image processing queue to avoid blocking request handlers"""
+import multiprocessing
 import threading
-import queue
+import time
+import traceback
 import os
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, features
 
+from src.constants import (
+    DATABASE_PATH,
+    IMAGE_VARIANTS,
+    IMAGE_VARIANT_FORMAT,
+    IMAGE_VARIANT_QUALITY,
+)
+from src.database_access_layer import Database, MAX_IMAGE_JOB_ATTEMPTS
+from src.image_index import invalidate_image
+from src.metrics import Counter, Histogram
 
-# Bounded queue prevents memory exhaustion under heavy load
-MAX_QUEUE_SIZE = 1000
+# Jobs live in the image_jobs table so nothing is lost when the process restarts. A worker
+# claims a job for JOB_LEASE seconds, if it dies the job is claimed again once that runs out.
 NUM_WORKERS = 4
+JOB_LEASE = 60.0
+# idle workers are woken straight away by queue_variants, they also look for retries,
+# expired leases and jobs queued by other processes this often
+POLL_INTERVAL = 5.0
+# seconds before a job that raised is retried, doubled on every attempt
+RETRY_DELAY = 2.0
 
-_image_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+# "thread" runs Pillow in NUM_WORKERS threads inside the server process, fine for small
+# deployments. "process" hands it to a pool of PROCESS_WORKERS processes so decoding and
+# encoding never hold the server's GIL or compete with request threads for its cores.
+IMAGE_BACKEND = os.environ.get("IMAGE_BACKEND", "thread")
+PROCESS_WORKERS = os.cpu_count() or 1
+
+IMAGE_JOB_SECONDS = Histogram(
+    "image_job_duration_seconds", "Time taken to make one image's derivatives"
+)
+IMAGE_JOBS = Counter(
+    "image_jobs_total", "Image jobs processed, by outcome", ("result",)
+)
+
+_wakeup = threading.Semaphore(0)
+_stopping = threading.Event()
 _worker_threads = []
 _started = False
 _lock = threading.Lock()
+_executor = None
+
+# webp needs Pillow built with libwebp
+VARIANT_FORMAT = (
+    IMAGE_VARIANT_FORMAT
+    if IMAGE_VARIANT_FORMAT != "webp" or features.check("webp")
+    else "jpeg"
+)
+VARIANT_EXT = "jpg" if VARIANT_FORMAT == "jpeg" else VARIANT_FORMAT
+
+
+def variant_filename(filename: str, variant: str) -> str:
+    """Name of a derivative, e.g. 1234.png -> 1234.feed.webp"""
+    stem = filename.rsplit(".", 1)[0]
+    return f"{stem}.{variant}.{VARIANT_EXT}"
+
+
+def make_variants(path: str) -> list[str]:
+    """
+    Writes every IMAGE_VARIANTS derivative of an original next to it, scaled to fit its box
+    with the aspect ratio kept and never enlarged. The original is left untouched.
+
+    Runs in a pool process with the process backend, so it only touches files and returns
+    the paths it wrote for the caller to invalidate.
+    """
+    directory, filename = os.path.split(path)
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+
+    if VARIANT_FORMAT == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        transparent = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if transparent else "RGB")
+
+    written = []
+    # largest first so each size is scaled down from the previous one, not the original
+    for variant, box in sorted(IMAGE_VARIANTS.items(), key=lambda item: -item[1]):
+        image.thumbnail((box, box), Image.LANCZOS)
+        target = os.path.join(directory, variant_filename(filename, variant))
+        # write next to the target and swap it in so a half written file is never served
+        tmp_path = f"{target}.tmp"
+        image.save(
+            tmp_path,
+            format=VARIANT_FORMAT,
+            quality=IMAGE_VARIANT_QUALITY[VARIANT_FORMAT],
+            optimize=True,
+        )
+        os.replace(tmp_path, target)
+        written.append(target)
+    return written
+
+
+def _lower_priority():
+    """Pool process initializer, request threads win any contention for the cores"""
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+
+def process_next_job(db: Database) -> bool:
+    """
+    Claims the next image job and makes its derivatives, a job that raises is retried later
+    and marked failed after its last attempt. Returns False if there was nothing to do.
+    """
+    job = db.claim_image_job(JOB_LEASE)
+    if job is None:
+        return False
+
+    path = job["path"]
+    start = time.perf_counter()
+    try:
+        # the post may have been deleted since, then there is nothing left to do
+        if os.path.exists(path):
+            if _executor is None:
+                written = make_variants(path)
+            else:
+                # the thread only waits, the pool process does the work
+                written = _executor.submit(make_variants, path).result()
+            for target in written:
+                invalidate_image(target)
+    except Exception as e:
+        retry_after = RETRY_DELAY * 2 ** (job["attempts"] - 1)
+        db.fail_image_job(path, repr(e), retry_after)
+        IMAGE_JOBS.inc(
+            "retry" if job["attempts"] < MAX_IMAGE_JOB_ATTEMPTS else "failed"
+        )
+    else:
+        db.complete_image_job(path)
+        IMAGE_JOBS.inc("done")
+    IMAGE_JOB_SECONDS.observe(time.perf_counter() - start)
+    return True
 
 
-def _process_images():
-    """Worker thread that processes image resize tasks from the queue"""
-    while True:
-        task = _image_queue.get()
-        if task is None:
-            _image_queue.task_done()
-            break
-        path, target_size = task
-        try:
-            if os.path.exists(path):
-                with Image.open(path) as img:
-                    resized = img.resize(target_size)
-                    resized.save(path)
-        except Exception:
-            pass
-        _image_queue.task_done()
-
-
-def start_worker():
-    """Start multiple background image processing worker threads"""
-    global _started
+def _process_images(db_path: str):
+    """Worker thread that works through the image jobs"""
+    db = Database(db_path)
+    try:
+        while not _stopping.is_set():
+            try:
+                if not process_next_job(db):
+                    _wakeup.acquire(timeout=POLL_INTERVAL)
+            except Exception:
+                # the database is unavailable, the job's lease brings it back later
+                traceback.print_exc()
+                _stopping.wait(POLL_INTERVAL)
+    finally:
+        db.close()
+
+
+def start_worker(backend: str = None, db_path: str = DATABASE_PATH):
+    """
+    Start the background image processing workers with the given backend, "thread" or
+    "process", defaulting to IMAGE_BACKEND. The process backend keeps one dispatch thread
+    per pool process so jobs are only claimed when there is a process free to run them.
+    Jobs the last run left queued are picked up straight away. Jobs it left running stay
+    claimed until their JOB_LEASE runs out, the table does not record which process
+    holds a lease, so one that may still be alive in another process is never taken.
+    """
+    global _started, _executor
+    backend = backend or IMAGE_BACKEND
+    if backend not in ("thread", "process"):
+        raise ValueError(f"unknown image backend {backend!r}")
+
     with _lock:
         if _started:
             return
         _started = True
-        for _ in range(NUM_WORKERS):
-            t = threading.Thread(target=_process_images, daemon=True)
+
+        workers = NUM_WORKERS
+        if backend == "process":
+            # forked by a fork server rather than by this process, which is already
+            # running the writer, the hasher's manager and maybe the request threads by
+            # now. Forking those could leave a child blocked on a lock copied mid use.
+            # The server preloads this module so each child starts with Pillow imported,
+            # each child still imports the main module again, which app.py allows for.
+            methods = multiprocessing.get_all_start_methods()
+            if "forkserver" in methods:
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _executor = ProcessPoolExecutor(
+                max_workers=PROCESS_WORKERS,
+                mp_context=context,
+                initializer=_lower_priority,
+            )
+            # start the server and a first child now rather than under the first upload
+            _executor.submit(int).result()
+            workers = PROCESS_WORKERS
+
+        for _ in range(workers):
+            t = threading.Thread(target=_process_images, args=(db_path,), daemon=True)
             t.start()
             _worker_threads.append(t)
 
+    with Database(db_path) as db:
+        jobs = db.count_image_jobs()
+    if jobs.get("queued"):
+        print(f"resuming {jobs['queued']} queued image jobs")
+    if jobs.get("running"):
+        print(
+            f"{jobs['running']} image jobs are still leased, they are retried once "
+            f"their {JOB_LEASE:.0f}s lease runs out"
+        )
+    if jobs.get("failed"):
+        print(f"{jobs['failed']} image jobs have failed, see the image_jobs table")
 
-def queue_resize(path: str, size: tuple = (256, 256)):
-    """Queue an image for background resizing. Non-blocking if queue is full."""
-    try:
-        _image_queue.put_nowait((path, size))
-    except queue.Full:
-        # Queue full - skip resize, image stays at original size
-        pass
+
+def stop_worker():
+    """
+    Stops the workers started by start_worker, waiting for the jobs they are running to
+    finish, and shuts the process pool down. start_worker can be called again afterwards.
+    """
+    global _started, _executor
+    with _lock:
+        if not _started:
+            return
+        _stopping.set()
+        for _ in _worker_threads:
+            _wakeup.release()
+        for t in _worker_threads:
+            t.join()
+        _worker_threads.clear()
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+        _stopping.clear()
+        _started = False
+
+
+def queue_variants(path: str, db: Database):
+    """Record a job for an uploaded original's derivatives and wake an idle worker"""
+    db.enqueue_image_job(path)
+    _wakeup.release()
+
+
+def find_unprocessed(directory: str) -> list[str]:
+    """Returns the paths of the originals in directory that are missing a derivative"""
+    from src.post_controller import ALLOWED_EXTENSIONS
+
+    names = set(os.listdir(directory))
+    unprocessed = []
+    for name in sorted(names):
+        # originals are <post_id>.<ext>, derivatives have the variant name in between
+        _, _, ext = name.partition(".")
+        if ext not in ALLOWED_EXTENSIONS:
+            continue
+        if not all(variant_filename(name, v) in names for v in IMAGE_VARIANTS):
+            unprocessed.append(os.path.join(directory, name))
+    return unprocessed
 
 
-def get_queue_depth() -> int:
-    """Return current queue depth for monitoring"""
-    return _image_queue.qsize()
+def get_queue_depth(db: Database) -> int:
+    """Return the number of image jobs waiting or running, for monitoring"""
+    jobs = db.count_image_jobs()
+    return jobs.get("queued", 0) + jobs.get("running", 0)
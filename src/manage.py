@@ -0,0 +1,213 @@
+"""Command line maintenance tasks, run with python -m src.manage <command>"""
+
+import argparse
+import json
+import os
+import sqlite3 as sql
+import sys
+import time
+
+from src.constants import DATABASE_PATH
+from src.database_access_layer import Database, BULK_CHUNK_SIZE, ITER_PAGE_SIZE
+from src.migrations import migrate_legacy_schema, MIGRATION_BATCH_SIZE
+
+
+def _migrate(args) -> int:
+    """Converts a legacy json column database to the typed schema"""
+    result = migrate_legacy_schema(args.path, args.batch_size, args.pause)
+    if result is None:
+        print(f"{args.path} already uses the current schema")
+        return 0
+
+    print(
+        f"migrated {result['users']} users and {result['posts']} posts "
+        f"({result['users_skipped']} users and {result['posts_skipped']} posts "
+        "skipped with unreadable json or values the typed schema rejects)"
+    )
+    return 0
+
+
+def _read_ndjson(path: str, counter: dict):
+    """Yields one dict per non-blank line of an NDJSON file, counting lines as it goes"""
+    with open(path, "r", encoding="utf-8", buffering=1 << 20) as file:
+        for number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: {e}") from e
+            counter["read"] += 1
+            yield row
+
+
+def _import(args) -> int:
+    """Bulk loads an NDJSON file of users or posts"""
+    counter = {"read": 0}
+    db = Database(args.db)
+    insert = db.insert_users if args.table == "users" else db.insert_posts
+
+    start = time.perf_counter()
+    try:
+        inserted = insert(_read_ndjson(args.file, counter), args.chunk_size)
+    except ValueError as e:
+        print(f"import failed: {e}", file=sys.stderr)
+        return 1
+    except sql.IntegrityError as e:
+        # a row with a missing or invalid column, the chunks before it stay imported
+        print(
+            f"import failed: {e} in the chunk ending at row {counter['read']}, "
+            "earlier chunks were imported",
+            file=sys.stderr,
+        )
+        return 1
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"imported {inserted} of {counter['read']} {args.table} in {elapsed:.2f}s "
+        f"({counter['read'] / elapsed if elapsed else 0:,.0f} rows/s, "
+        f"{counter['read'] - inserted} already present)"
+    )
+    return 0
+
+
+def _export(args) -> int:
+    """Writes every user or post to an NDJSON file that import can load back"""
+    db = Database(args.db)
+    rows = db.iter_users if args.table == "users" else db.iter_posts
+    to_stdout = args.file == "-"
+
+    start = time.perf_counter()
+    exported = 0
+    try:
+        file = (
+            sys.stdout
+            if to_stdout
+            else open(args.file, "w", encoding="utf-8", buffering=1 << 20)
+        )
+        try:
+            for row in rows(args.page_size):
+                file.write(json.dumps(row, separators=(",", ":")) + "\n")
+                exported += 1
+        finally:
+            if not to_stdout:
+                file.close()
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - start
+
+    # the summary goes to stderr so it never ends up in an export written to stdout
+    print(
+        f"exported {exported} {args.table} in {elapsed:.2f}s "
+        f"({exported / elapsed if elapsed else 0:,.0f} rows/s)",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _rebuild_search(args) -> int:
+    """Rebuilds the full text search index from the posts table"""
+    db = Database(args.db)
+    try:
+        db.rebuild_search_index()
+    finally:
+        db.close()
+    print(f"rebuilt the search index for {args.db}")
+    return 0
+
+
+def _reconcile_counters(args) -> int:
+    """Recounts the post counters from scratch and reports any that had drifted"""
+    db = Database(args.db)
+    try:
+        drift = db.reconcile_counters()
+    finally:
+        db.close()
+
+    for scope, key, stored, actual in drift:
+        print(f"{scope} {key or '-'}: stored {stored}, actual {actual}")
+    print(f"rebuilt the post counters, {len(drift)} had drifted")
+    return 0
+
+
+def _rescan_images(args) -> int:
+    """Queues a job for every uploaded image that is missing a derivative"""
+    from src.image_queue import find_unprocessed
+
+    paths = find_unprocessed(os.path.abspath(args.dir))
+    db = Database(args.db)
+    try:
+        for path in paths:
+            db.enqueue_image_job(path)
+        jobs = db.count_image_jobs()
+    finally:
+        db.close()
+
+    print(
+        f"queued {len(paths)} unprocessed images, "
+        f"{jobs.get('queued', 0)} jobs waiting and {jobs.get('failed', 0)} failed"
+    )
+    return 0
+
+
+def main(argv: list[str] = None) -> int:
+    """Parses the command line and runs the requested command"""
+    parser = argparse.ArgumentParser(prog="python -m src.manage", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser(
+        "migrate", help="convert a legacy json column database in place"
+    )
+    migrate.add_argument("path", nargs="?", default=DATABASE_PATH)
+    migrate.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    migrate.add_argument(
+        "--pause", type=float, default=0.0, help="seconds to sleep between batches"
+    )
+    migrate.set_defaults(func=_migrate)
+
+    load = commands.add_parser(
+        "import", help="bulk load users or posts from an NDJSON file"
+    )
+    load.add_argument("table", choices=["users", "posts"])
+    load.add_argument("file", help="one JSON object per line, keyed by column name")
+    load.add_argument("--db", default=DATABASE_PATH)
+    load.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE)
+    load.set_defaults(func=_import)
+
+    export = commands.add_parser(
+        "export",
+        help="write users or posts to an NDJSON file, users include password hashes",
+    )
+    export.add_argument("table", choices=["users", "posts"])
+    export.add_argument("file", help="where to write, - for stdout")
+    export.add_argument("--db", default=DATABASE_PATH)
+    export.add_argument("--page-size", type=int, default=ITER_PAGE_SIZE)
+    export.set_defaults(func=_export)
+
+    rebuild = commands.add_parser(
+        "rebuild-search", help="rebuild the full text search index, e.g. after a VACUUM"
+    )
+    rebuild.add_argument("--db", default=DATABASE_PATH)
+    rebuild.set_defaults(func=_rebuild_search)
+
+    reconcile = commands.add_parser(
+        "reconcile-counters", help="rebuild the post counters and report any drift"
+    )
+    reconcile.add_argument("--db", default=DATABASE_PATH)
+    reconcile.set_defaults(func=_reconcile_counters)
+
+    rescan = commands.add_parser(
+        "rescan-images", help="queue image jobs for uploads missing their derivatives"
+    )
+    rescan.add_argument("--dir", default="images", help="the upload directory")
+    rescan.add_argument("--db", default=DATABASE_PATH)
+    rescan.set_defaults(func=_rescan_images)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
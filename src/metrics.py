@@ -0,0 +1,176 @@
+"""In process metrics rendered in the Prometheus text exposition format for /metrics"""
+
+import bisect
+import functools
+import threading
+import time
+from typing import Callable
+
+# seconds, from a cached page to a slow image resize
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# every metric created, in the order they are rendered
+REGISTRY = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Shared parts of the metric types, one lock per metric keeps updates cheap"""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.extend(self._render_value(label_values, value))
+        return lines
+
+    def _render_value(self, label_values: tuple, value) -> list[str]:
+        return [f"{self.name}{_labels(self.labels, label_values)} {value}"]
+
+
+class Counter(_Metric):
+    """A count that only goes up"""
+
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def set_total(self, value: float, *label_values) -> None:
+        """
+        Copies a running total kept elsewhere, e.g. a cache's hit count read just before
+        rendering. The total must only ever grow, as any counter's does.
+        """
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Gauge(_Metric):
+    """A value that is set to whatever it currently is, usually just before rendering"""
+
+    kind = "gauge"
+
+    def set(self, value: float, *label_values) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their count and sum"""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (), buckets=DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # per bucket counts, the last bucket is +Inf, then the sum
+                series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *label_values):
+        """Context manager observing how long its block took"""
+        return _Timer(self, label_values)
+
+    def _render_value(self, label_values: tuple, series: list) -> list[str]:
+        lines = []
+        cumulative = 0
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, series):
+            cumulative += count
+            labels = _labels(self.labels, label_values, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _labels(self.labels, label_values)
+        lines.append(f"{self.name}_sum{labels} {series[-1]}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+def instrument(cls: type, histogram: Histogram, skip: tuple = ()) -> None:
+    """
+    Wraps every public method of cls so each call is observed in histogram, labelled with
+    the method's name
+    """
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or name in skip or not callable(method):
+            continue
+        setattr(cls, name, _timed(histogram, name, method))
+
+
+def _timed(histogram: Histogram, name: str, method: Callable) -> Callable:
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start, name)
+
+    return timed
+
+
+def render() -> str:
+    """Renders every registered metric in the text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,250 @@
+"""Online migration of the legacy json column tables to the typed schema"""
+
+import time
+import sqlite3 as sql
+
+from src.database_access_layer import (
+    _connect,
+    _create_counters,
+    _create_data_versions,
+    _create_schema,
+    _create_search_index,
+    _is_legacy_schema,
+    _normalise_path,
+)
+
+# rows copied per transaction, small enough that the write lock is only ever held briefly
+MIGRATION_BATCH_SIZE = 1000
+
+# the new tables reuse these names, so they are only dropped once the copy is done and
+# until then keep serving reads from the legacy tables
+_LEGACY_INDEXES = ("idx_posts_date", "idx_posts_user_id", "idx_users_username")
+
+# triggers that mirror writes made to the legacy tables while the copy is running,
+# so the app does not have to be stopped for the migration
+_MIRROR_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS migrate_users_insert AFTER INSERT ON users
+    WHEN json_valid(NEW.json) BEGIN
+        INSERT OR REPLACE INTO users_new (user_id, username, password) VALUES (
+            NEW.user_id,
+            COALESCE(json_extract(NEW.json, '$.username'), ''),
+            COALESCE(json_extract(NEW.json, '$.password'), '')
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS migrate_users_update AFTER UPDATE ON users BEGIN
+        DELETE FROM users_new WHERE user_id = OLD.user_id;
+        INSERT OR REPLACE INTO users_new (user_id, username, password)
+        SELECT
+            NEW.user_id,
+            COALESCE(json_extract(NEW.json, '$.username'), ''),
+            COALESCE(json_extract(NEW.json, '$.password'), '')
+        WHERE json_valid(NEW.json);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS migrate_users_delete AFTER DELETE ON users BEGIN
+        DELETE FROM users_new WHERE user_id = OLD.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS migrate_posts_insert AFTER INSERT ON posts
+    WHEN json_valid(NEW.json) BEGIN
+        INSERT OR REPLACE INTO posts_new (post_id, user_id, content, image_ext, date)
+        VALUES (
+            CAST(NEW.post_id AS TEXT),
+            CAST(json_extract(NEW.json, '$.user_id') AS INTEGER),
+            COALESCE(json_extract(NEW.json, '$.content'), ''),
+            COALESCE(json_extract(NEW.json, '$.image_ext'), 'NONE'),
+            COALESCE(json_extract(NEW.json, '$.date'), '')
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS migrate_posts_update AFTER UPDATE ON posts BEGIN
+        DELETE FROM posts_new WHERE post_id = CAST(OLD.post_id AS TEXT);
+        INSERT OR REPLACE INTO posts_new (post_id, user_id, content, image_ext, date)
+        SELECT
+            CAST(NEW.post_id AS TEXT),
+            CAST(json_extract(NEW.json, '$.user_id') AS INTEGER),
+            COALESCE(json_extract(NEW.json, '$.content'), ''),
+            COALESCE(json_extract(NEW.json, '$.image_ext'), 'NONE'),
+            COALESCE(json_extract(NEW.json, '$.date'), '')
+        WHERE json_valid(NEW.json);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS migrate_posts_delete AFTER DELETE ON posts BEGIN
+        DELETE FROM posts_new WHERE post_id = CAST(OLD.post_id AS TEXT);
+    END
+    """,
+)
+
+# batch copies, rows already mirrored by the triggers are newer so they are kept. OR IGNORE
+# also drops rows the typed schema rejects, e.g. a post with no user_id.
+_COPY_USERS = """
+    INSERT OR IGNORE INTO users_new (user_id, username, password)
+    SELECT
+        user_id,
+        COALESCE(json_extract(json, '$.username'), ''),
+        COALESCE(json_extract(json, '$.password'), '')
+    FROM users
+    WHERE rowid > ? AND json_valid(json)
+    ORDER BY rowid LIMIT ?
+"""
+_COPY_POSTS = """
+    INSERT OR IGNORE INTO posts_new (post_id, user_id, content, image_ext, date)
+    SELECT
+        CAST(post_id AS TEXT),
+        CAST(json_extract(json, '$.user_id') AS INTEGER),
+        COALESCE(json_extract(json, '$.content'), ''),
+        COALESCE(json_extract(json, '$.image_ext'), 'NONE'),
+        COALESCE(json_extract(json, '$.date'), '')
+    FROM posts
+    WHERE rowid > ? AND json_valid(json)
+    ORDER BY rowid LIMIT ?
+"""
+
+
+def _copy_table(
+    connection: sql.Connection,
+    table: str,
+    key: str,
+    legacy_key: str,
+    copy_sql: str,
+    batch_size: int,
+    pause: float,
+) -> tuple[int, int]:
+    """
+    Copies a legacy table into its new table in rowid order, one short transaction per batch.
+    key is the new table's primary key and legacy_key the legacy row's value for it, rows
+    already there (mirrored by a trigger or copied before an interruption) count as migrated.
+
+    Returns:
+        tuple: (rows migrated, rows skipped because their json could not be parsed or the
+        new table rejected them)
+    """
+    last_rowid = 0
+    migrated = 0
+    skipped = 0
+    while True:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            batch = connection.execute(
+                f"""
+                SELECT rowid, EXISTS (
+                    SELECT 1 FROM {table}_new WHERE {table}_new.{key} = {legacy_key}
+                )
+                FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?
+                """,
+                [last_rowid, batch_size],
+            ).fetchall()
+            copied = 0
+            if batch:
+                copied = connection.execute(copy_sql, [last_rowid, batch_size]).rowcount
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        if not batch:
+            return migrated, skipped
+
+        present = sum(1 for _, exists in batch if exists)
+        migrated += present + copied
+        skipped += len(batch) - present - copied
+        last_rowid = batch[-1][0]
+
+        # give the app's writers a chance at the lock between batches
+        if pause:
+            time.sleep(pause)
+
+
+def migrate_legacy_schema(
+    path: str, batch_size: int = MIGRATION_BATCH_SIZE, pause: float = 0.0
+) -> dict | None:
+    """
+    Converts a database using the legacy json column tables to the typed schema in place.
+
+    The new tables are built next to the old ones and filled in batches, with triggers on the
+    legacy tables mirroring any writes made in the meantime. The final swap only drops and
+    renames tables so the write lock is never held for longer than a single batch or index
+    build. Running it again after an interruption picks up where it left off.
+
+    Parameters:
+        path: path to the database file
+        batch_size: number of rows copied per transaction
+        pause: seconds to sleep between batches
+
+    Returns:
+        dict: number of users and posts migrated, and of those skipped because their json
+        could not be parsed or the typed schema rejected them
+        None: if the database does not use the legacy schema
+
+    Raises:
+        None
+    """
+    connection = _connect(_normalise_path(path))
+    connection.isolation_level = None
+
+    try:
+        if not _is_legacy_schema(connection):
+            return None
+
+        # each statement commits on its own and is safe to repeat after an interruption.
+        # Indexes named like a legacy one are left out here, the copy is faster without them.
+        _create_schema(connection, users="users_new", posts="posts_new")
+        for trigger in _MIRROR_TRIGGERS:
+            connection.execute(trigger)
+
+        users, users_skipped = _copy_table(
+            connection,
+            "users",
+            "user_id",
+            "users.user_id",
+            _COPY_USERS,
+            batch_size,
+            pause,
+        )
+        posts, posts_skipped = _copy_table(
+            connection,
+            "posts",
+            "post_id",
+            "CAST(posts.post_id AS TEXT)",
+            _COPY_POSTS,
+            batch_size,
+            pause,
+        )
+
+        # the legacy indexes served reads until now, each new one is built in a single
+        # statement that holds the write lock while it runs
+        for index in _LEGACY_INDEXES:
+            connection.execute(f"DROP INDEX IF EXISTS {index}")
+        _create_schema(connection, users="users_new", posts="posts_new")
+
+        # swap the tables in, renaming users_new also rewrites the posts foreign key
+        connection.execute("BEGIN IMMEDIATE")
+        for table in ("users", "posts"):
+            for event in ("insert", "update", "delete"):
+                connection.execute(f"DROP TRIGGER IF EXISTS migrate_{table}_{event}")
+        connection.execute("DROP TABLE posts")
+        connection.execute("DROP TABLE users")
+        connection.execute("ALTER TABLE users_new RENAME TO users")
+        connection.execute("ALTER TABLE posts_new RENAME TO posts")
+        connection.execute("COMMIT")
+
+        # the search index and counters are built from the swapped in posts table
+        _create_search_index(connection)
+        _create_counters(connection)
+        _create_data_versions(connection)
+
+        return {
+            "users": users,
+            "users_skipped": users_skipped,
+            "posts": posts,
+            "posts_skipped": posts_skipped,
+        }
+    finally:
+        connection.close()
@@ -0,0 +1,171 @@
+"""Password hashing and verification run off the request threads in a bounded process pool"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+from src.metrics import Counter
+
+# werkzeug method string new hashes are made with, e.g. "scrypt:32768:8:1" or
+# "pbkdf2:sha256:600000". Stored hashes made with anything else are redone at next login.
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+# processes doing KDF work, 0 runs it on the calling thread
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# hashes running or waiting for a process, past this a request is turned away with a 503
+# instead of tying up a server thread behind a queue of logins. 0 means no limit.
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", max(HASH_WORKERS, 1) * 4))
+
+HASHES_REJECTED = Counter(
+    "password_hashes_rejected_total", "Password hashes turned away with the pool full"
+)
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+class HasherBusy(Exception):
+    """
+    Raised when HASH_QUEUE_LIMIT hashes are already running or waiting, or when the
+    worker processes died again straight after being replaced
+    """
+
+
+def normalise_method(method: str) -> str:
+    """
+    Spells out werkzeug's defaults so the method can be compared with the prefix of a
+    stored hash, e.g. "scrypt" -> "scrypt:32768:8:1"
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        defaults = ["32768", "8", "1"]
+    elif name == "pbkdf2":
+        defaults = ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+    return ":".join([name, *args, *defaults[len(args) :]])
+
+
+class PasswordHasher:
+    """
+    Runs werkzeug's generate_password_hash and check_password_hash in a pool of worker
+    processes. At most queue_limit calls are in flight at once, any more raise HasherBusy
+    straight away rather than waiting. A queue_limit of 0 or None means no limit.
+    """
+
+    def __init__(
+        self,
+        method: str = PASSWORD_HASH_METHOD,
+        workers: int = HASH_WORKERS,
+        queue_limit: int = HASH_QUEUE_LIMIT,
+    ):
+        self.method = normalise_method(method)
+        self.workers = workers
+        self._slots = (
+            threading.BoundedSemaphore(queue_limit)
+            if queue_limit and queue_limit > 0
+            else None
+        )
+        self._executor = None
+        # set once a broken pool has been replaced, see _get_executor
+        self._replaced = False
+        self._lock = threading.Lock()
+
+    def hash(self, password: str) -> str:
+        """Returns a new hash of the password made with this hasher's method"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        """Returns True if the password matches the stored hash"""
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """Returns True if the stored hash was made with a different method"""
+        return pwhash.split("$", 1)[0] != self.method
+
+    def start(self) -> None:
+        """
+        Starts the worker processes now rather than on the first hash. Call it before the
+        process starts any threads: forking copies whatever locks other threads hold at
+        that moment, and a child could then block on one of them forever.
+        """
+        if self.workers:
+            # a fork pool launches every worker on its first job, wait for them to be up
+            self._get_executor().submit(int).result()
+
+    def _run(self, function, *args):
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            HASHES_REJECTED.inc()
+            raise HasherBusy("too many password hashes in flight")
+        try:
+            if not self.workers:
+                return function(*args)
+            # a worker killed mid hash (OOM killer, segfault) breaks the whole pool, it is
+            # replaced and the hash retried once rather than every later call failing
+            for _ in range(2):
+                executor = self._get_executor()
+                try:
+                    return executor.submit(function, *args).result()
+                except BrokenProcessPool:
+                    self._discard(executor)
+            raise HasherBusy("password hashing processes keep dying")
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # fork where possible, the children only ever run hashlib. Without
+                # start() this happens on the first hash, which is only safe in a
+                # process with no other threads. A pool replacing a broken one is made
+                # with the server threads running, so it comes from a fork server.
+                methods = multiprocessing.get_all_start_methods()
+                if "fork" in methods and not self._replaced:
+                    method = "fork"
+                elif "forkserver" in methods:
+                    method = "forkserver"
+                else:
+                    method = "spawn"
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(method),
+                )
+            return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        """Drops a broken pool, unless another thread has already replaced it"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._replaced = True
+        executor.shutdown(wait=False)
+
+    def close(self) -> None:
+        """Shuts the worker processes down"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def get_hasher() -> PasswordHasher:
+    """Returns the process wide hasher, creating it on first use"""
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None:
+            _hasher = PasswordHasher()
+        return _hasher
+
+
+def hash_password(password: str) -> str:
+    """Hashes a password with PASSWORD_HASH_METHOD, raises HasherBusy if the pool is full"""
+    return get_hasher().hash(password)
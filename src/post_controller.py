@@ -1,27 +1,133 @@
 """ Module for managing posts """
 from flask import jsonify, flash
 from datetime import datetime
+import base64
+import json
 import os
+import re
+from typing import Iterator
 from uuid import uuid4
 from werkzeug.utils import secure_filename
 import datetime
 
-from src.database_access_layer import Database
+from src.database_access_layer import Database, ConnectionPool
 from src.constants import *
 
 UPLOAD_FOLDER = "./images/"
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
 APP_DIR = os.path.abspath(os.path.dirname(__file__))
 
+# feed rows carry the author's username, posts of deleted users show as [deleted]
+_FEED_COLUMNS = """
+    p.post_id,
+    p.user_id,
+    p.image_ext,
+    p.content,
+    p.date,
+    COALESCE(u.username, '[deleted]') AS username
+"""
+_SELECT_FEED_FIRST = f"""
+    SELECT {_FEED_COLUMNS}
+    FROM posts p
+    LEFT JOIN users u ON u.user_id = p.user_id
+    ORDER BY p.date DESC, p.post_id DESC
+    LIMIT ?
+"""
+# keyset pagination, the row value comparison is a range seek on idx_posts_date so a
+# deep page costs the same as the first one
+_SELECT_FEED_BEFORE = f"""
+    SELECT {_FEED_COLUMNS}
+    FROM posts p
+    LEFT JOIN users u ON u.user_id = p.user_id
+    WHERE (p.date, p.post_id) < (?, ?)
+    ORDER BY p.date DESC, p.post_id DESC
+    LIMIT ?
+"""
+# the same keyset pagination over one user's posts, a seek on idx_posts_user_date_id
+_SELECT_USER_FEED_FIRST = f"""
+    SELECT {_FEED_COLUMNS}
+    FROM posts p
+    LEFT JOIN users u ON u.user_id = p.user_id
+    WHERE p.user_id = ?
+    ORDER BY p.date DESC, p.post_id DESC
+    LIMIT ?
+"""
+_SELECT_USER_FEED_BEFORE = f"""
+    SELECT {_FEED_COLUMNS}
+    FROM posts p
+    LEFT JOIN users u ON u.user_id = p.user_id
+    WHERE p.user_id = ? AND (p.date, p.post_id) < (?, ?)
+    ORDER BY p.date DESC, p.post_id DESC
+    LIMIT ?
+"""
+
+# ranked full text search, bm25 rank is negative so better matches sort first. The
+# MATCH is answered from the posts_fts index and only the matching rows are joined
+_SELECT_SEARCH_FIRST = f"""
+    SELECT {_FEED_COLUMNS}, s.rank AS rank
+    FROM posts_fts s
+    JOIN posts p ON p.rowid = s.rowid
+    LEFT JOIN users u ON u.user_id = p.user_id
+    WHERE posts_fts MATCH ?
+    ORDER BY s.rank, p.post_id
+    LIMIT ?
+"""
+_SELECT_SEARCH_AFTER = f"""
+    SELECT {_FEED_COLUMNS}, s.rank AS rank
+    FROM posts_fts s
+    JOIN posts p ON p.rowid = s.rowid
+    LEFT JOIN users u ON u.user_id = p.user_id
+    WHERE posts_fts MATCH ? AND (s.rank, p.post_id) > (?, ?)
+    ORDER BY s.rank, p.post_id
+    LIMIT ?
+"""
+_SEARCH_TERM = re.compile(r"\w+")
+
+
+class FeedPage:
+    """
+    A page of posts read lazily, for streaming templates. Iterating it yields at most
+    page_size posts as they come off the cursor, has_more and next_cursor are only known
+    once it has been iterated.
+    """
+
+    def __init__(self, rows: Iterator[dict], page_size: int, has_more: bool = False):
+        self._rows = rows
+        self.page_size = page_size
+        self.has_more = has_more
+        self.next_cursor = None
+
+    def __iter__(self) -> Iterator[dict]:
+        last = None
+        for count, row in enumerate(self._rows):
+            # the extra row only says there is another page, the rows are read to the end
+            # so the cursor finishes and the page can be cached
+            if count >= self.page_size:
+                self.has_more = True
+                continue
+            last = row
+            yield row
+        if self.has_more and last is not None:
+            self.next_cursor = encode_cursor(last)
+
 
 class PostController:
     """Post controller class"""
 
-    def __init__(self, database_path: str = None, db: Database = None) -> None:
+    def __init__(
+        self,
+        database_path: str = None,
+        db: Database = None,
+        pool: ConnectionPool = None,
+    ) -> None:
         """Constructor for the PostController class"""
         if db is not None:
             self.db = db
             self._owns_db = False
+        elif pool is not None:
+            # a pooled Database hands its connection back to the pool on close
+            self.db = Database(pool=pool)
+            self._owns_db = True
         else:
             self.db = Database(database_path)
             self._owns_db = True
@@ -48,80 +154,147 @@ class PostController:
         return self.db.insert_post(post)
 
     def get_posts(
-        self, page: int = None, page_size: int = 10
+        self, before: str = None, page_size: int = 10
     ) -> tuple[list[dict], bool]:
-        """Returns a list of posts in the database, optionally paginated, with usernames included.
+        """Returns a page of posts in the database, newest first, with usernames included.
+
+        Args:
+            before: cursor from encode_cursor, only posts older than it are returned
+            page_size: number of posts per page
 
         Returns:
             tuple: (list of posts, has_more boolean)
-        """
 
-        post_collection = []
-        query = """
-            SELECT
-                p.post_id,
-                json_extract(p.json, '$.user_id'),
-                json_extract(p.json, '$.image_ext'),
-                json_extract(p.json, '$.content'),
-                json_extract(p.json, '$.date'),
-                COALESCE(json_extract(u.json, '$.username'), '[deleted]')
-            FROM posts p
-            LEFT JOIN users u ON json_extract(p.json, '$.user_id') = CAST(u.user_id AS TEXT)
-            ORDER BY json_extract(p.json, '$.date') DESC
+        Raises:
+            ValueError: if the cursor is malformed
         """
-        if page is not None:
-            # Fetch one extra to check if there are more pages
-            query += f" LIMIT {page_size + 1} OFFSET {(page-1)*page_size}"
 
-        posts = self.db.connection.execute(query).fetchall()
+        key = None if before is None else decode_cursor(before)
+
+        # pages are cached until a write touches them
+        cache = self.db.feed_cache
+        cached = cache.get(key, page_size)
+        if cached is not None:
+            return cached
+        generation = cache.generation
+
+        # Fetch one extra to check if there are more pages
+        if key is None:
+            posts = self.db.fetch_all(_SELECT_FEED_FIRST, [page_size + 1])
+        else:
+            posts = self.db.fetch_all(_SELECT_FEED_BEFORE, [*key, page_size + 1])
+        cache.put(key, page_size, posts, generation)
 
         # Check if there are more posts than page_size
-        has_more = len(posts) > page_size if page is not None else False
+        has_more = len(posts) > page_size
         # Only return up to page_size posts
-        posts = posts[:page_size] if page is not None else posts
-
-        for post_id, user_id, image_ext, content, date, username in posts:
-            structured_post = {}
-            structured_post[POST_ID] = validate_value(post_id)
-            structured_post[USER_ID] = validate_value(user_id)
-            structured_post[IMAGE_EXT] = validate_value(image_ext)
-            structured_post[CONTENT] = validate_value(content)
-            structured_post[DATE] = validate_value(date)
-            structured_post[USERNAME] = validate_value(username) or "[deleted]"
-            post_collection.append(structured_post)
-
-        return post_collection, has_more
-
-    def get_user_posts(self, user_id: str) -> list[dict]:
-        """Returns all posts for a specific user, with username included"""
-
-        post_collection = []
-        query = """
-            SELECT
-                p.post_id,
-                json_extract(p.json, '$.user_id'),
-                json_extract(p.json, '$.image_ext'),
-                json_extract(p.json, '$.content'),
-                json_extract(p.json, '$.date'),
-                COALESCE(json_extract(u.json, '$.username'), '[deleted]')
-            FROM posts p
-            LEFT JOIN users u ON json_extract(p.json, '$.user_id') = CAST(u.user_id AS TEXT)
-            WHERE json_extract(p.json, '$.user_id') = ?
-            ORDER BY json_extract(p.json, '$.date') DESC LIMIT 100 OFFSET 0
+        posts = posts[:page_size]
+
+        return posts, has_more
+
+    def stream_posts(self, before: str = None, page_size: int = 10) -> FeedPage:
+        """Returns the same page as get_posts, read from the database as it is iterated.
+
+        Args:
+            before: cursor from encode_cursor, only posts older than it are returned
+            page_size: number of posts per page
+
+        Returns:
+            FeedPage: the page, its has_more and next_cursor are set once it is iterated
+
+        Raises:
+            ValueError: if the cursor is malformed, straight away rather than mid page
+        """
+
+        key = None if before is None else decode_cursor(before)
+
+        cache = self.db.feed_cache
+        cached = cache.get(key, page_size)
+        if cached is not None:
+            posts, has_more = cached
+            return FeedPage(iter(posts), page_size, has_more)
+        return FeedPage(self._read_feed(key, page_size, cache.generation), page_size)
+
+    def _read_feed(self, key, page_size: int, generation: int) -> Iterator[dict]:
+        """
+        Yields a feed page's rows plus the extra one, then caches them. The rows are kept
+        for the cache as they go by, so memory still grows with page_size, what streaming
+        saves is holding the rendered page.
+        """
+        if key is None:
+            rows = self.db.fetch_iter(_SELECT_FEED_FIRST, [page_size + 1])
+        else:
+            rows = self.db.fetch_iter(_SELECT_FEED_BEFORE, [*key, page_size + 1])
+
+        page = []
+        for row in rows:
+            page.append(row)
+            yield row
+        self.db.feed_cache.put(key, page_size, page, generation)
+
+    def search_posts(
+        self, query: str, after: str = None, page_size: int = 10
+    ) -> tuple[list[dict], bool]:
+        """Returns a page of posts whose content matches every word of the query, best match first.
+
+        Args:
+            query: text typed by the user, FTS5 syntax in it is treated as plain words
+            after: cursor from encode_search_cursor, only worse matches than it are returned
+            page_size: number of posts per page
+
+        Returns:
+            tuple: (list of posts, has_more boolean)
+
+        Raises:
+            ValueError: if the cursor is malformed
+        """
+
+        match = fts_query(query)
+        if match is None:
+            return [], False
+
+        if after is None:
+            posts = self.db.fetch_all(_SELECT_SEARCH_FIRST, [match, page_size + 1])
+        else:
+            rank, post_id = decode_search_cursor(after)
+            posts = self.db.fetch_all(
+                _SELECT_SEARCH_AFTER, [match, rank, post_id, page_size + 1]
+            )
+
+        has_more = len(posts) > page_size
+        posts = posts[:page_size]
+
+        return posts, has_more
+
+    def get_user_posts(
+        self, user_id: str, before: str = None, page_size: int = 100
+    ) -> tuple[list[dict], bool]:
+        """Returns a page of a specific user's posts, newest first, with username included.
+
+        Args:
+            user_id: the author whose posts are returned
+            before: cursor from encode_cursor, only posts older than it are returned
+            page_size: number of posts per page
+
+        Returns:
+            tuple: (list of posts, has_more boolean)
+
+        Raises:
+            ValueError: if the cursor is malformed
         """
-        posts = self.db.connection.execute(query, (user_id,)).fetchall()
 
-        for post_id, uid, image_ext, content, date, username in posts:
-            structured_post = {}
-            structured_post[POST_ID] = validate_value(post_id)
-            structured_post[USER_ID] = validate_value(uid)
-            structured_post[IMAGE_EXT] = validate_value(image_ext)
-            structured_post[CONTENT] = validate_value(content)
-            structured_post[DATE] = validate_value(date)
-            structured_post[USERNAME] = validate_value(username) or "[deleted]"
-            post_collection.append(structured_post)
+        if before is None:
+            posts = self.db.fetch_all(_SELECT_USER_FEED_FIRST, [user_id, page_size + 1])
+        else:
+            posts = self.db.fetch_all(
+                _SELECT_USER_FEED_BEFORE,
+                [user_id, *decode_cursor(before), page_size + 1],
+            )
+
+        has_more = len(posts) > page_size
+        posts = posts[:page_size]
 
-        return post_collection
+        return posts, has_more
 
     def get_post(self, date) -> dict:
         """Returns a specific post from the database"""
@@ -162,6 +335,20 @@ class PostController:
             return None
         return f"{post[POST_ID]}{post[IMAGE_EXT]}"
 
+    def get_srcset(self, post: dict) -> str:
+        """
+        Builds the img srcset for the feed sized src and the larger derivatives by pixel
+        density. Only the variant boxes are known here, and a box is not the width of a
+        portrait image, but the ratio of two boxes holds whatever the image's shape.
+        """
+        filename = self.get_filename(post)
+        base = IMAGE_VARIANTS["feed"]
+        return ", ".join(
+            f"/get_image/{filename}?size={variant} {box / base:g}x"
+            for variant, box in sorted(IMAGE_VARIANTS.items(), key=lambda v: v[1])
+            if box >= base
+        )
+
     def get_username(self, post: dict):
         user = self.db.get_user_by_id(post.get(USER_ID))
         if user is None:
@@ -177,7 +364,8 @@ class PostController:
     def upload_image(self, file, post_id, upload_dir) -> bool:
         """
         Opens file, checks to ensure it is an image then saves it to the uploads folder.
-        Image resizing is done asynchronously in a background thread to avoid blocking.
+        The original is kept, its resized derivatives are made asynchronously in a background
+        thread to avoid blocking.
         """
         if "." not in file.filename:
             return None
@@ -191,21 +379,87 @@ class PostController:
         file_path = os.path.join(upload_dir, safe_name)
         file.save(file_path)
 
-        # Queue resize in background instead of blocking the request
-        from src.image_queue import queue_resize
+        # Queue the derivatives in background instead of blocking the request
+        from src.image_queue import queue_variants
 
-        queue_resize(file_path)
+        queue_variants(file_path, self.db)
 
         return image_ext
 
 
-def validate_value(value):
+def _encode_key(key: list) -> str:
+    """Packs a pagination key into an opaque url safe cursor"""
+    packed = json.dumps(key, separators=(",", ":"))
+    return base64.urlsafe_b64encode(packed.encode()).decode().rstrip("=")
+
+
+def _decode_key(cursor: str, types: tuple) -> list:
+    """
+    Unpacks a cursor made by _encode_key, checking each value against types
+
+    Raises:
+        ValueError: if the cursor is malformed or holds the wrong kind of key
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor {cursor!r}") from e
+    if (
+        not isinstance(key, list)
+        or len(key) != len(types)
+        or not all(isinstance(value, kind) for value, kind in zip(key, types))
+    ):
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return key
+
+
+def encode_cursor(post: dict) -> str:
+    """Builds the opaque pagination cursor pointing just past the given post"""
+    return _encode_key([post[DATE], str(post[POST_ID])])
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """
+    Reads the (date, post_id) key back out of a pagination cursor
+
+    Raises:
+        ValueError: if the cursor was not made by encode_cursor
+    """
+    date, post_id = _decode_key(cursor, (str, str))
+    return date, post_id
+
+
+def encode_search_cursor(post: dict) -> str:
+    """Builds the cursor pointing just past the given search result"""
+    return _encode_key([post["rank"], str(post[POST_ID])])
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, str]:
+    """
+    Reads the (rank, post_id) key back out of a search cursor
+
+    Raises:
+        ValueError: if the cursor was not made by encode_search_cursor
+    """
+    rank, post_id = _decode_key(cursor, ((int, float), str))
+    return float(rank), post_id
+
+
+def fts_query(text: str) -> str | None:
+    """
+    Turns user input into an FTS5 query matching every word in it. Each word is quoted so
+    operators, column filters and stray quotes are searched for literally instead of
+    being parsed as FTS5 syntax.
 
-    if not value:
-        return value
-    if isinstance(value, tuple):
-        return value[0]
-    return value
+    Returns:
+        str: the MATCH expression
+        None: if the text has no words to search for
+    """
+    words = _SEARCH_TERM.findall(text or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words)
 
 
 # db = Database("test.db")
@@ -0,0 +1,255 @@
+"""Token bucket rate limits for the routes that cost a password hash or a write"""
+
+import os
+import sqlite3 as sql
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from src.metrics import Counter
+
+# buckets remembered by the in process limiter, the least recently used one is dropped
+# past this. A dropped bucket starts out full again, which only ever errs towards allowing.
+RATE_LIMIT_KEYS = 65536
+
+# set to a database file to share the buckets between processes, e.g. several waitress
+# processes behind a load balancer. Kept apart from the app's database so counting
+# requests never waits on its write lock.
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB")
+
+# shared buckets idle for this long have refilled and are deleted, every limit below
+# must refill completely in less time
+RATE_LIMIT_IDLE = 3600.0
+# shared buckets are pruned once every this many checks
+RATE_LIMIT_PRUNE_EVERY = 1000
+
+
+class Limit(NamedTuple):
+    # requests allowed in a burst
+    capacity: float
+    # requests allowed per second once the burst is used up
+    rate: float
+
+
+def _limit(name: str, requests: int, seconds: float) -> Limit | None:
+    """
+    Reads RATE_LIMIT_<NAME> from the environment as "<requests>/<seconds>", e.g.
+    RATE_LIMIT_REGISTER_IP=50/3600, falling back to the default given. 0 requests turns
+    the limit off, e.g. for a load test.
+    """
+    variable = f"RATE_LIMIT_{name.upper()}"
+    value = os.environ.get(variable)
+    if value:
+        try:
+            requests, seconds = value.split("/")
+            requests, seconds = int(requests), float(seconds)
+        except ValueError:
+            raise ValueError(
+                f"{variable} must look like 5/3600, not {value!r}"
+            ) from None
+        if not 0 < seconds <= RATE_LIMIT_IDLE:
+            raise ValueError(f"{variable} must refill within {RATE_LIMIT_IDLE:.0f}s")
+    if requests <= 0:
+        return None
+    return Limit(capacity=requests, rate=requests / seconds)
+
+
+# requests allowed per window for each limit, a burst of all of them is allowed and they
+# come back evenly over the window. Every one can be overridden, see _limit.
+LIMITS = {
+    # each attempt costs a password verification
+    "login_ip": _limit("login_ip", 20, 60),
+    "login_user": _limit("login_user", 5, 300),
+    # an hour per IP, raise it for sites with many users behind one NAT or proxy
+    "register_ip": _limit("register_ip", 5, 3600),
+    # each post costs a write and maybe an image save
+    "post_ip": _limit("post_ip", 30, 60),
+    "post_user": _limit("post_user", 10, 60),
+}
+
+RATE_LIMITED = Counter(
+    "rate_limited_total", "Requests turned away by a rate limit", ("limit",)
+)
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def _refill(tokens: float, updated: float, now: float, limit: Limit) -> float:
+    return min(limit.capacity, tokens + max(now - updated, 0.0) * limit.rate)
+
+
+def _wait(tokens: float, limit: Limit) -> float:
+    """Seconds until a bucket holding tokens has one to spare"""
+    return (1 - tokens) / limit.rate
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets for this process only, in a bounded LRU keyed by (limit, key). Safe to
+    share between threads.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        # (limit name, key) -> (tokens, updated)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, name: str, key: str, limit: Limit = None) -> float:
+        """
+        Takes a token from the key's bucket for the named limit.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise seconds until it would be
+        """
+        limit = limit or LIMITS[name]
+        bucket = (name, key)
+        with self._lock:
+            now = self.clock()
+            tokens, updated = self._buckets.get(bucket, (limit.capacity, now))
+            tokens = _refill(tokens, updated, now, limit)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[bucket] = (tokens, now)
+            self._buckets.move_to_end(bucket)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else _wait(tokens, limit)
+
+    def peek(self, name: str, key: str, limit: Limit = None) -> float:
+        """Same as acquire without taking the token or touching the bucket"""
+        limit = limit or LIMITS[name]
+        with self._lock:
+            now = self.clock()
+            tokens, updated = self._buckets.get((name, key), (limit.capacity, now))
+        tokens = _refill(tokens, updated, now, limit)
+        return 0.0 if tokens >= 1 else _wait(tokens, limit)
+
+
+# refill and take a token in one statement, so concurrent processes never both spend the
+# same token. allowed records whether this request got one.
+_CREATE_BUCKETS = """
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        bucket TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated REAL NOT NULL,
+        allowed INTEGER NOT NULL
+    ) WITHOUT ROWID
+"""
+_TAKE_TOKEN = """
+    INSERT INTO rate_limits (bucket, tokens, updated, allowed)
+    VALUES (:bucket, :capacity - 1, :now, 1)
+    ON CONFLICT (bucket) DO UPDATE SET
+        tokens = min(:capacity, tokens + max(:now - updated, 0) * :rate)
+            - (min(:capacity, tokens + max(:now - updated, 0) * :rate) >= 1),
+        allowed = min(:capacity, tokens + max(:now - updated, 0) * :rate) >= 1,
+        updated = :now
+    RETURNING tokens, allowed
+"""
+_PEEK_BUCKET = "SELECT tokens, updated FROM rate_limits WHERE bucket = ?"
+_PRUNE_BUCKETS = "DELETE FROM rate_limits WHERE updated < ?"
+
+
+class SQLiteRateLimiter:
+    """
+    Token buckets kept in a SQLite file so every process using the file shares them.
+    Each thread gets its own autocommit connection.
+    """
+
+    def __init__(self, path: str, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._local = threading.local()
+        self._checks = 0
+        self._connection().execute(_CREATE_BUCKETS)
+
+    def _connection(self) -> sql.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sql.connect(self.path, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+        return connection
+
+    def acquire(self, name: str, key: str, limit: Limit = None) -> float:
+        """Same as TokenBucketLimiter.acquire, with the bucket stored in the file"""
+        limit = limit or LIMITS[name]
+        now = self.clock()
+        connection = self._connection()
+        tokens, allowed = connection.execute(
+            _TAKE_TOKEN,
+            {
+                "bucket": f"{name}:{key}",
+                "capacity": limit.capacity,
+                "rate": limit.rate,
+                "now": now,
+            },
+        ).fetchone()
+
+        # not locked, an occasional extra or missed prune does not matter
+        self._checks += 1
+        if self._checks % RATE_LIMIT_PRUNE_EVERY == 0:
+            connection.execute(_PRUNE_BUCKETS, [now - RATE_LIMIT_IDLE])
+        return 0.0 if allowed else _wait(tokens, limit)
+
+    def peek(self, name: str, key: str, limit: Limit = None) -> float:
+        """Same as acquire without taking the token or touching the bucket"""
+        limit = limit or LIMITS[name]
+        now = self.clock()
+        row = self._connection().execute(_PEEK_BUCKET, [f"{name}:{key}"]).fetchone()
+        if row is None:
+            return 0.0
+        tokens = _refill(row[0], row[1], now, limit)
+        return 0.0 if tokens >= 1 else _wait(tokens, limit)
+
+
+def get_limiter() -> TokenBucketLimiter | SQLiteRateLimiter:
+    """Returns the process wide limiter, shared through RATE_LIMIT_DB if it is set"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = (
+                SQLiteRateLimiter(RATE_LIMIT_DB)
+                if RATE_LIMIT_DB
+                else TokenBucketLimiter()
+            )
+        return _limiter
+
+
+def check_limits(*buckets: tuple[str, str], limiter=None) -> float:
+    """
+    Takes a token from each (limit name, key) bucket, keys that are empty and limits that
+    are turned off are skipped.
+    Every bucket is checked before any token is taken, so a request turned away by one
+    limit never spends the others, e.g. a flood of logins from one IP cannot empty the
+    login bucket of the username it targets.
+
+    Returns:
+        float: 0 if every limit allows the request, otherwise the longest wait in seconds
+    """
+    limiter = limiter or get_limiter()
+    buckets = [(name, key) for name, key in buckets if key and LIMITS[name] is not None]
+
+    wait = 0.0
+    for name, key in buckets:
+        retry_after = limiter.peek(name, key)
+        if retry_after:
+            RATE_LIMITED.inc(name)
+            wait = max(wait, retry_after)
+    if wait:
+        return wait
+
+    # another request may have spent a token since the check, this only errs towards
+    # turning the request away
+    for name, key in buckets:
+        retry_after = limiter.acquire(name, key)
+        if retry_after:
+            RATE_LIMITED.inc(name)
+            wait = max(wait, retry_after)
+    return wait
@@ -0,0 +1,162 @@
+import os
+
+import pytest
+from src.constants import *
+
+# point the app's pools at the test database before it opens them
+os.environ["DATABASE_PATH"] = TEST_DATABASE_PATH
+
+from app import API_MAX_PAGE_SIZE, UPLOAD_DIR, app, image_index
+from src.database_access_layer import Database
+from src.post_controller import PostController
+
+
+def seed(post_count: int) -> int:
+    """Resets the test database to one user with post_count posts, returns the user id"""
+    db = Database(TEST_DATABASE_PATH)
+    db.reset_tables()
+    user_id = db.create_user({USERNAME: "api_user", PASSWORD: "password"})
+    db.insert_posts(
+        {
+            POST_ID: f"{i:03d}",
+            USER_ID: str(user_id),
+            CONTENT: f"post{i}",
+            DATE: f"2026-02-15 12:{i // 60:02d}:{i % 60:02d}",
+        }
+        for i in range(post_count)
+    )
+    db.close()
+    return user_id
+
+
+class TestApp:
+
+    # TEST-APP-ITGR-0001
+    def test_api_fields(self):
+
+        # initialize
+        seed(3)
+        client = app.test_client()
+
+        # compute
+        picked = client.get("/api/posts?fields=post_id,content")
+        unknown = client.get("/api/posts?fields=post_id,password")
+
+        # assert
+        assert picked.status_code == 200
+        assert picked.json["posts"] == [
+            {POST_ID: "002", CONTENT: "post2"},
+            {POST_ID: "001", CONTENT: "post1"},
+            {POST_ID: "000", CONTENT: "post0"},
+        ]
+        assert unknown.status_code == 400
+        assert unknown.json == {"ok": False, "error": "unknown fields password"}
+
+    # TEST-APP-ITGR-0002
+    def test_api_cursor_round_trip(self):
+
+        # initialize
+        user_id = seed(25)
+        client = app.test_client()
+
+        # compute
+        pages = {}
+        for url in ("/api/posts", f"/api/users/{user_id}/posts"):
+            post_ids, before = [], ""
+            while before is not None:
+                body = client.get(f"{url}?limit=10&fields=post_id&before={before}").json
+                post_ids += [post[POST_ID] for post in body["posts"]]
+                before = body["next"]
+            pages[url] = post_ids
+        bad_cursor = client.get("/api/posts?before=not-a-cursor")
+
+        # assert
+        # every post exactly once, newest first, on both feeds
+        expected = [f"{i:03d}" for i in reversed(range(25))]
+        assert list(pages.values()) == [expected, expected]
+        assert bad_cursor.status_code == 400
+
+    # TEST-APP-ITGR-0003
+    def test_api_limit_is_clamped(self):
+
+        # initialize
+        seed(API_MAX_PAGE_SIZE + 5)
+        client = app.test_client()
+
+        # compute
+        too_large = client.get("/api/posts?limit=1000")
+        too_small = client.get("/api/posts?limit=0")
+        not_a_number = client.get("/api/posts?limit=ten")
+
+        # assert
+        assert len(too_large.json["posts"]) == API_MAX_PAGE_SIZE
+        assert too_large.json["next"] is not None
+        assert len(too_small.json["posts"]) == 1
+        assert not_a_number.status_code == 400
+
+    # TEST-APP-ITGR-0004
+    def test_api_unknown_user(self):
+
+        # initialize
+        user_id = seed(0)
+        client = app.test_client()
+
+        # compute
+        unknown = client.get(f"/api/users/{user_id + 1}/posts")
+        no_posts = client.get(f"/api/users/{user_id}/posts")
+
+        # assert
+        assert unknown.status_code == 404
+        assert unknown.json == {"ok": False, "error": "user not found"}
+        assert no_posts.status_code == 200
+        assert no_posts.json == {"posts": [], "next": None}
+
+    # TEST-APP-ITGR-0005
+    def test_home_revalidates(self):
+
+        # initialize
+        user_id = seed(3)
+        client = app.test_client()
+        first = client.get("/")
+        etag = first.get_etag()[0]
+
+        # compute
+        repeat = client.get("/", headers={"If-None-Match": f'"{etag}"'})
+        db = Database(TEST_DATABASE_PATH)
+        with PostController(db=db) as posts:
+            posts.create_post(
+                {POST_ID: "new", USER_ID: str(user_id), CONTENT: "fresh post"}
+            )
+        db.close()
+        changed = client.get("/", headers={"If-None-Match": f'"{etag}"'})
+
+        # assert
+        assert first.status_code == 200
+        assert repeat.status_code == 304
+        assert repeat.get_etag()[0] == etag
+        assert repeat.data == b""
+        # the data_versions triggers moved the ETag on, the new post is rendered
+        assert changed.status_code == 200
+        assert changed.get_etag()[0] != etag
+        assert b"fresh post" in changed.data
+
+    # TEST-APP-ITGR-0006
+    def test_image_deleted_after_indexing(self):
+
+        # initialize
+        path = os.path.join(UPLOAD_DIR, "deleted-after-indexing.png")
+        with open(path, "wb") as file:
+            file.write(b"not really a png")
+        client = app.test_client()
+        served = client.get("/get_image/deleted-after-indexing.png")
+        served.close()
+
+        # compute
+        os.remove(path)
+        stale = client.get("/get_image/deleted-after-indexing.png")
+
+        # assert
+        assert served.status_code == 200
+        # the stale entry is a 404 rather than a 500, and is dropped from the index
+        assert stale.status_code == 404
+        assert "deleted-after-indexing.png" not in image_index._entries
@@ -1,6 +1,7 @@
 import pytest
 from src.auth_controller import AuthController
 from src.database_access_layer import Database
+from src.password_hasher import PasswordHasher
 from werkzeug.security import check_password_hash, generate_password_hash
 from src.constants import *
 
@@ -52,7 +53,7 @@ class TestAuthController:
         assert result is not None
 
         assert result[USERNAME] == self.user[USERNAME]
-        assert ac._verify_password(result[USERNAME], self.user[PASSWORD])
+        assert ac.hasher.verify(result[PASSWORD], self.user[PASSWORD])
 
     # TEST-AC-ITGR-0002
     def test_register_invalid(self):
@@ -117,7 +118,8 @@ class TestAuthController:
 
         ac.register(self.user)
 
-        result = ac._verify_password(self.user[USERNAME], self.user[PASSWORD])
+        stored = ac.db.get_user_by_username(self.user[USERNAME])
+        result = ac.hasher.verify(stored[PASSWORD], self.user[PASSWORD])
 
         assert result == True
 
@@ -129,10 +131,40 @@ class TestAuthController:
 
         ac.register(self.user)
 
-        result = ac._verify_password(self.user[USERNAME], "invalid_password")
+        stored = ac.db.get_user_by_username(self.user[USERNAME])
+        result = ac.hasher.verify(stored[PASSWORD], "invalid_password")
 
         assert result == False
 
+    # TEST-AC-ITGR-0008
+    def test_login_rehashes_old_parameters(self):
+
+        old = PasswordHasher(method="pbkdf2:sha256:1000", workers=0)
+        ac = AuthController(TEST_DATABASE_PATH, hasher=old)
+        ac.db.reset_tables()
+        ac.register(self.user)
+
+        ac = AuthController(TEST_DATABASE_PATH, hasher=PasswordHasher(workers=0))
+        result = ac.login(self.user)
+        stored = ac.db.get_user_by_username(self.user[USERNAME])
+
+        assert result is not None
+        assert stored[PASSWORD].startswith("scrypt:32768:8:1$")
+        assert ac.login(self.user) == result
+
+    # TEST-AC-ITGR-0009
+    def test_register_returns_user_id(self):
+
+        ac = AuthController(TEST_DATABASE_PATH)
+        ac.db.reset_tables()
+
+        created = ac.register({USERNAME: "new_user", PASSWORD: "new_password"})
+
+        assert created[USER_ID] == ac.db.get_user_by_username("new_user")[USER_ID]
+        assert ac.login({USERNAME: "new_user", PASSWORD: "new_password"}) == (
+            created[USER_ID]
+        )
+
     # def test_register(self, auth_controller):
     #     auth_controller.register(TestAuthController.user)
     #     user_in_db = auth_controller.db.get_user_by_username(self.user["username"])
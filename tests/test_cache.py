@@ -0,0 +1,153 @@
+import pytest
+from src.cache import FeedCache, UserCache
+from src.database_access_layer import Database
+from src.post_controller import PostController, encode_cursor
+from src.constants import *
+
+
+def make_posts(pc: PostController, count: int) -> None:
+    for i in range(count):
+        pc.db.insert_post(
+            {
+                POST_ID: f"{i:03d}",
+                USER_ID: str(i % 2 + 1),
+                IMAGE_EXT: "NONE",
+                CONTENT: f"post{i}",
+                DATE: f"2026-02-15 12:{i:02d}:00",
+            }
+        )
+
+
+class TestFeedCache:
+
+    # TEST-CA-FUNC-0001
+    def test_repeat_reads_hit(self):
+
+        # initialize
+        pc = PostController(TEST_DATABASE_PATH)
+        pc.db.reset_tables()
+        make_posts(pc, 25)
+        cache = pc.db.feed_cache
+        hits = cache.hits
+
+        # compute
+        first = pc.get_posts(None, 10)
+        second = pc.get_posts(None, 10)
+
+        # assert
+        assert first == second
+        assert cache.hits == hits + 1
+
+    # TEST-CA-FUNC-0002
+    def test_writes_only_drop_affected_pages(self):
+
+        # initialize
+        pc = PostController(TEST_DATABASE_PATH)
+        pc.db.reset_tables()
+        make_posts(pc, 25)
+        cache = pc.db.feed_cache
+        page1, _ = pc.get_posts(None, 10)
+        page2, _ = pc.get_posts(encode_cursor(page1[-1]), 10)
+        page3, _ = pc.get_posts(encode_cursor(page2[-1]), 10)
+
+        # compute
+        # post 002 is on the last page, only that page changes
+        old = pc.get_post_by_id("002")
+        pc.edit_post(old, {**old, CONTENT: "edited"}, old[USER_ID])
+        entries_after_edit = cache.stats()["entries"]
+        new_page3, _ = pc.get_posts(encode_cursor(page2[-1]), 10)
+        # a new post lands on the first page only
+        pc.create_post(
+            {POST_ID: "new", USER_ID: "1", CONTENT: "newest", IMAGE_EXT: "NONE"}
+        )
+        entries_after_create = cache.stats()["entries"]
+        new_page1, _ = pc.get_posts(None, 10)
+
+        # assert
+        assert entries_after_edit == 2
+        assert [p[CONTENT] for p in new_page3 if p[POST_ID] == "002"] == ["edited"]
+        assert entries_after_create == 2
+        assert new_page1[0][CONTENT] == "newest"
+        assert pc.get_posts(encode_cursor(page1[-1]), 10) == (page2, True)
+
+    # TEST-CA-FUNC-0003
+    def test_delete_user_posts_invalidates(self):
+
+        # initialize
+        pc = PostController(TEST_DATABASE_PATH)
+        pc.db.reset_tables()
+        make_posts(pc, 6)
+        pc.get_posts(None, 10)
+
+        # compute
+        pc.db.delete_user_posts(1)
+        posts, has_more = pc.get_posts(None, 10)
+
+        # assert
+        assert [p[USER_ID] for p in posts] == [2, 2, 2]
+        assert has_more is False
+
+    # TEST-CA-FUNC-0004
+    def test_lru_eviction(self):
+
+        # initialize
+        cache = FeedCache(max_entries=2)
+        row = {POST_ID: "1", USER_ID: 1, DATE: "2026-02-15 12:00:00"}
+
+        # compute
+        for page_size in (1, 2, 3):
+            cache.put(None, page_size, [row], cache.generation)
+        stale = cache.generation
+        cache.invalidate_user(2)
+        cache.put(None, 4, [row], stale)
+
+        # assert
+        assert cache.get(None, 1) is None
+        assert cache.get(None, 3) == ([row], False)
+        assert cache.get(None, 4) is None
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["hit_rate"] == pytest.approx(1 / 3)
+
+
+class TestUserCache:
+
+    # TEST-CA-FUNC-0005
+    def test_update_and_delete_invalidate(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        db.insert_user({USER_ID: 7, USERNAME: "old", PASSWORD: "password"})
+        user = db.get_user_by_id(7)
+        db.user_cache.put(user, db.user_cache.generation)
+
+        # compute
+        cached = db.user_cache.get(7)
+        db.update_user(user, {**user, USERNAME: "new"})
+        after_update = db.user_cache.get(7)
+        db.user_cache.put(db.get_user_by_id(7), db.user_cache.generation)
+        db.delete_user(7)
+        after_delete = db.user_cache.get(7)
+
+        # assert
+        assert cached[USERNAME] == "old"
+        assert after_update is None
+        assert after_delete is None
+
+    # TEST-CA-FUNC-0006
+    def test_ttl_and_size(self):
+
+        # initialize
+        cache = UserCache(max_entries=2, ttl=60)
+        expired = UserCache(ttl=0)
+
+        # compute
+        for user_id in (1, 2, 3):
+            cache.put({USER_ID: user_id, USERNAME: f"user{user_id}"}, cache.generation)
+        expired.put({USER_ID: 1, USERNAME: "user1"}, expired.generation)
+
+        # assert
+        assert cache.get(1) is None
+        assert cache.get("3")[USERNAME] == "user3"
+        assert cache.stats()["evictions"] == 1
+        assert expired.get(1) is None
@@ -1,6 +1,18 @@
+import sqlite3
+import threading
+
 import pytest
 from src.auth_controller import AuthController
-from src.database_access_layer import Database
+from src.database_access_layer import (
+    Database,
+    ConnectionPool,
+    GroupCommitWriter,
+    MAX_IMAGE_JOB_ATTEMPTS,
+    disable_profiling,
+    enable_profiling,
+    start_profile,
+    stop_profile,
+)
 from src.constants import *
 
 
@@ -119,7 +131,7 @@ class TestDatabase:
 
         # assert
         assert result1 is None
-        assert result2[USER_ID] == "123"
+        assert result2[USER_ID] == 123
         assert result2[USERNAME] == "test_user"
         assert result2[PASSWORD] == "test_password"
 
@@ -175,7 +187,7 @@ class TestDatabase:
 
         # assert
         assert result1 is None
-        assert result2[USER_ID] == "1234"
+        assert result2[USER_ID] == 1234
         assert result2[POST_ID] == "123456789"
         assert result2[DATE] == "2026-02-15"
         assert result2[IMAGE_EXT] == "NONE"
@@ -242,7 +254,7 @@ class TestDatabase:
         result = db.get_post_by_id("123456789")
 
         # assert
-        assert result[USER_ID] == "1234"
+        assert result[USER_ID] == 1234
         assert result[POST_ID] == "123456789"
         assert result[DATE] == "2026-02-15"
         assert result[CONTENT] == "edit"
@@ -264,7 +276,7 @@ class TestDatabase:
         result = db.get_user_by_id("1234")
 
         # assert
-        assert result[USER_ID] == "1234"
+        assert result[USER_ID] == 1234
         assert result[USERNAME] == "new_user"
         assert result[PASSWORD] == "new_password"
 
@@ -307,9 +319,485 @@ class TestDatabase:
         result2 = db.get_post_by_id(post[POST_ID])
 
         # assert
-        assert result1[USER_ID] == "1234"
+        assert result1[USER_ID] == 1234
         assert result1[POST_ID] == "123456789"
         assert result1[DATE] == "2026-02-15"
         assert result1[IMAGE_EXT] == "NONE"
         assert result1[CONTENT] == "test"
         assert result2 is None
+
+    # TEST-DB-FUNC-0014
+    def test_pool_reuses_connections(self):
+
+        # initialize
+        pool = ConnectionPool(TEST_DATABASE_PATH, max_connections=2)
+        db1 = Database(pool=pool)
+        connection = db1.connection
+        db1.close()
+
+        # compute
+        db2 = Database(pool=pool)
+
+        # assert
+        assert db2.connection is connection
+        db2.close()
+        pool.close()
+
+    # TEST-DB-FUNC-0015
+    def test_pool_is_bounded(self):
+
+        # initialize
+        pool = ConnectionPool(TEST_DATABASE_PATH, max_connections=1, timeout=0.1)
+        db1 = Database(pool=pool)
+
+        # compute
+        with pytest.raises(sqlite3.OperationalError):
+            Database(pool=pool)
+        db1.close()
+        db2 = Database(pool=pool)
+
+        # assert
+        assert db2.connection is not None
+        db2.close()
+        pool.close()
+
+    # TEST-DB-FUNC-0016
+    def test_pool_rolls_back_on_release(self):
+
+        # initialize
+        pool = ConnectionPool(TEST_DATABASE_PATH, max_connections=1)
+        db = Database(pool=pool)
+        db.reset_tables()
+        db.connection.execute(
+            "INSERT INTO users (username, password) VALUES (?, ?)", ["x", "y"]
+        )
+
+        # compute
+        db.close()
+        db = Database(pool=pool)
+
+        # assert
+        assert db.connection.in_transaction is False
+        assert db.get_user_by_username("x") is None
+        db.close()
+        pool.close()
+
+    # TEST-DB-FUNC-0017
+    def test_lookups_are_exact(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        db.insert_user({USERNAME: "user11", PASSWORD: "password", USER_ID: "11"})
+        db.insert_user({USERNAME: "user", PASSWORD: "password", USER_ID: "1"})
+
+        # compute
+        by_id = db.get_user_by_id("1")
+        by_username = db.get_user_by_username("user")
+        db.delete_user("1")
+        remaining = db.get_user_by_id("11")
+
+        # assert
+        assert by_id[USERNAME] == "user"
+        assert str(by_username[USER_ID]) == "1"
+        assert remaining[USERNAME] == "user11"
+
+    # TEST-DB-FUNC-0018
+    def test_concurrent_writes(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        results = []
+
+        def insert(i):
+            results.append(
+                db.insert_post(
+                    {
+                        POST_ID: str(i),
+                        USER_ID: "1234",
+                        CONTENT: f"post{i}",
+                        IMAGE_EXT: "NONE",
+                        DATE: "2026-02-15",
+                    }
+                )
+            )
+
+        # compute
+        threads = [threading.Thread(target=insert, args=(i % 40,)) for i in range(50)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # assert
+        assert results.count(True) == 40
+        assert results.count(False) == 10
+        assert len(db.get_all_posts()) == 40
+
+    # TEST-DB-FUNC-0019
+    def test_writer_isolates_failures(self, tmp_path):
+
+        # initialize
+        writer = GroupCommitWriter(str(tmp_path / "writer.db"), batch_window=0.05)
+        writer.submit(lambda c: c.execute("CREATE TABLE t (x PRIMARY KEY)"))
+        outcomes = {}
+
+        def insert(name, value):
+            try:
+                writer.submit(lambda c: c.execute("INSERT INTO t VALUES (?)", [value]))
+                outcomes[name] = True
+            except sqlite3.IntegrityError:
+                outcomes[name] = False
+
+        # compute
+        threads = [
+            threading.Thread(target=insert, args=("a", 1)),
+            threading.Thread(target=insert, args=("b", 1)),
+            threading.Thread(target=insert, args=("c", 2)),
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        rows = writer.connection.execute("SELECT x FROM t ORDER BY x").fetchall()
+
+        # assert
+        assert sorted(outcomes.values()) == [False, True, True]
+        assert rows == [(1,), (2,)]
+
+    # TEST-DB-FUNC-0020
+    def test_read_only(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        db.insert_user({USERNAME: "user", PASSWORD: "password", USER_ID: "1234"})
+        ro = Database(TEST_DATABASE_PATH, read_only=True)
+
+        # compute
+        result = ro.get_user_by_id(1234)
+
+        # assert
+        assert result[USERNAME] == "user"
+        assert ro.delete_user(1234) is False
+        with pytest.raises(sqlite3.OperationalError):
+            ro.insert_user({USERNAME: "other", PASSWORD: "password"})
+        with pytest.raises(sqlite3.OperationalError):
+            ro.connection.execute("DELETE FROM users")
+        assert db.get_user_by_id(1234) is not None
+        ro.close()
+
+    # TEST-DB-FUNC-0021
+    def test_read_only_pool(self):
+
+        # initialize
+        Database(TEST_DATABASE_PATH).reset_tables()
+        pool = ConnectionPool(TEST_DATABASE_PATH, max_connections=2, read_only=True)
+
+        # compute
+        db = Database(pool=pool)
+
+        # assert
+        assert db.read_only is True
+        assert pool.writer is None
+        assert db.get_all_posts() == []
+        db.close()
+        pool.close()
+
+    # TEST-DB-FUNC-0022
+    def test_insert_users_bulk(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        users = (
+            {USER_ID: i, USERNAME: f"user{i}", PASSWORD: "password"}
+            for i in range(1, 251)
+        )
+
+        # compute
+        result1 = db.insert_users(users, chunk_size=100)
+        result2 = db.insert_users([{USER_ID: 1, USERNAME: "dup", PASSWORD: "x"}])
+
+        # assert
+        assert result1 == 250
+        assert result2 == 0
+        assert db.get_user_by_id(250)[USERNAME] == "user250"
+        assert db.get_user_by_id(1)[USERNAME] == "user1"
+
+    # TEST-DB-FUNC-0023
+    def test_insert_posts_bulk(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        posts = (
+            {
+                POST_ID: str(i),
+                USER_ID: "1234",
+                CONTENT: f"post{i}",
+                DATE: f"2026-02-15 12:00:{i % 60:02d}",
+            }
+            for i in range(250)
+        )
+
+        # compute
+        result = db.insert_posts(posts, chunk_size=100)
+
+        # assert
+        assert result == 250
+        assert len(db.get_all_posts()) == 250
+        assert db.get_post_by_id("7")[IMAGE_EXT] == "NONE"
+
+    # TEST-DB-FUNC-0024
+    def test_post_counters(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        db.insert_posts(
+            {
+                POST_ID: str(i),
+                USER_ID: str(i % 3 + 1),
+                CONTENT: f"post{i}",
+                DATE: f"2026-02-{15 + i % 2} 12:00:{i % 60:02d}",
+            }
+            for i in range(30)
+        )
+
+        # compute
+        db.delete_user_posts(1)
+        db.delete_post(2, "2026-02-16 12:00:01")
+
+        # assert
+        assert db.get_post_count() == 19
+        assert db.get_user_post_count(1) == 0
+        assert db.get_user_post_count(2) == 9
+        assert db.get_user_post_count(3) == 10
+        assert db.get_daily_post_count("2026-02-15") == 10
+        assert db.get_daily_post_count("2026-02-16") == 9
+        assert db.get_daily_post_count("2026-02-17") == 0
+        assert db.reconcile_counters() == []
+
+    # TEST-DB-FUNC-0025
+    def test_reconcile_counters(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        db.insert_post(
+            {
+                POST_ID: "1",
+                USER_ID: "1234",
+                CONTENT: "post",
+                IMAGE_EXT: "NONE",
+                DATE: "2026-02-15 12:00:00",
+            }
+        )
+        db.execute_write(
+            "UPDATE post_counts SET count = 5 WHERE scope = 'user' AND key = '1234'"
+        )
+        db.execute_write("INSERT INTO post_counts VALUES ('day', '2026-01-01', 2)")
+
+        # compute
+        drift = db.reconcile_counters()
+
+        # assert
+        assert sorted(drift) == [("day", "2026-01-01", 2, 0), ("user", "1234", 5, 1)]
+        assert db.get_user_post_count(1234) == 1
+        assert db.get_daily_post_count("2026-01-01") == 0
+        assert db.reconcile_counters() == []
+
+    # TEST-DB-FUNC-0026
+    def test_data_versions(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        post = {
+            POST_ID: "1",
+            USER_ID: "1234",
+            CONTENT: "post",
+            IMAGE_EXT: "NONE",
+            DATE: "2026-02-15 12:00:00",
+        }
+        start = db.get_data_versions()
+
+        # compute
+        db.insert_post(post)
+        db.update_post(post, {**post, CONTENT: "edited"}, post[USER_ID])
+        db.insert_user({USER_ID: 1234, USERNAME: "user", PASSWORD: "password"})
+        end = db.get_data_versions()
+
+        # assert
+        assert start["posts"][0] == 0 and start["users"][0] == 0
+        assert end["posts"][0] == 2
+        assert end["users"][0] == 1
+        assert end["posts"][1] >= start["posts"][1]
+
+    # TEST-DB-FUNC-0027
+    def test_image_job_lease(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        db.enqueue_image_job("images/a.png")
+        db.enqueue_image_job("images/a.png")
+
+        # compute
+        first = db.claim_image_job(lease=60)
+        while_leased = db.claim_image_job(lease=60)
+        db.execute_write("UPDATE image_jobs SET available_at = 0")
+        after_expiry = db.claim_image_job(lease=60)
+        db.complete_image_job("images/a.png")
+
+        # assert
+        assert first == {"path": "images/a.png", "attempts": 1}
+        assert while_leased is None
+        assert after_expiry == {"path": "images/a.png", "attempts": 2}
+        assert db.count_image_jobs() == {}
+
+    # TEST-DB-FUNC-0028
+    def test_image_job_fails_after_max_attempts(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        db.enqueue_image_job("images/b.png")
+
+        # compute
+        for _ in range(MAX_IMAGE_JOB_ATTEMPTS):
+            job = db.claim_image_job(lease=60)
+            db.fail_image_job(job["path"], "broken", retry_after=0)
+        failed = db.count_image_jobs()
+        db.enqueue_image_job("images/b.png")
+
+        # assert
+        assert failed == {"failed": 1}
+        assert db.count_image_jobs() == {"queued": 1}
+
+    # TEST-DB-FUNC-0029
+    def test_profile_records_queries(self, caplog):
+
+        # initialize
+        enable_profiling(slow_query_seconds=0)
+        try:
+            db = Database(TEST_DATABASE_PATH)
+            db.reset_tables()
+            db.insert_user({USERNAME: "profiled", PASSWORD: "password"})
+
+            # compute
+            caplog.clear()
+            start_profile()
+            with caplog.at_level("WARNING"):
+                user = db.get_user_by_username("profiled")
+                db.get_all_posts()
+            profile = stop_profile()
+        finally:
+            disable_profiling()
+
+        # assert
+        assert user[USERNAME] == "profiled"
+        assert profile.count == 2
+        assert [rows for _, _, rows in profile.queries] == [1, 0]
+        assert profile.total_seconds > 0
+        assert profile.traced >= 2
+        assert len([r for r in caplog.records if "slow query" in r.message]) == 2
+        assert stop_profile() is None
+
+    # TEST-DB-FUNC-0030
+    def test_create_user_returns_id(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+
+        # compute
+        first = db.create_user({USERNAME: "first", PASSWORD: "password"})
+        second = db.create_user({USERNAME: "second", PASSWORD: "password"})
+        taken = db.create_user({USER_ID: second, USERNAME: "third", PASSWORD: "pw"})
+
+        # assert
+        assert db.get_user_by_id(first)[USERNAME] == "first"
+        assert db.get_user_by_id(second)[USERNAME] == "second"
+        assert taken is None
+
+    # TEST-DB-FUNC-0031
+    def test_iter_users_and_posts(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        db.insert_users(
+            {USER_ID: i, USERNAME: f"user{i}", PASSWORD: "pw"} for i in range(1, 8)
+        )
+        db.insert_posts(
+            {
+                POST_ID: f"{i:03d}",
+                USER_ID: 1,
+                CONTENT: f"post{i}",
+                IMAGE_EXT: "NONE",
+                DATE: f"2026-02-15 12:{i // 2:02d}:00",
+            }
+            for i in range(9)
+        )
+
+        # compute
+        users = [user[USER_ID] for user in db.iter_users(page_size=3)]
+        posts = [post[POST_ID] for post in db.iter_posts(page_size=2)]
+
+        # assert
+        assert users == list(range(1, 8))
+        assert posts == [f"{i:03d}" for i in range(9)]
+
+    # TEST-DB-FUNC-0032
+    def test_profile_records_writes(self):
+
+        # initialize
+        enable_profiling()
+        try:
+            db = Database(TEST_DATABASE_PATH)
+            db.reset_tables()
+            db.enqueue_image_job("images/a.png")
+
+            # compute
+            start_profile()
+            user_id = db.create_user({USERNAME: "profiled", PASSWORD: "password"})
+            job = db.claim_image_job(lease=60)
+            db.reconcile_counters()
+            profile = stop_profile()
+        finally:
+            disable_profiling()
+            db.close()
+
+        # assert
+        assert user_id is not None and job is not None
+        assert profile.count == 3
+        assert [rows for _, _, rows in profile.queries] == [1, 1, 0]
+        # the writer's connection traced the statements it ran for this thread
+        assert profile.traced >= 5
+
+    # TEST-DB-FUNC-0033
+    def test_insert_posts_bulk_malformed_row(self):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        posts = [
+            {POST_ID: str(i), USER_ID: "1", CONTENT: "ok", DATE: "2026-02-15 12:00:00"}
+            for i in range(4)
+        ]
+        # no date, the NOT NULL constraint rejects it
+        posts.append({POST_ID: "4", USER_ID: "1", CONTENT: "no date"})
+
+        # compute
+        duplicates = db.insert_posts(posts[:2])
+        with pytest.raises(sqlite3.IntegrityError):
+            db.insert_posts(posts, chunk_size=3)
+
+        # assert
+        # the duplicates were skipped, the chunk holding the bad row was rolled back
+        assert duplicates == 2
+        assert sorted(post[POST_ID] for post in db.get_all_posts()) == ["0", "1", "2"]
+        db.close()
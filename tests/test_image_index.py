@@ -0,0 +1,45 @@
+import os
+
+from src.image_index import ImageIndex, get_image_index, invalidate_image
+
+
+class TestImageIndex:
+
+    # TEST-II-FUNC-0001
+    def test_lookup_is_cached(self, tmp_path):
+
+        # initialize
+        (tmp_path / "a.png").write_bytes(b"12345")
+        index = ImageIndex(str(tmp_path))
+
+        # compute
+        first = index.lookup("a.png")
+        os.remove(tmp_path / "a.png")
+        second = index.lookup("a.png")
+
+        # assert
+        assert first.size == 5
+        assert first.mimetype == "image/png"
+        assert second == first
+        assert index.lookup("missing.png") is None
+
+    # TEST-II-FUNC-0002
+    def test_invalidate_image(self, tmp_path):
+
+        # initialize
+        path = tmp_path / "b.jpg"
+        path.write_bytes(b"123")
+        index = get_image_index(str(tmp_path))
+        before = index.lookup("b.jpg")
+
+        # compute
+        path.write_bytes(b"123456")
+        stale = index.lookup("b.jpg")
+        invalidate_image(str(path))
+        after = index.lookup("b.jpg")
+
+        # assert
+        assert stale == before
+        assert after.size == 6
+        assert after.etag != before.etag
+        assert index.lookup(".") is None
@@ -0,0 +1,141 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from PIL import Image
+
+from src.constants import IMAGE_VARIANTS, TEST_DATABASE_PATH
+from src.database_access_layer import Database
+from src.image_queue import (
+    find_unprocessed,
+    make_variants,
+    process_next_job,
+    queue_variants,
+    start_worker,
+    stop_worker,
+    variant_filename,
+)
+
+
+class TestImageQueue:
+
+    # TEST-IQ-FUNC-0001
+    def test_make_variants(self, tmp_path):
+
+        # initialize
+        path = tmp_path / "1234.png"
+        Image.new("RGBA", (2000, 1000), (255, 0, 0, 128)).save(path)
+        original = path.read_bytes()
+
+        # compute
+        make_variants(str(path))
+
+        # assert
+        assert path.read_bytes() == original
+        for variant, box in IMAGE_VARIANTS.items():
+            with Image.open(tmp_path / variant_filename("1234.png", variant)) as image:
+                assert image.size == (box, box // 2)
+
+    # TEST-IQ-FUNC-0002
+    def test_make_variants_never_enlarges(self, tmp_path):
+
+        # initialize
+        path = tmp_path / "small.jpg"
+        Image.new("RGB", (100, 300)).save(path)
+
+        # compute
+        make_variants(str(path))
+
+        # assert
+        with Image.open(tmp_path / variant_filename("small.jpg", "full")) as image:
+            assert image.size == (100, 300)
+        with Image.open(tmp_path / variant_filename("small.jpg", "thumb")) as image:
+            assert image.size == (53, 160)
+
+    # TEST-IQ-FUNC-0003
+    def test_make_variants_in_process_pool(self, tmp_path):
+
+        # initialize
+        path = tmp_path / "5678.jpg"
+        Image.new("RGB", (800, 800)).save(path)
+
+        # compute
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            written = pool.submit(make_variants, str(path)).result()
+
+        # assert
+        assert sorted(written) == sorted(
+            str(tmp_path / variant_filename("5678.jpg", variant))
+            for variant in IMAGE_VARIANTS
+        )
+        assert all(os.path.exists(target) for target in written)
+
+    # TEST-IQ-FUNC-0004
+    def test_unknown_backend(self):
+
+        # assert
+        with pytest.raises(ValueError):
+            start_worker("gpu")
+
+    # TEST-IQ-ITGR-0001
+    def test_process_next_job(self, tmp_path):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        good = tmp_path / "good.png"
+        Image.new("RGB", (50, 50)).save(good)
+        bad = tmp_path / "bad.png"
+        bad.write_bytes(b"not an image")
+        queue_variants(str(good), db)
+        queue_variants(str(bad), db)
+
+        # compute
+        processed = [process_next_job(db) for _ in range(3)]
+
+        # assert
+        assert processed == [True, True, False]
+        assert find_unprocessed(str(tmp_path)) == [str(bad)]
+        assert db.count_image_jobs() == {"queued": 1}
+
+    # TEST-IQ-FUNC-0005
+    def test_find_unprocessed(self, tmp_path):
+
+        # initialize
+        (tmp_path / "new.jpg").write_bytes(b"")
+        (tmp_path / "done.png").write_bytes(b"")
+        for variant in IMAGE_VARIANTS:
+            (tmp_path / variant_filename("done.png", variant)).write_bytes(b"")
+        (tmp_path / "notes.txt").write_bytes(b"")
+
+        # compute
+        result = find_unprocessed(str(tmp_path))
+
+        # assert
+        assert result == [str(tmp_path / "new.jpg")]
+
+    # TEST-IQ-ITGR-0002
+    def test_process_backend_runs_jobs(self, tmp_path):
+
+        # initialize
+        db = Database(TEST_DATABASE_PATH)
+        db.reset_tables()
+        path = tmp_path / "9012.png"
+        Image.new("RGB", (1200, 600)).save(path)
+        start_worker("process", db_path=TEST_DATABASE_PATH)
+
+        # compute
+        try:
+            queue_variants(str(path), db)
+            deadline = time.monotonic() + 30
+            while db.count_image_jobs() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop_worker()
+
+        # assert
+        # the job ran in a pool process and was removed once its variants were written
+        assert db.count_image_jobs() == {}
+        assert find_unprocessed(str(tmp_path)) == []
+        db.close()
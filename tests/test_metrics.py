@@ -0,0 +1,82 @@
+from src import metrics
+from src.metrics import Counter, Histogram, instrument
+
+
+class Thing:
+    def work(self, value):
+        return value * 2
+
+    def _private(self):
+        return None
+
+
+class TestMetrics:
+
+    # TEST-ME-FUNC-0001
+    def test_histogram_render(self):
+
+        # initialize
+        histogram = Histogram("test_seconds", "test", ("route",), buckets=(0.1, 1.0))
+
+        # compute
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value, "/")
+        lines = histogram.render()
+
+        # assert
+        assert lines == [
+            "# HELP test_seconds test",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{route="/",le="0.1"} 2',
+            'test_seconds_bucket{route="/",le="1.0"} 3',
+            'test_seconds_bucket{route="/",le="+Inf"} 4',
+            'test_seconds_sum{route="/"} 5.65',
+            'test_seconds_count{route="/"} 4',
+        ]
+
+    # TEST-ME-FUNC-0002
+    def test_counter_escapes_labels(self):
+
+        # initialize
+        counter = Counter("test_total", "test", ("path",))
+
+        # compute
+        counter.inc('a"b')
+        counter.inc('a"b', amount=2)
+
+        # assert
+        assert counter.render()[-1] == 'test_total{path="a\\"b"} 3'
+        assert "# TYPE test_total counter" in metrics.render()
+
+    # TEST-ME-FUNC-0003
+    def test_instrument(self):
+
+        # initialize
+        histogram = Histogram("test_method_seconds", "test", ("method",))
+        instrument(Thing, histogram)
+
+        # compute
+        result = Thing().work(2)
+
+        # assert
+        assert result == 4
+        assert Thing.work.__name__ == "work"
+        assert 'test_method_seconds_count{method="work"} 1' in histogram.render()
+        assert not any("_private" in line for line in histogram.render())
+
+    # TEST-ME-FUNC-0004
+    def test_counter_set_total(self):
+
+        # initialize
+        counter = Counter("test_events_total", "test", ("event",))
+
+        # compute
+        counter.set_total(3, "hits")
+        counter.set_total(5, "hits")
+
+        # assert
+        assert counter.render() == [
+            "# HELP test_events_total test",
+            "# TYPE test_events_total counter",
+            'test_events_total{event="hits"} 5',
+        ]
@@ -0,0 +1,110 @@
+import sqlite3
+
+import pytest
+from src.database_access_layer import Database
+from src.migrations import migrate_legacy_schema
+from src.constants import *
+
+
+def create_legacy_database(path):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, json TEXT)")
+    connection.execute("CREATE TABLE posts (post_id TEXT PRIMARY KEY, json TEXT)")
+    connection.execute(
+        "CREATE INDEX idx_posts_date ON posts(json_extract(json, '$.date'))"
+    )
+    connection.execute(
+        "INSERT INTO users (user_id, json) VALUES (1234, ?)",
+        ['{"username": "test_user", "password": "test_password"}'],
+    )
+    for i in range(25):
+        connection.execute(
+            "INSERT INTO posts (post_id, json) VALUES (?, ?)",
+            [
+                str(i),
+                '{"user_id": "1234", "content": "post%d", "image_ext": "NONE", "date": "2026-02-%02d"}'
+                % (i, i + 1),
+            ],
+        )
+    connection.commit()
+    connection.close()
+
+
+class TestMigrations:
+
+    # TEST-MG-FUNC-0001
+    def test_migrate_legacy_schema(self, tmp_path):
+
+        # initialize
+        path = str(tmp_path / "legacy.db")
+        create_legacy_database(path)
+
+        # compute
+        result = migrate_legacy_schema(path, batch_size=10)
+        db = Database(path)
+
+        # assert
+        assert result["users"] == 1
+        assert result["posts"] == 25
+        assert db.get_user_by_username("test_user")[USER_ID] == 1234
+        assert db.get_post_by_id("3")[CONTENT] == "post3"
+        assert db.get_post_by_id("3")[USER_ID] == 1234
+        db.close()
+
+    # TEST-MG-FUNC-0002
+    def test_migrate_current_schema(self, tmp_path):
+
+        # initialize
+        path = str(tmp_path / "current.db")
+        Database(path).close()
+
+        # compute
+        result = migrate_legacy_schema(path)
+
+        # assert
+        assert result is None
+
+    # TEST-MG-FUNC-0003
+    def test_open_legacy_schema(self, tmp_path):
+
+        # initialize
+        path = str(tmp_path / "legacy.db")
+        create_legacy_database(path)
+
+        # compute / assert
+        with pytest.raises(sqlite3.OperationalError):
+            Database(path)
+
+    # TEST-MG-FUNC-0004
+    def test_migrate_counts_rejected_rows(self, tmp_path):
+
+        # initialize
+        path = str(tmp_path / "legacy.db")
+        create_legacy_database(path)
+        connection = sqlite3.connect(path)
+        connection.execute(
+            "INSERT INTO posts (post_id, json) VALUES ('no_user', ?)",
+            ['{"content": "orphan", "date": "2026-03-01"}'],
+        )
+        connection.commit()
+        connection.close()
+
+        # compute
+        result = migrate_legacy_schema(path, batch_size=10)
+        db = Database(path)
+        index_columns = [
+            row[2] for row in db.connection.execute("PRAGMA index_info(idx_posts_date)")
+        ]
+
+        # assert
+        # the post without a user_id is dropped by the NOT NULL, not counted as migrated
+        assert result == {
+            "users": 1,
+            "users_skipped": 0,
+            "posts": 25,
+            "posts_skipped": 1,
+        }
+        assert db.get_post_by_id("no_user") is None
+        # the legacy index was replaced by the new table's once the copy was done
+        assert index_columns == ["date", "post_id"]
+        db.close()
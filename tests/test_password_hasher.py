@@ -0,0 +1,112 @@
+import os
+import signal
+
+import pytest
+
+from src.password_hasher import HasherBusy, PasswordHasher, normalise_method
+
+
+class TestPasswordHasher:
+
+    # TEST-PH-FUNC-0001
+    def test_hash_and_verify_in_pool(self):
+
+        # initialize
+        hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=1)
+
+        # compute
+        try:
+            pwhash = hasher.hash("password")
+            right = hasher.verify(pwhash, "password")
+            wrong = hasher.verify(pwhash, "not the password")
+        finally:
+            hasher.close()
+
+        # assert
+        assert pwhash.startswith("pbkdf2:sha256:1000$")
+        assert right is True
+        assert wrong is False
+
+    # TEST-PH-FUNC-0002
+    def test_full_queue_is_rejected(self):
+
+        # initialize
+        hasher = PasswordHasher(workers=0, queue_limit=1)
+        hasher._slots.acquire()
+
+        # compute
+        with pytest.raises(HasherBusy):
+            hasher.hash("password")
+        hasher._slots.release()
+        pwhash = hasher.hash("password")
+
+        # assert
+        assert hasher.verify(pwhash, "password")
+
+    # TEST-PH-FUNC-0003
+    def test_needs_rehash(self):
+
+        # initialize
+        hasher = PasswordHasher(method="scrypt", workers=0)
+
+        # compute
+        current = hasher.hash("password")
+        old = PasswordHasher(method="pbkdf2:sha256:1000", workers=0).hash("password")
+
+        # assert
+        assert normalise_method("scrypt") == "scrypt:32768:8:1"
+        assert normalise_method("pbkdf2:sha512") == "pbkdf2:sha512:1000000"
+        assert not hasher.needs_rehash(current)
+        assert hasher.needs_rehash(old)
+
+    # TEST-PH-FUNC-0004
+    def test_zero_queue_limit_is_unbounded(self):
+
+        # initialize
+        hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=0, queue_limit=0)
+
+        # compute
+        hashes = [hasher.hash("password") for _ in range(3)]
+
+        # assert
+        assert hasher._slots is None
+        assert all(hasher.verify(pwhash, "password") for pwhash in hashes)
+
+    # TEST-PH-FUNC-0005
+    def test_start_launches_workers(self):
+
+        # initialize
+        hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=2)
+
+        # compute
+        try:
+            hasher.start()
+            processes = len(hasher._executor._processes)
+            pwhash = hasher.hash("password")
+        finally:
+            hasher.close()
+
+        # assert
+        assert processes == 2
+        assert pwhash.startswith("pbkdf2:sha256:1000$")
+
+    # TEST-PH-FUNC-0006
+    def test_broken_pool_is_replaced(self):
+
+        # initialize
+        hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=1)
+        hasher.start()
+        broken = hasher._executor
+        for pid in broken._processes:
+            os.kill(pid, signal.SIGKILL)
+
+        # compute
+        try:
+            pwhash = hasher.hash("password")
+            replaced = hasher._executor
+        finally:
+            hasher.close()
+
+        # assert
+        assert pwhash.startswith("pbkdf2:sha256:1000$")
+        assert replaced is not broken
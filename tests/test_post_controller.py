@@ -1,5 +1,11 @@
 import pytest
-from src.post_controller import PostController
+from src.post_controller import (
+    PostController,
+    encode_cursor,
+    decode_cursor,
+    encode_search_cursor,
+    fts_query,
+)
 from src.database_access_layer import Database
 from src.constants import *
 from werkzeug.security import check_password_hash, generate_password_hash
@@ -141,7 +147,7 @@ class TestPostController:
         pc.create_post(post2)
         pc.create_post(post3)
 
-        result, _ = pc.get_posts(1)
+        result, _ = pc.get_posts()
 
         # assert
         assert len(result) == 3
@@ -169,3 +175,188 @@ class TestPostController:
 
         # assert
         assert result == "user"
+
+    # TEST-PC-ITGR-0005
+    def test_get_posts_cursor(self):
+
+        # initialize
+        pc = PostController(TEST_DATABASE_PATH)
+        pc.db.reset_tables()
+
+        for i in range(25):
+            pc.db.insert_post(
+                {
+                    POST_ID: f"{i:03d}",
+                    USER_ID: "1234",
+                    IMAGE_EXT: "NONE",
+                    CONTENT: f"post{i}",
+                    DATE: f"2026-02-15 12:{i // 2:02d}:00",
+                }
+            )
+
+        # compute
+        pages = []
+        before = None
+        while True:
+            page, has_more = pc.get_posts(before, 10)
+            pages.append(page)
+            if not has_more:
+                break
+            before = encode_cursor(page[-1])
+
+        # assert
+        seen = [p[POST_ID] for page in pages for p in page]
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert seen == [f"{i:03d}" for i in reversed(range(25))]
+
+    # TEST-PC-FUNC-0004
+    def test_decode_cursor(self):
+
+        # initialize
+        post = {POST_ID: "123456789", DATE: "2026-02-15 12:30:28"}
+
+        # compute
+        result = decode_cursor(encode_cursor(post))
+
+        # assert
+        assert result == ("2026-02-15 12:30:28", "123456789")
+        with pytest.raises(ValueError):
+            decode_cursor("not a cursor")
+
+    # TEST-PC-ITGR-0006
+    def test_search_posts(self):
+
+        # initialize
+        pc = PostController(TEST_DATABASE_PATH)
+        pc.db.reset_tables()
+
+        for i in range(25):
+            pc.db.insert_post(
+                {
+                    POST_ID: f"{i:03d}",
+                    USER_ID: "1234",
+                    IMAGE_EXT: "NONE",
+                    CONTENT: f"cats and dogs {i}" if i % 2 else f"only dogs {i}",
+                    DATE: f"2026-02-15 12:{i // 2:02d}:00",
+                }
+            )
+        old = pc.get_post_by_id("001")
+        pc.edit_post(old, {**old, CONTENT: "birds"}, old[USER_ID])
+        pc.delete_post(1234, pc.get_post_by_id("003")[DATE])
+
+        # compute
+        pages = []
+        after = None
+        while True:
+            page, has_more = pc.search_posts("cats", after, 5)
+            pages.append(page)
+            if not has_more:
+                break
+            after = encode_search_cursor(page[-1])
+        birds, _ = pc.search_posts("birds")
+
+        # assert
+        found = sorted(p[POST_ID] for page in pages for p in page)
+        assert found == [f"{i:03d}" for i in range(5, 25, 2)]
+        assert [len(page) for page in pages] == [5, 5]
+        assert [p[POST_ID] for p in birds] == ["001"]
+
+    # TEST-PC-FUNC-0005
+    def test_fts_query(self):
+
+        # initialize
+        text = 'cats "OR dogs* NEAR('
+
+        # compute
+        result = fts_query(text)
+
+        # assert
+        assert result == '"cats" "OR" "dogs" "NEAR"'
+        assert fts_query("  !! ") is None
+        assert PostController(TEST_DATABASE_PATH).search_posts("!!") == ([], False)
+
+    # TEST-PC-ITGR-0007
+    def test_get_user_posts_cursor(self):
+
+        # initialize
+        pc = PostController(TEST_DATABASE_PATH)
+        pc.db.reset_tables()
+
+        for i in range(15):
+            pc.db.insert_post(
+                {
+                    POST_ID: f"{i:03d}",
+                    USER_ID: "1234" if i % 3 else "5678",
+                    IMAGE_EXT: "NONE",
+                    CONTENT: f"post{i}",
+                    DATE: f"2026-02-15 12:{i // 2:02d}:00",
+                }
+            )
+
+        # compute
+        pages = []
+        before = None
+        while True:
+            page, has_more = pc.get_user_posts("1234", before, 4)
+            pages.append(page)
+            if not has_more:
+                break
+            before = encode_cursor(page[-1])
+
+        # assert
+        seen = [p[POST_ID] for page in pages for p in page]
+        assert [len(page) for page in pages] == [4, 4, 2]
+        assert seen == [f"{i:03d}" for i in reversed(range(15)) if i % 3]
+
+    # TEST-PC-ITGR-0008
+    def test_stream_posts(self):
+
+        # initialize
+        pc = PostController(TEST_DATABASE_PATH)
+        pc.db.reset_tables()
+
+        for i in range(15):
+            pc.db.insert_post(
+                {
+                    POST_ID: f"{i:03d}",
+                    USER_ID: "1234",
+                    IMAGE_EXT: "NONE",
+                    CONTENT: f"post{i}",
+                    DATE: f"2026-02-15 12:{i:02d}:00",
+                }
+            )
+
+        # compute
+        hits = pc.db.feed_cache.stats()["hits"]
+        page = pc.stream_posts(None, 10)
+        known_before = page.has_more
+        streamed = [p[POST_ID] for p in page]
+        cached = pc.stream_posts(None, 10)
+        from_cache = [p[POST_ID] for p in cached]
+        last = [p[POST_ID] for p in pc.stream_posts(page.next_cursor, 10)]
+
+        # assert
+        assert known_before is False
+        assert streamed == [f"{i:03d}" for i in reversed(range(5, 15))]
+        assert page.has_more and page.next_cursor == encode_cursor(
+            {POST_ID: "005", DATE: "2026-02-15 12:05:00"}
+        )
+        assert from_cache == streamed and cached.has_more
+        assert pc.db.feed_cache.stats()["hits"] == hits + 1
+        assert last == [f"{i:03d}" for i in reversed(range(5))]
+
+    # TEST-PC-FUNC-0006
+    def test_get_srcset(self):
+
+        # initialize
+        pc = PostController(TEST_DATABASE_PATH)
+        post = {POST_ID: "42", IMAGE_EXT: ".png"}
+
+        # compute
+        result = pc.get_srcset(post)
+
+        # assert
+        # densities relative to the feed sized src, the thumbnail is never the sharper pick
+        assert result == (
+            "/get_image/42.png?size=feed 1x, /get_image/42.png?size=full 2.5x"
+        )
@@ -0,0 +1,186 @@
+import itertools
+import re
+
+import pytest
+from src.database_access_layer import Database
+from src.post_controller import PostController, encode_cursor, encode_search_cursor
+from src.constants import *
+
+ROWS = 100_000
+
+# a plain "SCAN posts" walks the whole table, "SCAN posts USING INDEX ..." is an ordered
+# index walk that stops at the LIMIT so it is allowed
+FULL_SCAN = re.compile(r"^SCAN \w+$")
+# users.user_id is the rowid, so this also shows as "SCAN users" but walks the table in
+# order and stops at the LIMIT
+ROWID_WALK = re.compile(r"FROM users ORDER BY user_id LIMIT")
+# data_versions only ever holds a row each for users and posts
+SMALL_TABLE = "SCAN data_versions"
+SORT = "USE TEMP B-TREE"
+
+
+@pytest.fixture(scope="module")
+def big_database(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("plans") / "plans.db")
+    db = Database(path)
+    db.connection.executemany(
+        "INSERT INTO users (user_id, username, password) VALUES (?, ?, ?)",
+        ((i, f"user{i}", "password") for i in range(1, ROWS + 1)),
+    )
+    db.connection.executemany(
+        "INSERT INTO posts (post_id, user_id, content, image_ext, date) VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                str(i),
+                i % 1000 + 1,
+                f"post{i}",
+                "NONE",
+                f"2026-01-01 00:{i // 3600 % 60:02d}:{i % 60:02d}.{i:06d}",
+            )
+            for i in range(ROWS)
+        ),
+    )
+    db.connection.commit()
+    db.connection.execute("ANALYZE")
+    yield db
+    db.close()
+
+
+def capture_plans(db: Database, call) -> list[tuple[str, str]]:
+    """Runs call with statement tracing on and returns (statement, plan step) pairs"""
+    statements = []
+    # writes run on the group commit writer's connection, so trace both
+    connections = (db.connection, db._writer.connection)
+    for connection in connections:
+        connection.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        for connection in connections:
+            connection.set_trace_callback(None)
+
+    plans = []
+    for statement in statements:
+        if (
+            not statement.lstrip()
+            .upper()
+            .startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE"))
+        ):
+            continue
+        for row in db.connection.execute("EXPLAIN QUERY PLAN " + statement):
+            plans.append((statement, row[3]))
+    return plans
+
+
+class TestQueryPlans:
+
+    # TEST-QP-PERF-0001
+    def test_no_full_scans(self, big_database):
+
+        # initialize
+        db = big_database
+        pc = PostController(db=db)
+        post = db.get_post_by_id("500")
+        user = db.get_user_by_id(500)
+        calls = {
+            "get_user_by_username": lambda: db.get_user_by_username("user500"),
+            "get_user_by_id": lambda: db.get_user_by_id(500),
+            "get_post_by_date": lambda: db.get_post_by_date(post[DATE]),
+            "get_post_by_id": lambda: db.get_post_by_id("500"),
+            "get_all_posts": db.get_all_posts,
+            "iter_users": lambda: list(itertools.islice(db.iter_users(10), 15)),
+            "iter_posts": lambda: list(itertools.islice(db.iter_posts(10), 15)),
+            "get_post_count": db.get_post_count,
+            "get_user_post_count": lambda: db.get_user_post_count(500),
+            "get_daily_post_count": lambda: db.get_daily_post_count("2026-01-01"),
+            "get_data_versions": db.get_data_versions,
+            "get_posts": lambda: pc.get_posts(),
+            "get_posts_before": lambda: pc.get_posts(encode_cursor(post)),
+            "get_user_posts": lambda: pc.get_user_posts("501"),
+            "get_user_posts_before": lambda: pc.get_user_posts(
+                "501", encode_cursor(post)
+            ),
+            "insert_user": lambda: db.insert_user(
+                {USERNAME: "new_user", PASSWORD: "password"}
+            ),
+            "insert_post": lambda: db.insert_post(
+                {
+                    POST_ID: "new_post",
+                    USER_ID: "1",
+                    CONTENT: "new",
+                    IMAGE_EXT: "NONE",
+                    DATE: "2027-01-01 00:00:00",
+                }
+            ),
+            "update_post": lambda: db.update_post(
+                post, {**post, CONTENT: "edited"}, post[USER_ID]
+            ),
+            "update_user": lambda: db.update_user(user, {**user, USERNAME: "renamed"}),
+            "delete_post": lambda: db.delete_post(post[USER_ID], post[DATE]),
+            "delete_user_posts": lambda: db.delete_user_posts(777),
+            "delete_user": lambda: db.delete_user(777),
+            "enqueue_image_job": lambda: db.enqueue_image_job("images/new.png"),
+            "claim_image_job": lambda: db.claim_image_job(60),
+            "fail_image_job": lambda: db.fail_image_job("images/new.png", "e", 0),
+            "complete_image_job": lambda: db.complete_image_job("images/new.png"),
+            "count_image_jobs": db.count_image_jobs,
+        }
+
+        # compute
+        regressions = []
+        for name, call in calls.items():
+            for statement, step in capture_plans(db, call):
+                if ROWID_WALK.search(statement) or step == SMALL_TABLE:
+                    continue
+                if FULL_SCAN.match(step) or SORT in step:
+                    regressions.append(f"{name}: {step} <- {statement.strip()}")
+
+        # assert
+        assert regressions == []
+
+    # TEST-QP-PERF-0002
+    def test_search_uses_fts_index(self, big_database):
+
+        # initialize
+        db = big_database
+        pc = PostController(db=db)
+        first, _ = pc.search_posts("post600", page_size=1)
+
+        # compute
+        steps = [
+            step
+            for call in (
+                lambda: pc.search_posts("post600"),
+                lambda: pc.search_posts("post600", encode_search_cursor(first[0])),
+            )
+            for _, step in capture_plans(db, call)
+        ]
+
+        # assert
+        # the sort only ever sees the rows the index matched, never the whole table
+        assert first[0][POST_ID] == "600"
+        assert "SCAN s VIRTUAL TABLE INDEX 0:M1" in steps
+        assert [step for step in steps if FULL_SCAN.match(step)] == []
+        assert all("SCAN p" not in step for step in steps)
+
+    # TEST-QP-PERF-0003
+    def test_reconcile_reads_posts_through_indexes(self, big_database):
+
+        # initialize
+        db = big_database
+
+        # compute
+        steps = [step for _, step in capture_plans(db, db.reconcile_counters)]
+
+        # assert
+        # a recount reads every post, but only ever from a covering index
+        posts_steps = [step for step in steps if step.startswith("SCAN posts")]
+        assert posts_steps and all("COVERING INDEX" in step for step in posts_steps)
+        # counters and actual counts are matched by key, never by walking the other side
+        assert "SEARCH c USING PRIMARY KEY (scope=? AND key=?) LEFT-JOIN" in steps
+        assert not [step for step in steps if "CORRELATED" in step]
+        assert "SCAN a LEFT-JOIN" not in steps
+        # the only sort groups the posts by day, in the drift check and in the rewrite
+        assert [step for step in steps if SORT in step] == [
+            "USE TEMP B-TREE FOR GROUP BY"
+        ] * 2
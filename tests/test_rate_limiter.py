@@ -0,0 +1,120 @@
+import pytest
+
+from src.rate_limiter import (
+    LIMITS,
+    Limit,
+    SQLiteRateLimiter,
+    TokenBucketLimiter,
+    _limit,
+    check_limits,
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestRateLimiter:
+
+    # TEST-RL-FUNC-0001
+    def test_bucket_empties_and_refills(self):
+
+        # initialize
+        clock = FakeClock()
+        limiter = TokenBucketLimiter(clock=clock)
+        limit = Limit(capacity=3, rate=1)
+
+        # compute
+        burst = [limiter.acquire("test", "a", limit) for _ in range(4)]
+        other_key = limiter.acquire("test", "b", limit)
+        clock.now += 1.5
+        refilled = [limiter.acquire("test", "a", limit) for _ in range(2)]
+
+        # assert
+        assert burst == [0, 0, 0, 1.0]
+        assert other_key == 0
+        assert refilled == [0, 0.5]
+
+    # TEST-RL-FUNC-0002
+    def test_buckets_are_bounded(self):
+
+        # initialize
+        limiter = TokenBucketLimiter(max_keys=2, clock=FakeClock())
+        limit = Limit(capacity=1, rate=0.001)
+
+        # compute
+        limiter.acquire("test", "a", limit)
+        limiter.acquire("test", "b", limit)
+        limiter.acquire("test", "c", limit)
+
+        # assert
+        assert list(limiter._buckets) == [("test", "b"), ("test", "c")]
+        # the dropped bucket starts full again
+        assert limiter.acquire("test", "a", limit) == 0
+
+    # TEST-RL-ITGR-0001
+    def test_sqlite_buckets_are_shared(self, tmp_path):
+
+        # initialize
+        clock = FakeClock()
+        path = str(tmp_path / "limits.db")
+        first = SQLiteRateLimiter(path, clock=clock)
+        second = SQLiteRateLimiter(path, clock=clock)
+        limit = Limit(capacity=2, rate=1)
+
+        # compute
+        results = [
+            first.acquire("test", "a", limit),
+            second.acquire("test", "a", limit),
+            first.acquire("test", "a", limit),
+        ]
+        clock.now += 1
+        after_refill = second.acquire("test", "a", limit)
+
+        # assert
+        assert results == [0, 0, 1.0]
+        assert after_refill == 0
+
+    # TEST-RL-FUNC-0003
+    def test_denied_request_spends_no_tokens(self):
+
+        # initialize
+        limiter = TokenBucketLimiter(clock=FakeClock())
+        for _ in range(LIMITS["login_ip"].capacity):
+            limiter.acquire("login_ip", "10.0.0.1")
+        before = dict(limiter._buckets)
+
+        # compute
+        wait = check_limits(
+            ("login_ip", "10.0.0.1"), ("login_user", "alice"), limiter=limiter
+        )
+
+        # assert
+        assert wait > 0
+        # the username's bucket was never created, let alone drained
+        assert limiter._buckets == before
+        assert limiter.peek("login_user", "alice") == 0
+
+    # TEST-RL-FUNC-0004
+    def test_limits_from_environment(self, monkeypatch):
+
+        # initialize
+        monkeypatch.setenv("RATE_LIMIT_REGISTER_IP", "50/3600")
+        monkeypatch.setenv("RATE_LIMIT_POST_IP", "0/60")
+        monkeypatch.setenv("RATE_LIMIT_LOGIN_IP", "lots")
+
+        # compute
+        configured = _limit("register_ip", 5, 3600)
+        turned_off = _limit("post_ip", 30, 60)
+        default = _limit("post_user", 10, 60)
+
+        # assert
+        assert configured == Limit(capacity=50, rate=50 / 3600)
+        assert turned_off is None
+        assert default == Limit(capacity=10, rate=10 / 60)
+        with pytest.raises(ValueError):
+            _limit("login_ip", 20, 60)